@@ -0,0 +1,236 @@
+# annindex.py
+"""
+基于 NumPy 的 IVF（倒排文件）近似最近邻索引，用于归一化的 CLIP 特征（内积 = 余弦相似度）。
+
+训练：球面 k-means 得到 nlist 个聚类中心；入库：每条向量归入最近的中心，按列表连续存放
+（add 可分块多次调用，各块先暂存，首次查询或保存时一次性按列表写入）；
+查询：只扫描与查询最相近的 nprobe 个列表。每条向量带一个分组号（所属文章），
+可以只在某篇文章内检索（精确），也可以找出跨文章的近重复项。
+"""
+from __future__ import annotations
+import math
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+NPROBE = 8
+KMEANS_ITERS = 10
+SAMPLES_PER_LIST = 64  # 每个聚类中心的训练样本数
+FLUSH_ROWS = 65536     # 合并暂存块时每次写入的行数
+
+
+def _topk(scores: np.ndarray, k: int) -> np.ndarray:
+    """返回一维 scores 中最大的 k 个下标（降序）"""
+    if k >= len(scores):
+        return np.argsort(-scores)
+    idx = np.argpartition(-scores, k - 1)[:k]
+    return idx[np.argsort(-scores[idx])]
+
+
+class FeatureBuffer:
+    """
+    按块追加特征的可增长数组（默认 float16，内存为 float32 的一半），
+    避免先把每篇文章的 float32 特征攒成列表、再整体拼接一次。
+    """
+
+    def __init__(self, dtype=np.float16, capacity: int = 4096):
+        self.dtype = dtype
+        self.capacity = capacity
+        self._data: Optional[np.ndarray] = None
+        self._size = 0
+
+    def append(self, x: np.ndarray):
+        if self._data is None:
+            self._data = np.empty((max(self.capacity, len(x)), x.shape[1]), dtype=self.dtype)
+        elif self._size + len(x) > len(self._data):  # 容量翻倍，均摊每行只复制常数次
+            grown = np.empty((max(2 * len(self._data), self._size + len(x)), self._data.shape[1]), dtype=self.dtype)
+            grown[:self._size] = self._data[:self._size]
+            self._data = grown
+        self._data[self._size:self._size + len(x)] = x
+        self._size += len(x)
+
+    @property
+    def array(self) -> np.ndarray:
+        """已写入部分的视图（不复制）"""
+        return self._data[:self._size] if self._data is not None else np.empty((0, 0), dtype=self.dtype)
+
+    def __len__(self):
+        return self._size
+
+
+class IVFIndex:
+    def __init__(self, nlist: Optional[int] = None, nprobe: int = NPROBE, dtype=np.float32):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.dtype = dtype  # float16 可省一半内存，但 NumPy 的 float16 矩阵乘法慢得多
+        self.centroids: Optional[np.ndarray] = None
+        # 按倒排列表排好序的向量、原始编号、分组号，以及每个列表的起止位置
+        self.vectors = self.ids = self.groups = self.offsets = None
+        # 按分组排序的行号，用于分组内精确检索
+        self._group_order = self._group_keys = self._group_offsets = None
+        # add 暂存的 (向量, 原始编号, 分组号, 所属列表)，首次使用时由 _flush 合并
+        self._pending: List[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = []
+
+    # ---------------- 训练 ----------------
+    def train(self, x: np.ndarray, seed: int = 0):
+        """在（抽样的）x 上做球面 k-means"""
+        rng = np.random.default_rng(seed)
+        n = len(x)
+        self.nlist = self.nlist or max(1, min(65536, int(4 * math.sqrt(n))))
+        self.nlist = min(self.nlist, n)
+        sample = x[rng.choice(n, min(n, self.nlist * SAMPLES_PER_LIST), replace=False)].astype(np.float32)
+        centroids = sample[rng.choice(len(sample), self.nlist, replace=False)].copy()
+        for _ in range(KMEANS_ITERS):
+            assign = self._assign(sample, centroids)
+            order = np.argsort(assign, kind="stable")
+            counts = np.bincount(assign, minlength=self.nlist)
+            empty = counts == 0
+            sums = np.zeros_like(centroids)
+            sums[~empty] = np.add.reduceat(sample[order], np.cumsum(counts)[~empty] - counts[~empty])
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]  # 空簇重新随机初始化
+            centroids = sums / np.linalg.norm(sums, axis=1, keepdims=True).clip(1e-12)
+        self.centroids = centroids
+        return self
+
+    @staticmethod
+    def _assign(x: np.ndarray, centroids: np.ndarray, chunk: int = 65536) -> np.ndarray:
+        out = np.empty(len(x), dtype=np.int64)
+        for start in range(0, len(x), chunk):
+            out[start:start + chunk] = (x[start:start + chunk].astype(np.float32) @ centroids.T).argmax(axis=1)
+        return out
+
+    # ---------------- 入库 ----------------
+    def add(self, x: np.ndarray, ids: Optional[np.ndarray] = None, groups: Optional[np.ndarray] = None):
+        """
+        写入一块向量，可多次调用。这里只计算所属列表并暂存 x 的引用（调用方在首次查询前不要修改 x），
+        所有块在首次查询 / 保存时由 _flush 一次性按列表写入，总代价与向量总数线性相关。
+        ids 默认按写入顺序从已有条数开始编号。
+        """
+        if self.centroids is None:
+            self.train(x)
+        n_before = len(self)
+        ids = np.arange(n_before, n_before + len(x)) if ids is None else np.asarray(ids)
+        groups = np.full(len(x), -1) if groups is None else np.asarray(groups)
+        self._pending.append((x, ids, groups, self._assign(x, self.centroids)))
+        return self
+
+    def _flush(self):
+        """把已有数据和暂存块按列表散布到新数组中：每块只排序自身，不对全体重新排序"""
+        if not self._pending:
+            return
+        chunks = self._pending
+        if self.vectors is not None:
+            old_assign = np.repeat(np.arange(self.nlist), np.diff(self.offsets))
+            chunks.insert(0, (self.vectors, self.ids, self.groups, old_assign))
+        counts = sum(np.bincount(assign, minlength=self.nlist) for _, _, _, assign in chunks)
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        total, dim = int(offsets[-1]), chunks[-1][0].shape[1]
+        vectors = np.empty((total, dim), dtype=self.dtype)
+        ids = np.empty(total, dtype=np.result_type(*(c[1] for c in chunks)))
+        groups = np.empty(total, dtype=np.result_type(*(c[2] for c in chunks)))
+        filled = offsets[:-1].copy()  # 每个列表的下一个写入位置
+        while chunks:
+            x, chunk_ids, chunk_groups, assign = chunks.pop(0)  # 写完即释放对该块的引用
+            order = np.argsort(assign, kind="stable")
+            sorted_assign = assign[order]
+            chunk_counts = np.bincount(assign, minlength=self.nlist)
+            chunk_starts = np.concatenate([[0], np.cumsum(chunk_counts)[:-1]])
+            dest = np.empty(len(order), dtype=np.int64)
+            dest[order] = filled[sorted_assign] + np.arange(len(order)) - chunk_starts[sorted_assign]
+            for start in range(0, len(x), FLUSH_ROWS):  # 分段写入，避免整块的临时副本
+                vectors[dest[start:start + FLUSH_ROWS]] = x[start:start + FLUSH_ROWS]
+            ids[dest] = chunk_ids
+            groups[dest] = chunk_groups
+            filled += chunk_counts
+        self.vectors, self.ids, self.groups, self.offsets = vectors, ids, groups, offsets
+        self._build_group_table()
+
+    def _build_group_table(self):
+        self._group_order = np.argsort(self.groups, kind="stable")
+        keys, starts = np.unique(self.groups[self._group_order], return_index=True)
+        self._group_keys = keys
+        self._group_offsets = np.append(starts, len(self.groups))
+
+    def _group_rows(self, group) -> np.ndarray:
+        pos = np.searchsorted(self._group_keys, group)
+        if pos >= len(self._group_keys) or self._group_keys[pos] != group:
+            return np.empty(0, dtype=np.int64)
+        return self._group_order[self._group_offsets[pos]:self._group_offsets[pos + 1]]
+
+    def __len__(self):
+        return (0 if self.ids is None else len(self.ids)) + sum(len(c[1]) for c in self._pending)
+
+    # ---------------- 查询 ----------------
+    def _probe_rows(self, lists: np.ndarray) -> np.ndarray:
+        """lists 中各列表的行号依次拼接：由列表起止位置一次算出，不逐个列表生成 arange"""
+        lists = np.asarray(lists).ravel()
+        starts = self.offsets[lists]
+        lens = self.offsets[lists + 1] - starts
+        return np.repeat(starts - (np.cumsum(lens) - lens), lens) + np.arange(int(lens.sum()))
+
+    def search(self, queries: np.ndarray, k: int = 5, groups: Optional[np.ndarray] = None,
+               nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        查询 [Q, D] 的 top-k，返回 (scores [Q, k], ids [Q, k])，不足 k 个时以 -inf / -1 填充。
+        groups 不为 None 时，第 i 个查询只在分组 groups[i] 内精确检索。
+        """
+        self._flush()
+        queries = np.asarray(queries, dtype=np.float32)
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        if groups is None:  # 一次矩阵乘法选出所有查询要扫描的列表，再一次取出全部候选行号
+            probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+            all_rows = self._probe_rows(probes)
+            bounds = np.concatenate([[0], np.cumsum((self.offsets[probes + 1] - self.offsets[probes]).sum(axis=1))])
+        for i, q in enumerate(queries):
+            rows = self._group_rows(groups[i]) if groups is not None else all_rows[bounds[i]:bounds[i + 1]]
+            if not len(rows):
+                continue
+            s = self.vectors[rows] @ q.astype(self.dtype)
+            top = _topk(s, k)
+            scores[i, :len(top)] = s[top]
+            ids[i, :len(top)] = self.ids[rows[top]]
+        return scores, ids
+
+    def near_duplicates(self, threshold: float = 0.95, k: int = 10,
+                        nprobe: Optional[int] = None) -> List[Tuple[int, int, float]]:
+        """
+        找出不同分组之间余弦相似度 ≥ threshold 的向量对 (id_a, id_b, score)，id_a < id_b。
+        每条向量只在自己所在的列表及 nprobe 个近邻列表中找 top-k，整体复杂度与 N 近似线性。
+        """
+        self._flush()
+        nprobe = min(nprobe or 1, self.nlist)
+        pairs = {}
+        for l in range(self.nlist):
+            start, end = self.offsets[l], self.offsets[l + 1]
+            if start == end:
+                continue
+            block = self.vectors[start:end]
+            rows = self._probe_rows(_topk(self.centroids @ self.centroids[l], nprobe))
+            s = block @ self.vectors[rows].T  # [列表大小, 候选数]
+            for i in range(len(block)):
+                top = _topk(s[i], min(k + 1, len(rows)))
+                for t in top[s[i, top] >= threshold]:
+                    j = rows[t]
+                    if self.groups[start + i] == self.groups[j]:
+                        continue
+                    a, b = sorted((int(self.ids[start + i]), int(self.ids[j])))
+                    pairs[(a, b)] = float(s[i, t])
+        return sorted(((a, b, sc) for (a, b), sc in pairs.items()), key=lambda t: -t[2])
+
+    # ---------------- 保存 / 读取 ----------------
+    def save(self, path: str):
+        self._flush()
+        np.savez(path, centroids=self.centroids, vectors=self.vectors, ids=self.ids,
+                 groups=self.groups, offsets=self.offsets, nprobe=self.nprobe)
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        data = np.load(path)
+        index = cls(nlist=len(data["centroids"]), nprobe=int(data["nprobe"]), dtype=data["vectors"].dtype)
+        index.centroids = data["centroids"]
+        index.vectors, index.ids = data["vectors"], data["ids"]
+        index.groups, index.offsets = data["groups"], data["offsets"]
+        index._build_group_table()
+        return index
@@ -0,0 +1,49 @@
+# articleutil.py
+"""
+clip_match_1 输入目录（<root>/<文章>/<文章>.txt 和 <root>/<文章>/图片/）的读取，
+clip_match_1、clip_match_global、neardup 等脚本共用同一套段落切分和图片列表规则。
+只依赖标准库，不加载模型。
+"""
+from __future__ import annotations
+import os
+import re
+from typing import Iterator, List, Tuple
+
+IMAGE_FOLDER = "图片"
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def split_paragraphs(content):
+    """按空行切分段落并去除空白段落"""
+    # 使用双换行 '\n\n' 进行初步分割
+    paragraphs = re.split(r'\n\s*\n', content)
+
+    return [para.strip() for para in paragraphs if para.strip()]  # 去除空白段落
+
+
+def list_images(image_folder: str) -> List[str]:
+    """图片文件夹中 clip_match_1 处理的图片（按文件名排序）"""
+    return sorted([os.path.join(image_folder, img) for img in os.listdir(image_folder) if
+                   img.endswith(IMAGE_EXTENSIONS)])
+
+
+def iter_articles(root_folder: str, require_text: bool = True) -> Iterator[Tuple[str, List[str], List[str]]]:
+    """
+    流式读取每篇文章，产出 (文章名, 段落列表, 图片路径列表)。
+    require_text 为 True 时跳过没有 <文章>.txt 的文章并打印警告，为 False 时段落列表为空
+    """
+    with os.scandir(root_folder) as entries:
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            txt_file = os.path.join(entry.path, f"{entry.name}.txt")
+            image_folder = os.path.join(entry.path, IMAGE_FOLDER)
+            paragraphs = []
+            if os.path.exists(txt_file):
+                with open(txt_file, "r", encoding="utf-8") as f:
+                    paragraphs = split_paragraphs(f.read())
+            elif require_text:
+                print(f"警告: 找不到文章内容文件 '{txt_file}'")
+                continue
+            image_paths = list_images(image_folder) if os.path.isdir(image_folder) else []
+            yield entry.name, paragraphs, image_paths
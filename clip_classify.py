@@ -1,61 +1,69 @@
 import os
 import torch
-import cn_clip.clip as clip
-from PIL import Image, UnidentifiedImageError
-from cn_clip.clip import load_from_name
 import shutil
-
-# 设置设备
-device = "cuda" if torch.cuda.is_available() else "cpu"
-
-# 加载模型
-model, preprocess = load_from_name("ViT-B-16", device=device, download_root='./')
-model.eval()
+from cliputil import DEVICE as device, MODEL_NAME as model_name, auto_batch_size, encode_categories, \
+    encode_image_paths, get_model, model_id, throughput_report
+from featcache import FeatureCache
+from metrics import run
+from results import ResultsWriter, run_results_path
 
 # 定义类别名称
 categories =["数据统计图","流程路线图","实物示例图"]
 
-# 将类别名称转换为 CLIP 文本特征
-category_tokens = clip.tokenize(categories).to(device)
-with torch.no_grad():
-    category_features = model.encode_text(category_tokens)
-    category_features /= category_features.norm(dim=-1, keepdim=True)  # 归一化
+# 提示模板：每个类别用多条提示编码后取平均（提示集成），"{}" 处填入类别名
+prompt_templates = ["{}", "一张{}的图片", "这是一张{}", "论文中的{}", "{}的截图"]
 
 input_folder = r"D:\move11\分类前"
 output_folder = r"D:\move11\分类图片"
-os.makedirs(output_folder, exist_ok=True)
+cache_folder = r"./clip_cache"  # 特征缓存目录
 
 # 设置相似度阈值
 similarity_threshold = 0.3
 
-# 遍历文件夹中的所有图片文件
-for img_name in os.listdir(input_folder):
-    img_path = os.path.join(input_folder, img_name)
-
-    # 检查文件是否为有效图片
-    try:
-        img = Image.open(img_path)
-        image_input = preprocess(img).unsqueeze(0).to(device)
-    except UnidentifiedImageError:
-        print(f"警告: 无法处理图像文件 '{img_path}': 图片无法识别")
-        continue  # 跳过无法处理的文件
-    except Exception as e:
-        print(f"警告: 无法处理图像文件 '{img_path}': {e}")
-        continue  # 跳过其他异常文件
-
-    # 计算图像特征
-    with torch.no_grad():
-        image_feature = model.encode_image(image_input)
-        image_feature /= image_feature.norm(dim=-1, keepdim=True)  # 归一化
+# 每次读取/查缓存的图片数
+chunk_size = 1024
+
+# 分类模式："single" 为原来的单标签 softmax + 复制图片；"multi" 为两级多标签，只输出一个标签表
+mode = "single"
+
+# 两级类别体系（粗类 -> 细类）；细类只对通过粗类阈值的图片计算
+taxonomy = {
+    "数据统计图": ["柱状图", "折线图", "饼图", "散点图", "表格"],
+    "流程路线图": ["流程图", "技术路线图", "结构示意图"],
+    "实物示例图": ["实物照片", "显微图像", "设备照片"],
+}
+
+# 多标签模式的阈值是图文余弦相似度（不是 softmax 概率）；未列出的类别使用 default_class_threshold，
+# 细类可用 "粗类/细类" 单独设置
+default_class_threshold = 0.25
+class_thresholds = {}
+
+results_format = "jsonl"  # 标签表格式："jsonl" 或 "parquet"（需要 pyarrow）
+
+
+def classify_paths(model, preprocess, img_paths, category_features, cache, batch_size):
+    """按块读取缓存或编码图片并与类别特征比较，逐张产出 (图片路径, 最佳类别下标, 最高相似度)"""
+    for start in range(0, len(img_paths), chunk_size):
+        # 计算图像特征（无法识别的文件会被跳过）
+        image_features, valid_paths = encode_image_paths(model, preprocess, img_paths[start:start + chunk_size],
+                                                         cache, batch_size, device)
+        if image_features is None:
+            continue
 
         # 计算图像与类别的相似度
-        similarities = torch.matmul(image_feature, category_features.T)
-        probs = similarities.softmax(dim=-1).cpu().numpy()
+        with torch.no_grad():
+            similarities = torch.matmul(image_features, category_features.T)
+            probs = similarities.softmax(dim=-1).cpu().numpy()
+
+        # 找到相似度最高的类别
+        best_match_idxs = probs.argmax(axis=-1)
+        for img_path, image_probs, best_match_idx in zip(valid_paths, probs, best_match_idxs):
+            yield img_path, best_match_idx, image_probs[best_match_idx]
 
-    # 找到相似度最高的类别
-    best_match_idx = probs.argmax()
-    best_category = categories[best_match_idx]
-    best_similarity = probs[0][best_match_idx]  # 最高相似度
+
+def save_classified(img_path, best_category, best_similarity, output_folder, similarity_threshold, verbose=True):
+    """相似度超过阈值时把图片复制到输出目录（文件名追加类别），返回新路径；否则返回 None"""
+    img_name = os.path.basename(img_path)
 
     # 如果相似度超过阈值，则保存图片
     if best_similarity > similarity_threshold:
@@ -65,8 +73,115 @@ for img_name in os.listdir(input_folder):
 
         # 复制图片并重命名到新的文件夹
         shutil.copy(img_path, new_img_path)
-        print(f"图片 '{img_name}' 分类为 '{best_category}'（相似度: {best_similarity*100:.2f}%)，已保存为 '{new_img_name}'")
-    else:
+        if verbose:
+            print(f"图片 '{img_name}' 分类为 '{best_category}'（相似度: {best_similarity*100:.2f}%)，已保存为 '{new_img_name}'")
+        return new_img_path
+    if verbose:
         print(f"图片 '{img_name}' 相似度低于阈值（{best_similarity*100:.2f}%)，未保存")
+    return None
+
+
+def label_schema(pa):
+    return pa.schema([("image", pa.string()), ("labels", pa.list_(pa.string())),
+                      ("scores", pa.list_(pa.float32()))])
+
+
+def taxonomy_features(model, cache, taxonomy=taxonomy):
+    """
+    编码两级类别体系，返回 (粗类名, 粗类特征 [C, D], 粗类阈值 [C], 细类列表)；
+    细类列表与粗类一一对应，每项为 (带粗类前缀的细类名, 细类特征 [F, D], 细类阈值 [F])，没有细类时为 None
+    """
+    coarse = list(taxonomy)
+    coarse_features = encode_categories(model, coarse, prompt_templates, cache, device)
+    coarse_thresholds = torch.tensor([class_thresholds.get(c, default_class_threshold) for c in coarse],
+                                     device=device)
+    fine = []
+    for c in coarse:
+        if not taxonomy[c]:
+            fine.append(None)
+            continue
+        names = [f"{c}/{f}" for f in taxonomy[c]]
+        fine.append((names, encode_categories(model, taxonomy[c], prompt_templates, cache, device),
+                     torch.tensor([class_thresholds.get(n, default_class_threshold) for n in names], device=device)))
+    return coarse, coarse_features, coarse_thresholds, fine
+
+
+def multilabel_rows(image_features, img_paths, coarse, coarse_features, coarse_thresholds, fine):
+    """
+    对整块图片特征 [N, D] 做矩阵运算：先一次算出所有粗类相似度并按各自阈值过滤，
+    再对每个粗类只取通过的图片行计算其细类。返回每张图片一行的 {image, labels, scores}
+    """
+    labels = [[] for _ in img_paths]
+    scores = [[] for _ in img_paths]
+
+    def collect(rows, cols, sims, names):
+        for r, c, sim in zip(rows.tolist(), cols.tolist(), sims.tolist()):
+            labels[r].append(names[c])
+            scores[r].append(round(sim, 4))
+
+    with torch.no_grad():
+        sims = image_features @ coarse_features.T  # [N, C]
+        passed = sims >= coarse_thresholds
+        rows, cols = passed.nonzero(as_tuple=True)
+        collect(rows, cols, sims[rows, cols], coarse)
+        for j, level in enumerate(fine):
+            sel = passed[:, j].nonzero(as_tuple=True)[0]
+            if level is None or not len(sel):
+                continue
+            names, fine_features, fine_thresholds = level
+            fine_sims = image_features[sel] @ fine_features.T  # [通过粗类 j 的图片数, F]
+            rows, cols = (fine_sims >= fine_thresholds).nonzero(as_tuple=True)
+            collect(sel[rows], cols, fine_sims[rows, cols], names)
+    return [{"image": p, "labels": l, "scores": s} for p, l, s in zip(img_paths, labels, scores)]
+
+
+def main_multilabel(input_folder=input_folder, output_folder=output_folder):
+    """多标签模式：不复制图片，所有结果写入一个标签表"""
+    model, preprocess = get_model(model_name, device)
+    cache = FeatureCache(cache_folder, model_id(model, model_name))
+    coarse, coarse_features, coarse_thresholds, fine = taxonomy_features(model, cache)
+    batch_size = auto_batch_size(device)
+
+    img_paths = [os.path.join(input_folder, name) for name in os.listdir(input_folder)]
+    labelled = 0
+    with ResultsWriter(run_results_path(output_folder, "labels", results_format), label_schema) as writer:
+        for start in range(0, len(img_paths), chunk_size):
+            image_features, valid_paths = encode_image_paths(model, preprocess, img_paths[start:start + chunk_size],
+                                                             cache, batch_size, device)
+            if image_features is None:
+                continue
+            rows = multilabel_rows(image_features, valid_paths, coarse, coarse_features, coarse_thresholds, fine)
+            labelled += sum(1 for r in rows if r["labels"])
+            writer.write_rows(rows)
+    cache.close()
+    print(throughput_report())
+    print(f"共 {writer.count} 张图片，其中 {labelled} 张至少有一个标签；标签表: '{writer.path}'")
+
+
+def main(input_folder=input_folder, output_folder=output_folder, similarity_threshold=similarity_threshold):
+    # 加载模型（进程内只加载一次；设置 CLIP_SERVER 时使用常驻模型服务）
+    model, preprocess = get_model(model_name, device)
+    os.makedirs(output_folder, exist_ok=True)
+
+    # 特征缓存：调整阈值后重跑时不再重新编码图片
+    cache = FeatureCache(cache_folder, model_id(model, model_name))
+
+    # 类别特征（提示集成、已归一化）；类别和模板不变时直接读取缓存的类别矩阵
+    category_features = encode_categories(model, categories, prompt_templates, cache, device)
+
+    # 图像编码批大小，按可用内存自动设置
+    batch_size = auto_batch_size(device)
+
+    # 遍历文件夹中的所有图片文件
+    img_paths = [os.path.join(input_folder, name) for name in os.listdir(input_folder)]
+    for img_path, best_match_idx, best_similarity in classify_paths(model, preprocess, img_paths,
+                                                                    category_features, cache, batch_size):
+        save_classified(img_path, categories[best_match_idx], best_similarity, output_folder, similarity_threshold)
+
+    cache.close()
+    print(throughput_report())
+    print("所有图片处理完成。")
+
 
-print("所有图片处理完成。")
+if __name__ == "__main__":
+    run(main_multilabel if mode == "multi" else main)
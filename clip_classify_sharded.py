@@ -0,0 +1,189 @@
+'''
+多进程分片版 clip_classify：按文件名哈希把输入目录分成 N 片，每个进程加载自己的模型并批量编码，
+各分片的结果先写入 labels.shard<i>.jsonl，正常结束的分片合并到 labels.jsonl，并输出总体 张/秒。
+异常退出的分片保留 labels.shard<i>.jsonl；重新运行时先把它们并入 labels.jsonl，已有标签的图片不再处理。
+所有进程共用 clip_classify 的特征缓存（SQLite WAL），与单进程版、不同的分片数之间都能互相命中。
+clip_classify.mode = "multi" 时每个分片按 taxonomy 做两级多标签打分（同 clip_classify.main_multilabel，不复制图片），
+结果文件为 multilabels.shard<i>.jsonl / multilabels.jsonl，每行 {image, labels, scores}，与单标签结果分开续跑。
+'''
+import glob
+import json
+import multiprocessing as mp
+import os
+import queue
+import time
+import zlib
+
+import torch
+
+import cliputil
+import clip_classify
+from clip_classify import categories, chunk_size, classify_paths, multilabel_rows, prompt_templates, \
+    save_classified, taxonomy_features
+from cliputil import DEVICE as device, MODEL_NAME as model_name, auto_batch_size, encode_categories, \
+    encode_image_paths, get_model, model_id, throughput_report
+from featcache import FeatureCache
+from metrics import run
+
+input_folder = clip_classify.input_folder
+output_folder = clip_classify.output_folder
+cache_folder = clip_classify.cache_folder
+
+num_workers = os.cpu_count() or 4   # 分片 / 进程数；CPU 机器上默认用满所有核
+report_every = 1000                 # 每个分片每处理多少张图片汇报一次进度
+
+# 各模式的结果文件名：<stem>.shard<i>.jsonl 合并到 <stem>.jsonl
+MANIFEST_STEMS = {"single": "labels", "multi": "multilabels"}
+
+
+def shard_of(name, num_shards):
+    """稳定的分片号（不受 PYTHONHASHSEED 影响），同一文件每次都落在同一分片"""
+    return zlib.crc32(name.encode("utf-8")) % num_shards
+
+
+def shard_manifest_path(output_folder, shard, stem="labels"):
+    return os.path.join(output_folder, f"{stem}.shard{shard}.jsonl")
+
+
+def read_labelled(path):
+    """结果文件中已有标签的图片路径；崩溃时写了一半的末行被忽略"""
+    labelled = set()
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    labelled.add(json.loads(line)["image"])
+                except (json.JSONDecodeError, KeyError):
+                    continue
+    return labelled
+
+
+def single_records(model, preprocess, img_paths, cache, batch_size, output_folder, similarity_threshold):
+    """单标签：softmax 最佳类别，超过阈值时复制图片，逐张产出结果行"""
+    category_features = encode_categories(model, categories, prompt_templates, cache, device)
+    for img_path, best_match_idx, best_similarity in classify_paths(model, preprocess, img_paths,
+                                                                    category_features, cache, batch_size):
+        saved = save_classified(img_path, categories[best_match_idx], best_similarity, output_folder,
+                                similarity_threshold, verbose=False)
+        yield {"image": img_path, "category": categories[best_match_idx],
+               "similarity": round(float(best_similarity), 4), "saved": saved}
+
+
+def multilabel_records(model, preprocess, img_paths, cache, batch_size):
+    """多标签：与 clip_classify.main_multilabel 相同的两级打分，逐张产出 {image, labels, scores}"""
+    coarse, coarse_features, coarse_thresholds, fine = taxonomy_features(model, cache)
+    for start in range(0, len(img_paths), chunk_size):
+        image_features, valid_paths = encode_image_paths(model, preprocess, img_paths[start:start + chunk_size],
+                                                         cache, batch_size, device)
+        if image_features is None:
+            continue
+        yield from multilabel_rows(image_features, valid_paths, coarse, coarse_features, coarse_thresholds, fine)
+
+
+def _worker(shard, num_shards, mode, input_folder, output_folder, similarity_threshold, threads, progress,
+            merged_path):
+    """子进程：只处理 shard_of(文件名) == shard 且在 merged_path 中还没有标签的图片"""
+    torch.set_num_threads(threads)
+    cliputil.DECODE_WORKERS = threads
+    model, preprocess = get_model(model_name, device)
+
+    cache = FeatureCache(cache_folder, model_id(model, model_name))
+    batch_size = auto_batch_size(device, fraction=0.25 / num_shards)
+
+    labelled = read_labelled(merged_path)
+    with os.scandir(input_folder) as entries:
+        img_paths = [e.path for e in entries if e.is_file() and shard_of(e.name, num_shards) == shard
+                     and e.path not in labelled]
+    progress.put(("progress", shard, 0, len(img_paths)))
+
+    if mode == "multi":
+        records = multilabel_records(model, preprocess, img_paths, cache, batch_size)
+    else:
+        records = single_records(model, preprocess, img_paths, cache, batch_size, output_folder,
+                                 similarity_threshold)
+    start = time.perf_counter()
+    n = 0
+    # 行缓冲：异常退出时已写出的结果不会丢失
+    with open(shard_manifest_path(output_folder, shard, MANIFEST_STEMS[mode]), "w", encoding="utf-8",
+              buffering=1) as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            n += 1
+            if n % report_every == 0:
+                progress.put(("progress", shard, n, len(img_paths)))
+    cache.close()
+    progress.put(("done", shard, n, time.perf_counter() - start, throughput_report()))
+
+
+def merge_manifests(merged_path, paths):
+    """把分片结果追加到合并文件后删除分片文件（只保留完整的行），返回合并的行数"""
+    n = 0
+    with open(merged_path, "a", encoding="utf-8") as out:
+        for path in paths:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.endswith("\n"):
+                        out.write(line)
+                        n += 1
+            os.remove(path)
+    return n
+
+
+def main(input_folder=input_folder, output_folder=output_folder, num_workers=num_workers,
+         similarity_threshold=clip_classify.similarity_threshold, mode=clip_classify.mode):
+    if mode not in MANIFEST_STEMS:
+        raise ValueError(f"未知的分类模式 '{mode}'，可选 single / multi")
+    stem = MANIFEST_STEMS[mode]
+    os.makedirs(output_folder, exist_ok=True)
+    threads = max(1, (os.cpu_count() or 1) // num_workers)
+
+    # 上次异常退出的分片留下的结果先并入合并文件（分片数可能不同），这些图片不再处理
+    merged_path = os.path.join(output_folder, f"{stem}.jsonl")
+    leftovers = sorted(glob.glob(os.path.join(glob.escape(output_folder), f"{stem}.shard*.jsonl")))
+    if leftovers:
+        print(f"并入上次未完成分片的 {merge_manifests(merged_path, leftovers)} 条结果")
+
+    # torch 与 fork 混用可能死锁，统一用 spawn（Windows 上也只支持 spawn）
+    ctx = mp.get_context("spawn")
+    progress = ctx.Queue()
+    # mode 显式传给子进程：spawn 出的进程重新导入 clip_classify，看不到父进程里修改过的 mode
+    procs = [ctx.Process(target=_worker, args=(shard, num_workers, mode, input_folder, output_folder,
+                                               similarity_threshold, threads, progress, merged_path))
+             for shard in range(num_workers)]
+    start = time.perf_counter()
+    for p in procs:
+        p.start()
+
+    finished, failed, total = set(), set(), 0
+    while len(finished) + len(failed) < num_workers:
+        try:
+            msg = progress.get(timeout=1)
+        except queue.Empty:
+            # 子进程异常退出时不会发送 done 消息
+            for shard, p in enumerate(procs):
+                if shard not in finished and shard not in failed and p.exitcode not in (None, 0):
+                    print(f"分片 {shard} 异常退出（exitcode={p.exitcode}）")
+                    failed.add(shard)
+            continue
+        if msg[0] == "progress":
+            _, shard, done, count = msg
+            print(f"分片 {shard}: {done}/{count}")
+        else:
+            _, shard, done, seconds, report = msg
+            finished.add(shard)
+            total += done
+            print(f"分片 {shard} 完成: {done} 张, {seconds:.1f} 秒；{report}")
+    for p in procs:
+        p.join()
+
+    # 只合并正常结束的分片；异常退出的分片保留结果文件，便于查看，下次运行时并入并从断点继续
+    merge_manifests(merged_path, [shard_manifest_path(output_folder, s, stem) for s in sorted(finished)])
+    elapsed = time.perf_counter() - start
+    print(f"共 {total} 张图片, {elapsed:.1f} 秒, {total / elapsed if elapsed else 0:.1f} 张/秒；结果已合并到 '{merged_path}'")
+    if failed:
+        kept = [shard_manifest_path(output_folder, s, stem) for s in sorted(failed)]
+        print(f"警告: 分片 {sorted(failed)} 未完成，结果保留在 {kept}；重新运行会跳过已有标签的图片")
+
+
+if __name__ == "__main__":
+    run(main)
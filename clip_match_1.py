@@ -1,42 +1,116 @@
-import torch
-import cn_clip.clip as clip
-from PIL import Image, UnidentifiedImageError
-from cn_clip.clip import load_from_name
+import json
 import os
-import re
 import shutil
+import time
 
-# 设置设备
-device = "cuda" if torch.cuda.is_available() else "cpu"
+import numpy as np
 
-# 加载模型
-model, preprocess = load_from_name("ViT-B-16", device=device, download_root='./')
-model.eval()
+from articleutil import list_images, split_paragraphs
+from cliputil import DEVICE as device, MODEL_NAME as model_name, TEXT_POOL as text_pool, auto_batch_size, \
+    encode_image_paths, encode_texts, get_model, model_id, score_topk, throughput_report
+from exportutil import export_matched_pairs
+from featcache import FeatureCache
+from metrics import run
+from journal import Journal
+from neardup import load_representatives
+from results import ResultsWriter, match_rows, run_results_path
 
 # 设置文件路径
 root_folder = r"D:\move11\result"  # 顶层 result 文件夹路径
 output_folder = r"D:\move11\配对结果"  # 保存配对结果的文件夹
-os.makedirs(output_folder, exist_ok=True)
+cache_folder = r"./clip_cache"  # 特征缓存目录
+
+# 运行日志：记录每篇文章的处理状态，重启时跳过已完成的文章
+manifest_name = "manifest.jsonl"  # 保存在 output_folder 下
+
+# 匹配结果：每次运行写一个结果文件（jsonl；改为 "parquet" 需要安装 pyarrow）
+results_format = "jsonl"
+top_k = 3           # 每张图片保留的候选段落数
+min_score = None    # 余弦相似度下限，低于该值的候选不写入结果；None 表示不过滤
+export_pairs = False  # 是否额外按旧方式为每张图片保存图片 + .txt
+export_format = None  # 导出图片的格式；None 保持原格式（不转码），"png" 等则统一转码
+export_link = True    # 格式不变时优先用硬链接/reflink 代替复制
+
+# 全部处理完后是否删除已完成的文章文件夹（原先每篇处理完立即删除）
+delete_processed = False
+
+# neardup.py 生成的近重复簇文件（None 不使用）：近重复图片直接复用代表图片的特征，不再解码编码
+neardup_clusters = None
+
+# pdfextract 写出的 figures.jsonl：找到图注的图片只在图注段落和引用 "图N" 的段落中排序；
+# 所有图片都有候选段落时只编码这些段落。没有该文件或设为 False 时在全部段落中排序
+use_figure_links = True
+figures_name = "figures.jsonl"
+
+
+def encode_with_representatives(model, preprocess, image_paths, cache, batch_size, representatives):
+    """近重复图片换成其代表图片编码（每个代表只编码一次），再按原图片顺序取回特征"""
+    rep_of = {p: r for p in image_paths if (r := representatives.get(p)) and os.path.exists(r)}
+    unique_paths = list(dict.fromkeys(rep_of.get(p, p) for p in image_paths))
+    features, valid_paths = encode_image_paths(model, preprocess, unique_paths, cache, batch_size, device)
+    if features is None or not rep_of:
+        return features, valid_paths
+    row = {p: i for i, p in enumerate(valid_paths)}
+    kept = [p for p in image_paths if rep_of.get(p, p) in row]
+    return features[[row[rep_of.get(p, p)] for p in kept]], kept
+
+
+def load_figure_links(article_path, n_paragraphs):
+    """读取 figures.jsonl，返回 {图片文件名: 候选段落下标}；没有图注的图片不在其中"""
+    path = os.path.join(article_path, figures_name)
+    if not os.path.exists(path):
+        return {}
+    links = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            cand = [i for i in record.get("paragraphs") or [] if 0 <= i < n_paragraphs]
+            if cand:
+                links[record["image"]] = cand
+    return links
+
+
+def score_with_links(model, image_features, image_paths, paragraphs, cache, links):
+    """按图注链接打分：所有图片都有候选段落时只编码被引用的段落，返回的段落下标仍按全文编号"""
+    candidates = [links.get(os.path.basename(p)) for p in image_paths]
+    if links and all(candidates):
+        needed = sorted({i for cand in candidates for i in cand})
+        local = {i: n for n, i in enumerate(needed)}
+        text_features = encode_texts(model, [paragraphs[i] for i in needed], cache, device, window_pool=text_pool)
+        scores, probs, idx = score_topk(image_features, text_features, top_k,
+                                        [[local[i] for i in cand] for cand in candidates])
+        return scores, probs, np.asarray(needed)[idx]
+    text_features = encode_texts(model, paragraphs, cache, device, window_pool=text_pool)
+    return score_topk(image_features, text_features, top_k, candidates if links else None)
+
+
+def article_fingerprint(article_path):
+    """文章目录、<文章>.txt 和 图片/ 的修改时间；解析步骤补齐文件后会改变，被跳过的文章据此重新处理"""
+    fingerprint = []
+    for path in (article_path, os.path.join(article_path, f"{os.path.basename(article_path)}.txt"),
+                 os.path.join(article_path, "图片")):
+        try:
+            fingerprint.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            fingerprint.append(None)
+    return fingerprint
 
-# 迭代每个文章文件夹
-for article_folder in os.listdir(root_folder):
-    article_path = os.path.join(root_folder, article_folder)
-    if not os.path.isdir(article_path):
-        continue  # 如果不是文件夹，跳过
 
+def process_article(article_folder, article_path, output_folder, model, preprocess, cache, batch_size, writer,
+                    representatives=None):
+    """匹配一篇文章的图片与段落，返回 (状态, 附加字段) 写入运行日志"""
     # 读取文章内容
     txt_file = os.path.join(article_path, f"{article_folder}.txt")
     if not os.path.exists(txt_file):
         print(f"警告: 找不到文章内容文件 '{txt_file}'")
-        continue
+        return "skipped", {"reason": "找不到文章内容文件"}
 
     with open(txt_file, "r", encoding="utf-8") as f:
         content = f.read()
 
-    # 使用双换行 '\n\n' 进行初步分割
-    paragraphs = re.split(r'\n\s*\n', content)
-
-    paragraphs = [para.strip() for para in paragraphs if para.strip()]  # 去除空白段落
+    paragraphs = split_paragraphs(content)
 
     print(f"文章 '{article_folder}' 共分割出 {len(paragraphs)} 个段落。")
 
@@ -44,81 +118,108 @@ for article_folder in os.listdir(root_folder):
     image_folder = os.path.join(article_path, "图片")
     if not os.path.exists(image_folder):
         print(f"警告: 找不到图片文件夹 '{image_folder}'")
-        continue
+        return "skipped", {"reason": "找不到图片文件夹"}
 
     # 加载文件夹中的所有图片
-    image_paths = sorted([os.path.join(image_folder, img) for img in os.listdir(image_folder) if
-                          img.endswith(('.png', '.jpg', '.jpeg'))])
+    image_paths = list_images(image_folder)
 
-    # 使用列表存储预处理后的图像和有效路径
-    images = []
-    valid_image_paths = []
-    for image_path in image_paths:
-        try:
-            img = Image.open(image_path)
-            images.append(preprocess(img).unsqueeze(0).to(device))
-            valid_image_paths.append(image_path)  # 只添加有效的路径
-        except UnidentifiedImageError:
-            print(f"警告: 无法处理图像文件 '{image_path}': 图片无法识别")
-            continue
-        except Exception as e:
-            print(f"警告: 无法处理图像文件 '{image_path}': {e}")
-            continue
+    # 读取缓存或编码图片，得到归一化特征矩阵和有效路径
+    if representatives:
+        image_features, valid_image_paths = encode_with_representatives(model, preprocess, image_paths, cache,
+                                                                        batch_size, representatives)
+    else:
+        image_features, valid_image_paths = encode_image_paths(model, preprocess, image_paths, cache,
+                                                               batch_size, device)
 
     # 如果没有有效图片，跳过处理
-    if not images:
+    if image_features is None:
         print(f"警告: 图片文件夹 '{image_folder}' 中没有找到有效图片")
-        continue
-
-    # 计算每张图片与所有段落的相似度
-    text_tokens = clip.tokenize(paragraphs).to(device)
-
-    with torch.no_grad():
-        # 提取文本特征
-        text_features = model.encode_text(text_tokens)
-        text_features /= text_features.norm(dim=-1, keepdim=True)  # 归一化
-
-        # 使用 zip 同时迭代有效图像和路径
-        for image, image_path in zip(images, valid_image_paths):
-            image_feature = model.encode_image(image)
-            image_feature /= image_feature.norm(dim=-1, keepdim=True)  # 归一化
-
-            # 计算相似度
-            similarities = torch.matmul(image_feature, text_features.T)
-            probs = similarities.softmax(dim=-1).cpu().numpy()
-
-            # 找到相似度最高的段落
-            best_match_idx = probs.argmax()
-            best_match_prob = probs[0, best_match_idx]
+        return "skipped", {"reason": "没有有效图片"}
+
+    # 提取文本特征（已归一化），一次矩阵运算得到每张图片的 top-k 段落（余弦相似度 + softmax 概率）；
+    # 有图注链接的图片只在候选段落中排序
+    links = load_figure_links(article_path, len(paragraphs)) if use_figure_links else {}
+    scores, probs, idx = score_with_links(model, image_features, valid_image_paths, paragraphs, cache, links)
+    rows = match_rows(article_folder, valid_image_paths, paragraphs, scores, probs, idx, min_score)
+    writer.write_rows(rows)
+
+    for image_path, image_probs, image_idx in zip(valid_image_paths, probs, idx):
+        # 输出匹配结果
+        print(f"图片 '{image_path}' 与段落 {image_idx[0] + 1} 的相似度概率: {image_probs[0]:.4f}")
+
+    outputs = []
+    if export_pairs:
+        outputs = export_matched_pairs(article_folder, output_folder, valid_image_paths, rows,
+                                       export_format, export_link)
+
+    return "done", {"images": len(valid_image_paths), "paragraphs": len(paragraphs),
+                    "linked": sum(os.path.basename(p) in links for p in valid_image_paths),
+                    "results": writer.path, "outputs": outputs}
+
+
+def delete_finished_articles(root_folder, journal):
+    """删除运行日志中状态为 done 且仍然存在的文章文件夹"""
+    for article_folder, record in journal.records.items():
+        article_path = os.path.join(root_folder, article_folder)
+        if record["status"] != "done" or not os.path.isdir(article_path):
+            continue
+        try:
+            shutil.rmtree(article_path)  # 删除整个文件夹及其内容
+            print(f"已删除文件夹 '{article_path}'")
+        except Exception as e:
+            print(f"删除文件夹 '{article_path}' 时出错: {e}")
+
+
+def main(root_folder=root_folder, output_folder=output_folder, delete_processed=delete_processed):
+    # 加载模型（进程内只加载一次；设置 CLIP_SERVER 时使用常驻模型服务）
+    model, preprocess = get_model(model_name, device)
+    os.makedirs(output_folder, exist_ok=True)
+
+    # 特征缓存：重跑或崩溃后重启时跳过已编码的图片和段落
+    cache = FeatureCache(cache_folder, model_id(model, model_name))
+
+    # 图像编码批大小，按可用内存自动设置，也可手动指定
+    batch_size = auto_batch_size(device)
+
+    journal = Journal(os.path.join(output_folder, manifest_name), key="article")
+    representatives = load_representatives(neardup_clusters, "image", root_folder) if neardup_clusters else None
+    writer = ResultsWriter(run_results_path(output_folder, fmt=results_format))
+    skipped = 0
+
+    # 流式迭代每个文章文件夹，已完成的文章直接跳过；被跳过（缺少文件等）的文章在目录有变化后重新处理
+    with os.scandir(root_folder) as entries:
+        for entry in entries:
+            if not entry.is_dir():
+                continue  # 如果不是文件夹，跳过
+            record = journal.get(entry.name)
+            fingerprint = article_fingerprint(entry.path)
+            if journal.is_finished(entry.name) or (record and record["status"] == "skipped"
+                                                   and record.get("fingerprint") == fingerprint):
+                skipped += 1
+                continue
 
-            # 输出匹配结果
-            print(f"图片 '{image_path}' 与段落 {best_match_idx + 1} 的相似度概率: {best_match_prob:.4f}")
+            start = time.perf_counter()
+            try:
+                status, fields = process_article(entry.name, entry.path, output_folder,
+                                                 model, preprocess, cache, batch_size, writer, representatives)
+            except Exception as e:
+                print(f"处理文章 '{entry.name}' 时出错: {e}")
+                status, fields = "failed", {"error": repr(e)}
+            journal.append(entry.name, status, seconds=round(time.perf_counter() - start, 3),
+                           fingerprint=fingerprint, **fields)
 
-            # 创建目录以保存配对结果
-            match_folder = os.path.join(output_folder, article_folder)
-            os.makedirs(match_folder, exist_ok=True)
+    print(f"跳过 {skipped} 篇已在运行日志中完成（或跳过后没有变化）的文章。")
 
-            # 保存配对结果到指定文件夹
-            output_image_path = os.path.join(match_folder,
-                                             f"{article_folder}_{valid_image_paths.index(image_path) + 1}.png")
-            output_text_path = os.path.join(match_folder,
-                                            f"{article_folder}_{valid_image_paths.index(image_path) + 1}.txt")
+    # 可选的收尾步骤：删除已完成的文章文件夹
+    if delete_processed:
+        delete_finished_articles(root_folder, journal)
 
-            # 保存图片
-            try:
-                original_image = Image.open(image_path)  # 使用原始路径
-                original_image.save(output_image_path)
-            except Exception as e:
-                print(f"保存图片时出错 '{image_path}' 到 '{output_image_path}': {e}")
-                continue
+    writer.close()
+    print(f"共写入 {writer.count} 条匹配结果到 '{writer.path}'")
+    journal.close()
+    cache.close()
+    print(throughput_report())
 
-            # 保存匹配的段落文本
-            with open(output_text_path, "w", encoding="utf-8") as f:
-                f.write(paragraphs[best_match_idx])
 
-    # 删除已经处理过的文章文件夹
-    try:
-        shutil.rmtree(article_path)  # 删除整个文件夹及其内容
-        print(f"已删除文件夹 '{article_path}'")
-    except Exception as e:
-        print(f"删除文件夹 '{article_path}' 时出错: {e}")
+if __name__ == "__main__":
+    run(main)
@@ -1,120 +1,106 @@
-import torch
-
-import cn_clip.clip as clip
-from PIL import Image, UnidentifiedImageError
-from cn_clip.clip import load_from_name
 import os
 import re
 import pandas as pd
+from cliputil import DEVICE as device, MODEL_NAME as model_name, TEXT_POOL as text_pool, auto_batch_size, \
+    encode_image_paths, encode_texts, get_model, model_id, score_topk, throughput_report
+from exportutil import export_matched_pairs
+from featcache import FeatureCache
+from metrics import run
+from results import ResultsWriter, match_rows, run_results_path
+
+# Excel 文件（文章内容）、图片目录与保存配对结果的文件夹
+excel_path = r"D:\move11\esult.xlsx"
+image_root = r"D:\move11\csdn\csdn\图片"  # 每篇文章的图片在 image_root/<标题> 下
+output_folder = r"D:\move11\配对结果"
+cache_folder = r"./clip_cache"  # 特征缓存目录
 
-# 设置设备
-device = "cuda" if torch.cuda.is_available() else "cpu"
+# 匹配结果：每次运行写一个结果文件（jsonl；改为 "parquet" 需要安装 pyarrow）
+results_format = "jsonl"
+top_k = 3           # 每张图片保留的候选段落数
+min_score = None    # 余弦相似度下限，低于该值的候选不写入结果；None 表示不过滤
+export_pairs = False  # 是否额外按旧方式为每张图片保存图片 + .txt
+export_format = None  # 导出图片的格式；None 保持原格式（不转码），"png" 等则统一转码
+export_link = True    # 格式不变时优先用硬链接/reflink 代替复制
 
-# 加载模型
-model, preprocess = load_from_name("ViT-B-16", device=device, download_root='./')
-model.eval()
 
-# 加载Excel文件中的文章内容
-excel_path = r"D:\move11\esult.xlsx"
-df = pd.read_excel(excel_path)
+def main(excel_path=excel_path, image_root=image_root, output_folder=output_folder):
+    # 加载模型（进程内只加载一次；设置 CLIP_SERVER 时使用常驻模型服务）
+    model, preprocess = get_model(model_name, device)
 
-# 创建保存配对结果的文件夹
-output_folder = r"D:\move11\配对结果"
-os.makedirs(output_folder, exist_ok=True)
-
-# 迭代Excel中的每一行，处理文章和对应的图片
-for index, row in df.iterrows():
-    title = row['标题']  # 假设Excel第一列是标题，列名为 "标题"
-    content = row['内容']  # 假设Excel第二列是文章内容，列名为 "文章内容"
-
-
-    paragraphs = re.split(
-        r'\s*#\s*|'
-        r'\s*（[一二三四五六七八九十]+）\s*|'
-        r'[一二三四五六七八九十]+、|'
-        r'[0-9]+\.[0-9]+|'
-        r'[0-9]+、|' 
-        r'🍔|🍀|💯|🌈|🔥|💫',
-        content
-    )
-
-    paragraphs = [para.strip() for para in paragraphs if para.strip()]  # 去除空白段落
-    print(f"文章标题: {title}")
-    print(f"共分割出 {len(paragraphs)} 个段落。")  # 打印段落数量以检查分割是否正确
-
-    # 加载对应标题的图片文件夹
-    image_folder = os.path.join(r"D:\move11\csdn\csdn\图片", title)
-    if not os.path.exists(image_folder):
-        print(f"警告: 找不到图片文件夹 '{image_folder}'")
-        continue
-
-    # 加载文件夹中的所有图片
-    image_paths = sorted([os.path.join(image_folder, img) for img in os.listdir(image_folder) if
-                          img.endswith(('.png', '.jpg', '.jpeg'))])
-
-    # 使用列表存储预处理后的图像和有效路径
-    images = []
-    valid_image_paths = []  # 用于存储有效的图像路径
-    for image_path in image_paths:
-        try:
-            img = Image.open(image_path)
-            images.append(preprocess(img).unsqueeze(0).to(device))
-            valid_image_paths.append(image_path)  # 只添加有效的路径
-        except UnidentifiedImageError:
-            print(f"警告: 无法处理图像文件 '{image_path}': 图片无法识别")
-            continue  # 放弃当前图像，继续下一个
-        except Exception as e:
-            print(f"警告: 无法处理图像文件 '{image_path}': {e}")
-            continue  # 放弃当前图像，继续下一个
-
-    # 如果没有有效图片，跳过处理
-    if not images:
-        print(f"警告: 图片文件夹 '{image_folder}' 中没有找到有效图片")
-        continue
-
-    # 计算每张图片与所有段落的相似度
-    text_tokens = clip.tokenize(paragraphs).to(device)
-
-    with torch.no_grad():
-        # 提取文本特征
-        text_features = model.encode_text(text_tokens)
-        text_features /= text_features.norm(dim=-1, keepdim=True)  # 归一化
-
-        # 使用 zip 同时迭代有效图像和路径
-        for image, image_path in zip(images, valid_image_paths):
-            image_feature = model.encode_image(image)
-            image_feature /= image_feature.norm(dim=-1, keepdim=True)  # 归一化
-
-            # 计算相似度
-            similarities = torch.matmul(image_feature, text_features.T)
-            probs = similarities.softmax(dim=-1).cpu().numpy()
-
-            # 找到相似度最高的段落
-            best_match_idx = probs.argmax()
-            best_match_prob = probs[0, best_match_idx]
+    # 加载Excel文件中的文章内容
+    df = pd.read_excel(excel_path)
+
+    # 创建保存配对结果的文件夹
+    os.makedirs(output_folder, exist_ok=True)
+
+    # 特征缓存：重跑时跳过已编码的图片和段落
+    cache = FeatureCache(cache_folder, model_id(model, model_name))
+
+    # 图像编码批大小，按可用内存自动设置，也可手动指定
+    batch_size = auto_batch_size(device)
+
+    writer = ResultsWriter(run_results_path(output_folder, fmt=results_format))
+
+    # 迭代Excel中的每一行，处理文章和对应的图片
+    for index, row in df.iterrows():
+        title = row['标题']  # 假设Excel第一列是标题，列名为 "标题"
+        content = row['内容']  # 假设Excel第二列是文章内容，列名为 "文章内容"
+
+
+        paragraphs = re.split(
+            r'\s*#\s*|'
+            r'\s*（[一二三四五六七八九十]+）\s*|'
+            r'[一二三四五六七八九十]+、|'
+            r'[0-9]+\.[0-9]+|'
+            r'[0-9]+、|' 
+            r'🍔|🍀|💯|🌈|🔥|💫',
+            content
+        )
 
+        paragraphs = [para.strip() for para in paragraphs if para.strip()]  # 去除空白段落
+        print(f"文章标题: {title}")
+        print(f"共分割出 {len(paragraphs)} 个段落。")  # 打印段落数量以检查分割是否正确
+
+        # 加载对应标题的图片文件夹
+        image_folder = os.path.join(image_root, title)
+        if not os.path.exists(image_folder):
+            print(f"警告: 找不到图片文件夹 '{image_folder}'")
+            continue
+
+        # 加载文件夹中的所有图片
+        image_paths = sorted([os.path.join(image_folder, img) for img in os.listdir(image_folder) if
+                              img.endswith(('.png', '.jpg', '.jpeg'))])
+
+        # 读取缓存或编码图片，得到归一化特征矩阵和有效路径
+        image_features, valid_image_paths = encode_image_paths(model, preprocess, image_paths, cache,
+                                                               batch_size, device)
+
+        # 如果没有有效图片，跳过处理
+        if image_features is None:
+            print(f"警告: 图片文件夹 '{image_folder}' 中没有找到有效图片")
+            continue
+
+        # 提取文本特征（已归一化）
+        text_features = encode_texts(model, paragraphs, cache, device, window_pool=text_pool)
+
+        # 一次矩阵运算得到每张图片的 top-k 段落（余弦相似度 + 全部段落上的 softmax 概率）
+        scores, probs, idx = score_topk(image_features, text_features, top_k)
+        rows = match_rows(title, valid_image_paths, paragraphs, scores, probs, idx, min_score)
+        writer.write_rows(rows)
+
+        for image_path, image_probs, image_idx in zip(valid_image_paths, probs, idx):
             # 输出匹配结果
-            print(f"图片 '{image_path}' 与段落 {best_match_idx + 1} 的相似度概率: {best_match_prob:.4f}")
-
-            # 创建目录以保存配对结果
-            match_folder = os.path.join(output_folder, title)
-            os.makedirs(match_folder, exist_ok=True)  # 确保创建对应的文件夹
-
-            # 保存配对结果到指定文件夹
-            output_image_path = os.path.join(match_folder,
-                                             f"{title}_{valid_image_paths.index(image_path) + 1}.png")
-            output_text_path = os.path.join(match_folder, f"{title}_{valid_image_paths.index(image_path) + 1}.txt")
-
-            # 保存图片
-            try:
-                original_image = Image.open(image_path)  # 使用原始路径
-                original_image.save(output_image_path)
-            except Exception as e:
-                print(f"保存图片时出错 '{image_path}' 到 '{output_image_path}': {e}")
-                continue  # 放弃当前图片，继续下一个
-
-            # 保存匹配的段落文本
-            with open(output_text_path, "w", encoding="utf-8") as f:
-                f.write(paragraphs[best_match_idx])
-
-print("所有配对结果已保存。")
\ No newline at end of file
+            print(f"图片 '{image_path}' 与段落 {image_idx[0] + 1} 的相似度概率: {image_probs[0]:.4f}")
+
+        if export_pairs:
+            export_matched_pairs(title, output_folder, valid_image_paths, rows, export_format, export_link)
+
+    writer.close()
+    print(f"共写入 {writer.count} 条匹配结果到 '{writer.path}'")
+    cache.close()
+    print(throughput_report())
+    print("所有配对结果已保存。")
+
+
+if __name__ == "__main__":
+    run(main)
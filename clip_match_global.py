@@ -0,0 +1,113 @@
+'''
+全局图文匹配：把 result 目录下所有文章的段落编码后放入一个 IVF 近似最近邻索引，
+每张图片在整个语料（或仅在所属文章内）检索 top-k 段落，并报告跨文章的近重复段落与图片。
+'''
+import json
+import os
+import time
+
+import numpy as np
+
+from annindex import FeatureBuffer, IVFIndex
+from articleutil import iter_articles
+from cliputil import DEVICE as device, MODEL_NAME as model_name, TEXT_POOL as text_pool, auto_batch_size, \
+    encode_image_paths, encode_texts, get_model, model_id, throughput_report
+from featcache import FeatureCache
+from metrics import run
+
+# 设置文件路径
+root_folder = r"D:\move11\result"  # 顶层 result 文件夹路径，结构同 clip_match_1.py
+output_folder = r"D:\move11\全局配对结果"
+cache_folder = r"./clip_cache"  # 特征缓存目录
+
+top_k = 5                     # 每张图片保留的候选段落数
+restrict_to_article = False   # True 时只在图片所属文章内检索
+duplicate_threshold = 0.95    # 余弦相似度不低于该值视为近重复
+
+
+def write_jsonl(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def main(root_folder=root_folder, output_folder=output_folder, top_k=top_k,
+         restrict_to_article=restrict_to_article):
+    model, preprocess = get_model(model_name, device)
+    os.makedirs(output_folder, exist_ok=True)
+    cache = FeatureCache(cache_folder, model_id(model, model_name))
+    batch_size = auto_batch_size(device)
+
+    # 第一遍：编码所有段落，记录 (文章, 段落序号)；特征逐篇写入 float16 缓冲区
+    articles, article_images = [], []
+    para_feats, para_refs = FeatureBuffer(), []
+    for article_folder, paragraphs, image_paths in iter_articles(root_folder):
+        if not paragraphs:
+            continue
+        article_idx = len(articles)
+        articles.append(article_folder)
+        article_images.append(image_paths)
+        para_feats.append(encode_texts(model, paragraphs, cache, device,
+                                       window_pool=text_pool).cpu().numpy())
+        para_refs.extend((article_idx, i) for i in range(len(paragraphs)))
+    if not para_refs:
+        print("没有找到任何段落。")
+        cache.close()
+        return
+    para_refs = np.array(para_refs)
+
+    start = time.perf_counter()
+    para_index = IVFIndex().add(para_feats.array, groups=para_refs[:, 0])  # 首次 add 时在缓冲区上训练
+    para_index.save(os.path.join(output_folder, "paragraph_index.npz"))  # 保存前按列表写入索引
+    del para_feats
+    print(f"段落索引: {len(para_index)} 条, {para_index.nlist} 个列表, 构建耗时 {time.perf_counter() - start:.1f} 秒")
+
+    def para_ref(pid):
+        article_idx, para_idx = para_refs[pid]
+        return {"article": articles[article_idx], "paragraph": int(para_idx) + 1}
+
+    # 第二遍：逐篇编码图片并在索引中检索
+    image_feats, image_refs = FeatureBuffer(), []
+    search_seconds, n_queries = 0.0, 0
+    with open(os.path.join(output_folder, "matches.jsonl"), "w", encoding="utf-8") as out:
+        for article_idx, image_paths in enumerate(article_images):
+            feats, valid_image_paths = encode_image_paths(model, preprocess, image_paths, cache, batch_size, device)
+            if feats is None:
+                continue
+            feats = feats.cpu().numpy()
+            groups = np.full(len(feats), article_idx) if restrict_to_article else None
+            start = time.perf_counter()
+            scores, ids = para_index.search(feats, top_k, groups=groups)
+            search_seconds += time.perf_counter() - start
+            n_queries += len(feats)
+            for image_path, row_scores, row_ids in zip(valid_image_paths, scores, ids):
+                matches = [{**para_ref(pid), "score": round(float(sc), 4)}
+                           for sc, pid in zip(row_scores, row_ids) if pid >= 0]
+                out.write(json.dumps({"image": image_path, "article": articles[article_idx],
+                                      "matches": matches}, ensure_ascii=False) + "\n")
+            image_feats.append(feats)
+            image_refs.extend((article_idx, p) for p in valid_image_paths)
+    if n_queries:
+        print(f"检索 {n_queries} 张图片，平均每张 {search_seconds / n_queries * 1000:.3f} 毫秒")
+
+    # 跨文章近重复：段落
+    para_dups = [{"a": para_ref(a), "b": para_ref(b), "score": round(sc, 4)}
+                 for a, b, sc in para_index.near_duplicates(duplicate_threshold)]
+    write_jsonl(os.path.join(output_folder, "paragraph_duplicates.jsonl"), para_dups)
+
+    # 跨文章近重复：图片
+    image_dups = []
+    if image_refs:
+        image_index = IVFIndex().add(image_feats.array, groups=[a for a, _ in image_refs])
+        del image_feats  # 索引在 near_duplicates 中合并后即释放缓冲区
+        image_dups = [{"a": image_refs[a][1], "b": image_refs[b][1], "score": round(sc, 4)}
+                      for a, b, sc in image_index.near_duplicates(duplicate_threshold)]
+    write_jsonl(os.path.join(output_folder, "image_duplicates.jsonl"), image_dups)
+    print(f"跨文章近重复段落 {len(para_dups)} 对，近重复图片 {len(image_dups)} 对。")
+
+    cache.close()
+    print(throughput_report())
+
+
+if __name__ == "__main__":
+    run(main)
@@ -0,0 +1,271 @@
+# clipbench.py
+"""
+CLIP 阶段基准测试：生成 result/<文章>/<文章>.txt + 图片/ 结构的合成语料，用随机初始化的小模型
+（不下载权重，可完全离线运行）分别计时 解码、预处理、文本编码、图像编码、打分、导出 各阶段，
+并端到端运行 clip_match_1 / clip_match_2 / clip_classify，结果写成 JSON，便于在不同提交之间比较。
+
+运行：python clipbench.py --articles 20 --images 8 --output bench.json
+"""
+from __future__ import annotations
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from PIL import Image
+
+import cliputil
+from cliputil import DEVICE as device
+
+TINY_MODEL = "RN50@RBT3-chinese"  # cn_clip 中最小的结构，随机初始化
+SEED = 0
+
+# 合成段落用的词表：长度不一，覆盖超出上下文长度需要滑动窗口的长段落
+WORDS = ["实验", "结果", "表明", "温度", "压力", "样品", "强度", "曲线", "模型", "数据", "方法", "系统",
+         "结构", "流程", "如图", "所示", "分析", "测试", "变化", "提高", "降低", "显著", "比较", "参数"]
+
+
+# ---------------- 合成语料 ----------------
+def _paragraph(rng: random.Random) -> str:
+    n = rng.choice([8, 20, 60, 150])  # 词数：短段落到远超 52 个 token 的长段落
+    text = "".join(rng.choice(WORDS) for _ in range(n))
+    return f"图{rng.randint(1, 9)} {text}。"
+
+
+def _image(rng: np.random.Generator, size: int) -> Image.Image:
+    """随机色块 + 噪声，避免 JPEG 把纯色图压得过小、解码过快"""
+    base = rng.integers(0, 256, size=(8, 8, 3), dtype=np.uint8)
+    img = np.kron(base, np.ones((size // 8, size // 8, 1), dtype=np.uint8))
+    noise = rng.integers(0, 32, size=img.shape, dtype=np.uint8)
+    return Image.fromarray(img + noise)
+
+
+def make_corpus(root: str, articles: int = 20, images: int = 8, paragraphs: int = 12,
+                image_size: int = 640, seed: int = SEED) -> str:
+    """在 root/result 下生成合成语料，返回 result 目录"""
+    rng, np_rng = random.Random(seed), np.random.default_rng(seed)
+    result = os.path.join(root, "result")
+    for a in range(articles):
+        name = f"article_{a:04d}"
+        image_folder = os.path.join(result, name, "图片")
+        os.makedirs(image_folder, exist_ok=True)
+        with open(os.path.join(result, name, f"{name}.txt"), "w", encoding="utf-8") as f:
+            f.write("\n\n".join(_paragraph(rng) for _ in range(paragraphs)))
+        for i in range(images):
+            ext = ".png" if i % 4 == 3 else ".jpg"
+            _image(np_rng, image_size).save(os.path.join(image_folder, f"图{i + 1}{ext}"))
+    return result
+
+
+def corpus_files(result: str) -> List[Tuple[str, List[str], List[str]]]:
+    """按文章返回 [(文章名, 段落列表, 图片路径列表)]"""
+    from articleutil import split_paragraphs
+    articles = []
+    for name in sorted(os.listdir(result)):
+        with open(os.path.join(result, name, f"{name}.txt"), "r", encoding="utf-8") as f:
+            paragraphs = split_paragraphs(f.read())
+        folder = os.path.join(result, name, "图片")
+        articles.append((name, paragraphs, [os.path.join(folder, img) for img in sorted(os.listdir(folder))]))
+    return articles
+
+
+# ---------------- 模型 ----------------
+def register_tiny_model(struct: str = TINY_MODEL):
+    """构建随机初始化的小模型并登记到 cliputil 的模型注册表，之后 get_model() 直接返回它"""
+    from cn_clip.clip import image_transform
+    from cn_clip.clip.utils import create_model
+    for var in ("CLIP_SERVER", "CLIP_BACKEND", "CLIP_QUANTIZE"):  # 基准测试只测本地 eager 模型
+        os.environ.pop(var, None)
+    torch.manual_seed(SEED)
+    with contextlib.redirect_stdout(io.StringIO()):
+        model = create_model(struct)
+    model = model.float().to(device).eval()
+    preprocess = image_transform(model.visual.input_resolution)
+    cliputil._MODELS[(cliputil.MODEL_NAME, str(device))] = (model, preprocess)
+    return model, preprocess
+
+
+# ---------------- 计时 ----------------
+def _stage(seconds: float, items: int, unit: str) -> Dict[str, float]:
+    return {"seconds": round(seconds, 4), "items": items, "unit": unit,
+            "per_second": round(items / seconds, 2) if seconds else None}
+
+
+def time_stages(model, preprocess, articles: List[Tuple[str, List[str], List[str]]],
+                export_root: str, batch_size: int = 16) -> Dict[str, dict]:
+    """单线程逐阶段计时（不经过缓存），各阶段输入为上一阶段的输出"""
+    from cliputil import TEXT_POOL as text_pool, _input_size, encode_images, encode_texts, score_topk
+    from exportutil import export_image
+
+    stages = {}
+    size = _input_size(preprocess)
+    image_paths = [p for _, _, paths in articles for p in paths]
+
+    start = time.perf_counter()
+    decoded = []
+    for path in image_paths:
+        with Image.open(path) as img:
+            if img.format == "JPEG" and size:
+                img.draft("RGB", (size, size))
+            decoded.append(img.convert("RGB"))
+    stages["decode"] = _stage(time.perf_counter() - start, len(decoded), "images")
+
+    start = time.perf_counter()
+    tensors = [preprocess(img) for img in decoded]
+    stages["preprocess"] = _stage(time.perf_counter() - start, len(tensors), "images")
+
+    start = time.perf_counter()
+    text_features = [encode_texts(model, paragraphs, None, device, window_pool=text_pool)
+                     for _, paragraphs, _ in articles]
+    _sync()
+    stages["text_encode"] = _stage(time.perf_counter() - start, sum(len(p) for _, p, _ in articles), "paragraphs")
+
+    start = time.perf_counter()
+    image_features = encode_images(model, tensors, batch_size, device).float()
+    _sync()
+    stages["image_encode"] = _stage(time.perf_counter() - start, len(tensors), "images")
+
+    # 按文章打分（image_paths 按文章顺序排列）
+    start = time.perf_counter()
+    offset = 0
+    for (_, _, paths), feats in zip(articles, text_features):
+        score_topk(image_features[offset:offset + len(paths)], feats, 3)
+        offset += len(paths)
+    stages["scoring"] = _stage(time.perf_counter() - start, len(tensors), "images")
+
+    for link in (True, False):
+        folder = os.path.join(export_root, "link" if link else "copy")
+        os.makedirs(folder, exist_ok=True)
+        start = time.perf_counter()
+        for i, path in enumerate(image_paths):
+            export_image(path, os.path.join(folder, str(i)), link=link)
+        stages["export_link" if link else "export_copy"] = _stage(time.perf_counter() - start, len(image_paths),
+                                                                  "images")
+    return stages
+
+
+def _sync():
+    if str(device).startswith("cuda"):
+        torch.cuda.synchronize()
+
+
+def _timed(fn, *args) -> float:
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # 脚本逐张打印，计时时不输出
+        fn(*args)
+    return round(time.perf_counter() - start, 4)
+
+
+def time_scripts(root: str, result: str, image_paths: List[str]) -> Dict[str, dict]:
+    """端到端运行三个脚本（缓存目录放在临时目录）；冷缓存与热缓存各一次"""
+    import clip_classify
+    import clip_match_1
+    import clip_match_2
+
+    scripts = {}
+    for module in (clip_match_1, clip_match_2, clip_classify):
+        module.cache_folder = os.path.join(root, f"clip_cache_{module.__name__}")  # 各脚本的冷缓存互不影响
+
+    runs = {}
+    for run in ("cold", "warm"):
+        shutil.rmtree(os.path.join(root, "out_match_1"), ignore_errors=True)  # 清空运行日志，否则全部跳过
+        runs[run] = _timed(clip_match_1.main, result, os.path.join(root, "out_match_1"), False)
+    scripts["clip_match_1"] = {**runs, "images": len(image_paths)}
+
+    classify_input = os.path.join(root, "classify_input")
+    os.makedirs(classify_input, exist_ok=True)
+    for i, path in enumerate(image_paths):
+        dst = os.path.join(classify_input, f"{i}{os.path.splitext(path)[1]}")
+        if not os.path.exists(dst):
+            shutil.copyfile(path, dst)
+    scripts["clip_classify"] = {"cold": _timed(clip_classify.main, classify_input,
+                                               os.path.join(root, "out_classify"), 0.0),
+                                "multilabel_warm": _timed(clip_classify.main_multilabel, classify_input,
+                                                          os.path.join(root, "out_classify")),
+                                "images": len(image_paths)}
+
+    try:
+        import pandas as pd
+        excel_path = os.path.join(root, "articles.xlsx")
+        rows = []
+        for name in sorted(os.listdir(result)):
+            with open(os.path.join(result, name, f"{name}.txt"), "r", encoding="utf-8") as f:
+                rows.append({"标题": name, "内容": f.read().replace("\n\n", "#")})
+        pd.DataFrame(rows).to_excel(excel_path, index=False)
+    except ImportError as e:  # clip_match_2 读 Excel 需要 pandas + openpyxl
+        scripts["clip_match_2"] = {"skipped": str(e)}
+    else:
+        image_root = os.path.join(root, "excel_images")
+        for name in sorted(os.listdir(result)):
+            if not os.path.exists(os.path.join(image_root, name)):
+                shutil.copytree(os.path.join(result, name, "图片"), os.path.join(image_root, name))
+        scripts["clip_match_2"] = {"warm": _timed(clip_match_2.main, excel_path, image_root,
+                                                  os.path.join(root, "out_match_2")),
+                                   "images": len(image_paths)}
+    return scripts
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(articles: int = 20, images: int = 8, paragraphs: int = 12, image_size: int = 640,
+         output: Optional[str] = None, workdir: Optional[str] = None, scripts: bool = True) -> dict:
+    root = workdir or tempfile.mkdtemp(prefix="clipbench_")
+    try:
+        start = time.perf_counter()
+        result = make_corpus(root, articles, images, paragraphs, image_size)
+        corpus_seconds = time.perf_counter() - start
+        corpus = corpus_files(result)
+        image_paths = [p for _, _, paths in corpus for p in paths]
+        model, preprocess = register_tiny_model()
+
+        report = {
+            "commit": _git_commit(),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "platform": platform.platform(), "python": platform.python_version(), "torch": torch.__version__,
+            "device": str(device), "torch_threads": torch.get_num_threads(), "model": TINY_MODEL,
+            "corpus": {"articles": articles, "images": len(image_paths), "paragraphs": sum(len(p) for _, p, _ in corpus),
+                       "image_size": image_size, "seconds": round(corpus_seconds, 2)},
+            "stages": time_stages(model, preprocess, corpus, os.path.join(root, "export")),
+        }
+        if scripts:
+            report["scripts"] = time_scripts(root, result, image_paths)
+    finally:
+        if workdir is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CLIP 阶段基准测试（合成语料 + 随机小模型，离线）")
+    parser.add_argument("--articles", type=int, default=20)
+    parser.add_argument("--images", type=int, default=8, help="每篇文章的图片数")
+    parser.add_argument("--paragraphs", type=int, default=12, help="每篇文章的段落数")
+    parser.add_argument("--image-size", type=int, default=640)
+    parser.add_argument("--output", help="结果 JSON 文件")
+    parser.add_argument("--workdir", help="语料与输出目录（默认使用临时目录并在结束后删除）")
+    parser.add_argument("--no-scripts", action="store_true", help="只做分阶段计时，不端到端运行脚本")
+    args = parser.parse_args()
+    main(args.articles, args.images, args.paragraphs, args.image_size, args.output, args.workdir,
+         not args.no_scripts)
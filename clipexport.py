@@ -0,0 +1,218 @@
+# clipexport.py
+"""
+CPU 推理后端：把 cn_clip 的图像塔和文本塔各导出一次（TorchScript 或 ONNX），缓存在 download_root/exported 下，
+之后直接加载导出的模型推理，不再构建 eager 模型。
+
+使用：设置环境变量 CLIP_BACKEND=torchscript（或 onnx，需要 onnxruntime）后运行 clip_match_1.py 等脚本，
+cliputil.get_model() 会自动改用导出的模型；
+校验与测速：python clipexport.py --backend torchscript --fixtures <图片目录>
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import time
+from typing import Dict, Optional
+
+import torch
+import cn_clip.clip as clip
+from cn_clip.clip import image_transform
+
+BACKENDS = ("torchscript", "onnx")
+EXPORT_DIR = "exported"
+ONNX_OPSET = 17
+PARITY_MIN_COSINE = 0.999  # 导出模型与 eager 模型特征的最低余弦相似度
+
+# 校验 / 测速用的固定文本
+FIXTURE_TEXTS = ["数据统计图", "一张流程路线图的图片", "实验装置的实物照片",
+                 "图1 不同温度下样品的拉伸强度变化曲线", "本文提出了一种基于深度学习的图像分类方法"]
+
+
+def intra_op_threads() -> int:
+    """算子内线程数：取物理核数，超线程对矩阵乘法帮助不大"""
+    try:
+        import psutil
+        return psutil.cpu_count(logical=False) or os.cpu_count() or 1
+    except ImportError:
+        return os.cpu_count() or 1
+
+
+def artifact_path(download_root: str, name: str, backend: str, tower: str) -> str:
+    ext = "pt" if backend == "torchscript" else "onnx"
+    return os.path.join(download_root, EXPORT_DIR, f"{name}.{tower}.{ext}")
+
+
+def _meta_path(download_root: str, name: str) -> str:
+    return os.path.join(download_root, EXPORT_DIR, f"{name}.json")
+
+
+class _Tower(torch.nn.Module):
+    """把 encode_image / encode_text 包成单输入的模块，便于 trace / 导出"""
+
+    def __init__(self, model, tower: str):
+        super().__init__()
+        self.model = model
+        self.tower = tower
+
+    def forward(self, x):
+        return self.model.encode_image(x) if self.tower == "image" else self.model.encode_text(x)
+
+
+def export(model, name: str, backend: str, download_root: str):
+    """导出图像塔和文本塔（batch 维可变），并记录输入分辨率"""
+    resolution = model.visual.input_resolution
+    examples = {"image": torch.randn(2, 3, resolution, resolution),
+                "text": clip.tokenize(FIXTURE_TEXTS[:2])}
+    os.makedirs(os.path.join(download_root, EXPORT_DIR), exist_ok=True)
+    model = model.float().cpu().eval()
+    for tower, example in examples.items():
+        path = artifact_path(download_root, name, backend, tower)
+        tmp_path = f"{path}.tmp"
+        module = _Tower(model, tower)
+        with torch.no_grad():
+            if backend == "torchscript":
+                torch.jit.trace(module, example, check_trace=False).save(tmp_path)
+            else:
+                torch.onnx.export(module, (example,), tmp_path, input_names=["input"], output_names=["features"],
+                                  dynamic_axes={"input": {0: "batch"}, "features": {0: "batch"}},
+                                  opset_version=ONNX_OPSET, dynamo=False)
+        os.replace(tmp_path, path)  # 导出中断时不会留下半个文件
+        print(f"已导出 {tower} 塔: {path}")
+    with open(_meta_path(download_root, name), "w", encoding="utf-8") as f:
+        json.dump({"name": name, "input_resolution": resolution}, f)
+
+
+def is_exported(name: str, backend: str, download_root: str) -> bool:
+    return os.path.exists(_meta_path(download_root, name)) and all(
+        os.path.exists(artifact_path(download_root, name, backend, t)) for t in ("image", "text"))
+
+
+class ExportedModel:
+    """导出模型的包装，提供与 CLIP 模型相同的 encode_image / encode_text 接口（仅 CPU）"""
+
+    def __init__(self, name: str, backend: str, download_root: str, threads: Optional[int] = None):
+        if backend not in BACKENDS:
+            raise ValueError(f"未知后端 '{backend}'，可选 {BACKENDS}")
+        self.backend = backend
+        self.threads = threads or intra_op_threads()
+        with open(_meta_path(download_root, name), "r", encoding="utf-8") as f:
+            self.info = json.load(f)
+        paths = {t: artifact_path(download_root, name, backend, t) for t in ("image", "text")}
+        if backend == "torchscript":
+            torch.set_num_threads(self.threads)
+            self.towers = {t: torch.jit.load(p, map_location="cpu").eval() for t, p in paths.items()}
+        else:
+            import onnxruntime as ort  # 只在使用 onnx 后端时才依赖 onnxruntime
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = self.threads
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            self.towers = {t: ort.InferenceSession(p, options, providers=["CPUExecutionProvider"])
+                           for t, p in paths.items()}
+
+    def _run(self, tower: str, x: torch.Tensor) -> torch.Tensor:
+        if self.backend == "torchscript":
+            with torch.no_grad():
+                return self.towers[tower](x.cpu())
+        out = self.towers[tower].run(None, {"input": x.cpu().numpy()})[0]
+        return torch.from_numpy(out)
+
+    def encode_image(self, images: torch.Tensor) -> torch.Tensor:
+        return self._run("image", images.float())
+
+    def encode_text(self, text_tokens: torch.Tensor) -> torch.Tensor:
+        return self._run("text", text_tokens)
+
+    def eval(self):
+        return self
+
+
+def load_exported(name: str, backend: str, download_root: str, threads: Optional[int] = None):
+    """返回 (ExportedModel, preprocess)；还没有导出文件时先加载 eager 模型导出一次"""
+    if not is_exported(name, backend, download_root):
+        model, _ = clip.load_from_name(name, device="cpu", download_root=download_root)
+        export(model, name, backend, download_root)
+        del model
+    model = ExportedModel(name, backend, download_root, threads)
+    return model, image_transform(model.info["input_resolution"])
+
+
+# ---------------- 校验与测速 ----------------
+def _normalized(x: torch.Tensor) -> torch.Tensor:
+    x = x.float()
+    return x / x.norm(dim=-1, keepdim=True)
+
+
+def parity(reference, candidate, images: torch.Tensor, text_tokens: torch.Tensor) -> Dict[str, float]:
+    """两个模型在同一组输入上的最低余弦相似度（按图像 / 文本分别统计）"""
+    with torch.no_grad():
+        return {
+            "image": float((_normalized(reference.encode_image(images)) *
+                            _normalized(candidate.encode_image(images))).sum(-1).min()),
+            "text": float((_normalized(reference.encode_text(text_tokens)) *
+                           _normalized(candidate.encode_text(text_tokens))).sum(-1).min()),
+        }
+
+
+def benchmark(model, images: torch.Tensor, text_tokens: torch.Tensor, repeats: int = 3) -> Dict[str, float]:
+    """预热一次后重复 repeats 次，返回每秒处理的图片数 / 文本数"""
+    rates = {}
+    with torch.no_grad():
+        for tower, x, encode in (("image", images, model.encode_image), ("text", text_tokens, model.encode_text)):
+            encode(x)
+            start = time.perf_counter()
+            for _ in range(repeats):
+                encode(x)
+            rates[tower] = len(x) * repeats / (time.perf_counter() - start)
+    return rates
+
+
+def fixture_inputs(preprocess, fixtures: Optional[str], n: int = 16):
+    """校验用输入：fixtures 目录下的图片（最多 n 张），没有时用随机图像；文本为 FIXTURE_TEXTS"""
+    from cliputil import _input_size, load_images
+    images = None
+    if fixtures:
+        paths = sorted(os.path.join(fixtures, f) for f in os.listdir(fixtures))[:n]
+        images = torch.stack(load_images(paths, preprocess)[0]) if paths else None
+    if images is None:
+        resolution = _input_size(preprocess)
+        images = torch.rand(n, 3, resolution, resolution)
+    return images, clip.tokenize(FIXTURE_TEXTS)
+
+
+def main(backend: str, name: str, download_root: str, fixtures: Optional[str] = None,
+         threads: Optional[int] = None, repeats: int = 3, force: bool = False) -> bool:
+    from cliputil import get_model
+    threads = threads or intra_op_threads()
+    torch.set_num_threads(threads)
+    eager, preprocess = get_model(name, "cpu", download_root, server="", backend="eager")
+    if force or not is_exported(name, backend, download_root):
+        export(eager, name, backend, download_root)
+    exported = ExportedModel(name, backend, download_root, threads)
+
+    images, text_tokens = fixture_inputs(preprocess, fixtures)
+    cosines = parity(eager, exported, images, text_tokens)
+    ok = min(cosines.values()) >= PARITY_MIN_COSINE
+    print(f"一致性（最低余弦相似度）: 图像 {cosines['image']:.6f}, 文本 {cosines['text']:.6f} -> "
+          f"{'通过' if ok else '未通过'}（阈值 {PARITY_MIN_COSINE}）")
+
+    base = benchmark(eager, images, text_tokens, repeats)
+    fast = benchmark(exported, images, text_tokens, repeats)
+    for tower, unit in (("image", "张"), ("text", "条")):
+        print(f"{tower}: eager {base[tower]:.1f} {unit}/秒, {backend} {fast[tower]:.1f} {unit}/秒, "
+              f"加速 {fast[tower] / base[tower]:.2f}x（{threads} 线程）")
+    return ok
+
+
+if __name__ == "__main__":
+    from cliputil import DOWNLOAD_ROOT, MODEL_NAME
+    parser = argparse.ArgumentParser(description="导出 CLIP 编码器并与 eager 模型做一致性校验和测速")
+    parser.add_argument("--backend", choices=BACKENDS, default="torchscript")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--download-root", default=DOWNLOAD_ROOT)
+    parser.add_argument("--fixtures", help="校验用图片目录（默认使用随机图像）")
+    parser.add_argument("--threads", type=int)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--force", action="store_true", help="重新导出")
+    args = parser.parse_args()
+    raise SystemExit(0 if main(args.backend, args.model, args.download_root, args.fixtures,
+                               args.threads, args.repeats, args.force) else 1)
@@ -0,0 +1,225 @@
+# clipquant.py
+"""
+CPU 量化推理：对 load_from_name 加载的模型做动态 INT8 量化（nn.Linear），或把权重和激活转成 float16 / bfloat16。
+
+量化前必须通过精度闸门：在留出集上比较量化模型与 fp32 模型的 top-1 一致率
+（图片 -> 段落配对、图片 -> 分类标签），任一项低于 MIN_AGREEMENT 时拒绝量化、继续使用 fp32 模型。
+评估结果存为 download_root/quantized/<模型>.<模式>.json，之后的运行直接读取，不再重复评估。
+
+使用：设置环境变量 CLIP_QUANTIZE=int8（或 fp16 / bf16）后运行 clip_match_1.py 等脚本；
+重新评估并测速：python clipquant.py --mode int8
+"""
+from __future__ import annotations
+import argparse
+import copy
+import json
+import os
+from typing import Dict
+
+import torch
+
+QUANT_MODES = ("int8", "fp16", "bf16")
+QUANT_DIR = "quantized"
+MIN_AGREEMENT = 0.97  # top-1 一致率下限；吞吐量优先，允许少量与 fp32 不一致
+
+# 留出集：配对评估使用 clip_match_1.py 的目录结构（<文章>/<文章>.txt + <文章>/图片），
+# 分类评估使用一个图片目录，类别与提示模板取自 clip_classify.py
+eval_pairs_root = r"D:\move11\留出集\result"
+eval_label_folder = r"D:\move11\留出集\分类前"
+eval_max_articles = 200
+eval_max_images = 2000
+
+
+class QuantizedModel:
+    """量化 / 低精度模型的包装：接口与 CLIP 模型相同，输出统一转回 float32"""
+
+    def __init__(self, model, mode: str):
+        self.model = model
+        self.mode = mode
+        self.visual = model.visual
+
+    def encode_image(self, images: torch.Tensor) -> torch.Tensor:
+        return self.model.encode_image(images).float()
+
+    def encode_text(self, text_tokens: torch.Tensor) -> torch.Tensor:
+        return self.model.encode_text(text_tokens).float()
+
+    def eval(self):
+        return self
+
+
+def _convert_weights(model, dtype: torch.dtype):
+    """
+    同 cn_clip.clip.model.convert_weights，但可指定目标类型：卷积、线性层、注意力和 BERT 转成 dtype，
+    LayerNorm 保持 float32（cn_clip 的 LayerNorm 会把输入转成 float32 计算）
+    """
+    from cn_clip.clip.model import BertModel
+
+    def convert(layer):
+        if isinstance(layer, (torch.nn.Conv1d, torch.nn.Conv2d, torch.nn.Linear)):
+            layer.weight.data = layer.weight.data.to(dtype)
+            if layer.bias is not None:
+                layer.bias.data = layer.bias.data.to(dtype)
+        if isinstance(layer, torch.nn.MultiheadAttention):
+            for attr in ["in_proj_weight", "q_proj_weight", "k_proj_weight", "v_proj_weight",
+                         "in_proj_bias", "bias_k", "bias_v"]:
+                tensor = getattr(layer, attr)
+                if tensor is not None:
+                    tensor.data = tensor.data.to(dtype)
+        if isinstance(layer, BertModel):
+            layer.to(dtype)
+        for attr in ("text_projection", "proj"):
+            tensor = getattr(layer, attr, None)
+            if isinstance(tensor, torch.Tensor):
+                tensor.data = tensor.data.to(dtype)
+
+    model.apply(convert)
+    return model
+
+
+def _int8_layers(model) -> Dict[str, object]:
+    """
+    动态量化的 nn.Linear（按模块名）。RN 系列的 AttentionPool2d 直接把 q/k/v/c_proj 的 weight、bias
+    传给 F.multi_head_attention_forward，量化后的 Linear 没有这些张量，因此这几层保持 fp32
+    """
+    from cn_clip.clip.model import AttentionPool2d
+    skip = {f"{name}.{child}" for name, module in model.named_modules() if isinstance(module, AttentionPool2d)
+            for child, _ in module.named_children()}
+    return {name: torch.ao.quantization.default_dynamic_qconfig for name, module in model.named_modules()
+            if isinstance(module, torch.nn.Linear) and name not in skip}
+
+
+def quantize(model, mode: str) -> QuantizedModel:
+    """返回量化后的副本，原 fp32 模型不变"""
+    if mode not in QUANT_MODES:
+        raise ValueError(f"未知量化模式 '{mode}'，可选 {QUANT_MODES}")
+    model = copy.deepcopy(model).float().cpu().eval()
+    if mode == "int8":
+        model = torch.ao.quantization.quantize_dynamic(model, _int8_layers(model), dtype=torch.qint8)
+    else:
+        model = _convert_weights(model, torch.float16 if mode == "fp16" else torch.bfloat16)
+    return QuantizedModel(model, mode)
+
+
+# ---------------- 精度闸门 ----------------
+def _pair_agreement(reference, candidate, preprocess) -> Dict[str, float]:
+    """每张图片在所属文章内的 top-1 段落是否与 fp32 模型相同"""
+    from articleutil import iter_articles
+    from cliputil import TEXT_POOL as text_pool, encode_images, encode_texts, load_images
+
+    same = total = 0
+    for n, (_, paragraphs, image_paths) in enumerate(iter_articles(eval_pairs_root)):
+        if n >= eval_max_articles:
+            break
+        images, _ = load_images(image_paths, preprocess)
+        if not paragraphs or not images:
+            continue
+        top1 = []
+        for model in (reference, candidate):
+            text_features = encode_texts(model, paragraphs, None, "cpu", window_pool=text_pool)
+            top1.append((encode_images(model, images, device="cpu").float() @ text_features.T).argmax(dim=-1))
+        same += int((top1[0] == top1[1]).sum())
+        total += len(images)
+    return {"pairs": same / total if total else None, "pair_images": total}
+
+
+def _label_agreement(reference, candidate, preprocess) -> Dict[str, float]:
+    """图片的 top-1 分类标签是否与 fp32 模型相同"""
+    from clip_classify import categories, prompt_templates
+    from cliputil import encode_categories, encode_images, load_images
+
+    image_paths = sorted(os.path.join(eval_label_folder, f) for f in os.listdir(eval_label_folder))
+    images, _ = load_images(image_paths[:eval_max_images], preprocess)
+    if not images:
+        return {"labels": None, "label_images": 0}
+    top1 = []
+    for model in (reference, candidate):
+        category_features = encode_categories(model, categories, prompt_templates, None, "cpu")
+        top1.append((encode_images(model, images, device="cpu").float() @ category_features.T).argmax(dim=-1))
+    return {"labels": float((top1[0] == top1[1]).float().mean()), "label_images": len(images)}
+
+
+def evaluate(reference, candidate, preprocess) -> dict:
+    """在留出集上计算 top-1 一致率；留出集不存在的部分记为 None"""
+    report = {}
+    report.update(_pair_agreement(reference, candidate, preprocess) if os.path.isdir(eval_pairs_root)
+                  else {"pairs": None, "pair_images": 0})
+    report.update(_label_agreement(reference, candidate, preprocess) if os.path.isdir(eval_label_folder)
+                  else {"labels": None, "label_images": 0})
+    return report
+
+
+def passes(report: dict, floor: float = MIN_AGREEMENT) -> bool:
+    """至少有一项评估，且每一项都不低于 floor"""
+    scores = [report[k] for k in ("pairs", "labels") if report.get(k) is not None]
+    return bool(scores) and min(scores) >= floor
+
+
+def report_path(download_root: str, name: str, mode: str) -> str:
+    return os.path.join(download_root, QUANT_DIR, f"{name}.{mode}.json")
+
+
+def gate(reference, candidate, preprocess, name: str, mode: str, download_root: str,
+         floor: float = MIN_AGREEMENT, force: bool = False) -> dict:
+    """读取或重新计算评估结果并写入报告文件，返回报告（含 passed 字段）"""
+    path = report_path(download_root, name, mode)
+    if not force and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            report = json.load(f)
+    else:
+        report = {"name": name, "mode": mode, **evaluate(reference, candidate, preprocess)}
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    report["passed"] = passes(report, floor)
+    return report
+
+
+def _describe(report: dict) -> str:
+    parts = []
+    for key, count, label in (("pairs", "pair_images", "图文配对"), ("labels", "label_images", "分类标签")):
+        value = report.get(key)
+        parts.append(f"{label} {value * 100:.2f}%（{report[count]} 张）" if value is not None else f"{label} 无留出集")
+    return "，".join(parts)
+
+
+def load_quantized(model, preprocess, name: str, mode: str, download_root: str, floor: float = MIN_AGREEMENT):
+    """返回通过精度闸门的量化模型；未通过时打印原因并返回 fp32 模型"""
+    candidate = quantize(model, mode)
+    report = gate(model, candidate, preprocess, name, mode, download_root, floor)
+    if not report["passed"]:
+        print(f"警告: {mode} 量化未通过精度闸门（下限 {floor * 100:.1f}%）: {_describe(report)}，继续使用 fp32 模型")
+        return model
+    print(f"使用 {mode} 量化模型，top-1 一致率: {_describe(report)}")
+    return candidate
+
+
+def main(mode: str, name: str, download_root: str, floor: float = MIN_AGREEMENT, repeats: int = 3) -> bool:
+    from clipexport import benchmark, fixture_inputs
+    from cliputil import get_model
+    model, preprocess = get_model(name, "cpu", download_root, server="", backend="eager", quantize="")
+    candidate = quantize(model, mode)
+    report = gate(model, candidate, preprocess, name, mode, download_root, floor, force=True)
+    print(f"{mode} 与 fp32 的 top-1 一致率: {_describe(report)} -> "
+          f"{'通过' if report['passed'] else '未通过'}（下限 {floor * 100:.1f}%）")
+
+    images, text_tokens = fixture_inputs(preprocess, None)
+    threads = torch.get_num_threads()
+    base = benchmark(model, images, text_tokens, repeats)
+    fast = benchmark(candidate, images, text_tokens, repeats)
+    for tower, unit in (("image", "张"), ("text", "条")):
+        print(f"{tower}: fp32 {base[tower] / threads:.2f} {unit}/秒/核, {mode} {fast[tower] / threads:.2f} {unit}/秒/核, "
+              f"加速 {fast[tower] / base[tower]:.2f}x（{threads} 线程）")
+    return report["passed"]
+
+
+if __name__ == "__main__":
+    from cliputil import DOWNLOAD_ROOT, MODEL_NAME
+    parser = argparse.ArgumentParser(description="量化 CLIP 模型，评估与 fp32 的一致率并测速")
+    parser.add_argument("--mode", choices=QUANT_MODES, default="int8")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--download-root", default=DOWNLOAD_ROOT)
+    parser.add_argument("--floor", type=float, default=MIN_AGREEMENT)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    raise SystemExit(0 if main(args.mode, args.model, args.download_root, args.floor, args.repeats) else 1)
@@ -0,0 +1,134 @@
+# clipserve.py
+"""
+常驻 CLIP 模型服务：模型只加载一次，流水线中的各个脚本通过本地 socket 调用。
+
+启动：python clipserve.py --port 6006
+使用：设置环境变量 CLIP_SERVER=127.0.0.1:6006 后运行 clip_match_1.py 等脚本，
+cliputil.get_model() 会自动改用服务端模型；图片预处理仍在客户端完成。
+
+连接用 multiprocessing.connection 传输（pickle），必须用密钥认证：取环境变量 CLIP_SERVER_AUTHKEY，
+没有设置时服务端首次启动生成随机密钥，写入只有当前用户可读的密钥文件（默认 ~/.clipserve.key，
+可用 CLIP_SERVER_KEY_FILE 指定），客户端从同一文件读取。
+"""
+from __future__ import annotations
+import argparse
+import os
+import secrets
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from typing import Optional, Tuple
+
+import torch
+from cn_clip.clip import image_transform
+
+from cliputil import DEVICE, MODEL_NAME, _input_size, get_model, model_id
+
+KEY_FILE = os.environ.get("CLIP_SERVER_KEY_FILE", os.path.join(os.path.expanduser("~"), ".clipserve.key"))
+
+
+def load_authkey(create: bool = False) -> bytes:
+    """认证密钥：CLIP_SERVER_AUTHKEY，否则读密钥文件；create 为 True 且文件不存在时生成随机密钥（权限 0600）"""
+    key = os.environ.get("CLIP_SERVER_AUTHKEY")
+    if key:
+        return key.encode("utf-8")
+    try:
+        with open(KEY_FILE, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        if not create:
+            raise FileNotFoundError(f"找不到模型服务的密钥文件 '{KEY_FILE}'，请先启动 clipserve.py "
+                                    f"或设置 CLIP_SERVER_AUTHKEY") from None
+    key = secrets.token_bytes(32)
+    fd = os.open(KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    return key
+
+
+def _parse_address(server: str) -> Tuple[str, int]:
+    host, _, port = server.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+class RemoteModel:
+    """模型服务的客户端，提供与 CLIP 模型相同的 encode_image / encode_text 接口"""
+
+    def __init__(self, server: str, authkey: Optional[bytes] = None):
+        self.conn = Client(_parse_address(server), authkey=authkey or load_authkey())
+        self.lock = threading.Lock()
+        self.info = self._call("info")
+
+    def _call(self, op: str, payload=None):
+        with self.lock:
+            self.conn.send((op, payload))
+            status, result = self.conn.recv()
+        if status != "ok":
+            raise RuntimeError(f"模型服务出错: {result}")
+        return result
+
+    def encode_image(self, images: torch.Tensor) -> torch.Tensor:
+        return self._call("encode_image", images.cpu()).to(images.device)
+
+    def encode_text(self, text_tokens: torch.Tensor) -> torch.Tensor:
+        return self._call("encode_text", text_tokens.cpu()).to(text_tokens.device)
+
+    def eval(self):
+        return self
+
+    def close(self):
+        self.conn.close()
+
+
+def connect(server: str, authkey: Optional[bytes] = None):
+    """连接模型服务，返回 (RemoteModel, preprocess)"""
+    model = RemoteModel(server, authkey)
+    return model, image_transform(model.info["input_resolution"])
+
+
+def _handle(conn, info: dict, model, device: str, lock: threading.Lock):
+    """处理单个客户端连接上的请求，直到对方断开"""
+    with conn:
+        while True:
+            try:
+                op, payload = conn.recv()
+            except EOFError:
+                return
+            try:
+                if op == "info":
+                    result = info
+                elif op in ("encode_image", "encode_text"):
+                    with lock, torch.no_grad():
+                        result = getattr(model, op)(payload.to(device)).cpu()
+                else:
+                    raise ValueError(f"未知操作 '{op}'")
+                conn.send(("ok", result))
+            except Exception as e:
+                conn.send(("error", repr(e)))
+
+
+def serve(port: int, host: str = "127.0.0.1", name: str = MODEL_NAME, device: str = DEVICE,
+          authkey: Optional[bytes] = None):
+    authkey = authkey or load_authkey(create=True)
+    model, preprocess = get_model(name, device, server="")  # 服务端自身总是本地加载（可配合 CLIP_BACKEND）
+    info = {"name": name, "model_id": model_id(model, name), "input_resolution": _input_size(preprocess)}
+    lock = threading.Lock()
+    with Listener((host, port), authkey=authkey) as listener:
+        print(f"模型服务已启动: {host}:{port}（{name}, {device}）")
+        while True:
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError, AuthenticationError) as e:  # 认证失败等，不影响其他客户端
+                print(f"警告: 拒绝连接: {e}")
+                continue
+            threading.Thread(target=_handle, args=(conn, info, model, device, lock), daemon=True).start()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="常驻 CLIP 模型服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6006)
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--device", default=DEVICE)
+    args = parser.parse_args()
+    serve(args.port, args.host, args.model, args.device)
@@ -0,0 +1,465 @@
+# cliputil.py
+from __future__ import annotations
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+import cn_clip.clip as clip
+from PIL import Image, UnidentifiedImageError
+
+from metrics import count, timer
+
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+MODEL_NAME = "ViT-B-16"
+DOWNLOAD_ROOT = "./"
+
+# clip.tokenize 的默认上下文长度，以及长段落滑动窗口之间重叠的 token 数
+CONTEXT_LENGTH = 52
+WINDOW_OVERLAP = 16
+# 各脚本编码段落时的默认池化方式：超过上下文长度的段落按重叠窗口编码后池化（"mean" / "max"），None 为直接截断
+TEXT_POOL = "mean"
+
+# 类别提示模板（"{}" 处填入类别名）；encode_categories 对同一类别的所有提示取平均
+PROMPT_TEMPLATES = ("{}",)
+
+# 进程内模型注册表：同一 (模型, 设备) 只加载一次
+_MODELS = {}
+_MODELS_LOCK = threading.Lock()
+# id(model) -> 实际使用的模型标识（含后端 / 量化方式），用作特征缓存和类别矩阵的键
+_MODEL_IDS = {}
+
+# ViT-B-16 在 224 分辨率下单张图前向的峰值显存/内存粗估（MB），用于推算批大小
+PER_IMAGE_MB = 64
+MIN_BATCH, MAX_BATCH = 1, 128
+
+# 解码线程数与预取批数：解码线程池领先编码器最多 PREFETCH_BATCHES 个批次
+DECODE_WORKERS = os.cpu_count() or 4
+PREFETCH_BATCHES = 2
+
+
+class Throughput:
+    """累计某一阶段处理的图片数与耗时，用于输出 张/秒"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.seconds = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, count: int, seconds: float):
+        with self.lock:
+            self.count += count
+            self.seconds += seconds
+
+    @property
+    def rate(self) -> float:
+        return self.count / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return f"{self.name}: {self.count} 张, {self.rate:.1f} 张/秒"
+
+
+DECODE_STATS = Throughput("解码+预处理")
+ENCODE_STATS = Throughput("图像编码")
+
+
+def throughput_report() -> str:
+    """解码与编码两个阶段各自的吞吐，解码明显快于编码说明解码已不是瓶颈"""
+    return f"{DECODE_STATS}；{ENCODE_STATS}"
+
+
+def get_model(name: str = MODEL_NAME, device: str = DEVICE, download_root: str = DOWNLOAD_ROOT,
+              server: Optional[str] = None, backend: Optional[str] = None, quantize: Optional[str] = None):
+    """
+    返回 (model, preprocess)，首次调用时才加载，之后在本进程内复用。
+    server 为 "host:port"（为 None 时读环境变量 CLIP_SERVER，为 "" 时强制本地加载）时
+    改用常驻模型服务（见 clipserve.py），连接失败则回退到本地加载。
+    backend 为 "torchscript" / "onnx"（为 None 时读环境变量 CLIP_BACKEND，默认 "eager"）时
+    在 CPU 上使用导出的编码器（见 clipexport.py），首次使用时自动导出。
+    quantize 为 "int8" / "fp16" / "bf16"（为 None 时读环境变量 CLIP_QUANTIZE）时在 CPU 上使用量化模型，
+    未通过精度闸门（见 clipquant.py）时仍使用 fp32 模型。
+    实际加载的模型标识（如 "ViT-B-16+int8"）用 model_id(model) 取得，特征缓存必须以它为键。
+    """
+    if server is None:
+        server = os.environ.get("CLIP_SERVER")
+    if backend is None:
+        backend = os.environ.get("CLIP_BACKEND", "eager")
+    if backend != "eager" and str(device) != "cpu":
+        print(f"警告: '{backend}' 后端只用于 CPU，设备 '{device}' 上仍使用 eager 模型")
+        backend = "eager"
+    if quantize is None:
+        quantize = os.environ.get("CLIP_QUANTIZE", "")
+    if quantize and (backend != "eager" or str(device) != "cpu"):
+        print(f"警告: 量化只用于 CPU 上的 eager 模型，忽略 '{quantize}'")
+        quantize = ""
+    with _MODELS_LOCK:
+        if server and ("remote", server) not in _MODELS:
+            from clipserve import connect
+            try:
+                remote = connect(server)
+                if remote[0].info["name"] != name:
+                    print(f"警告: 模型服务加载的是 '{remote[0].info['name']}'，而不是 '{name}'")
+                # 旧版服务不报告后端，单独使用一个标识，不与本地 eager 模型共用缓存
+                _MODEL_IDS[id(remote[0])] = remote[0].info.get("model_id") or f"{remote[0].info['name']}+remote"
+                _MODELS[("remote", server)] = remote
+            except OSError as e:
+                print(f"警告: 无法连接模型服务 '{server}'，改为本地加载: {e}")
+                server = None
+        if server:
+            return _MODELS[("remote", server)]
+
+        if backend != "eager":
+            key = (name, backend)
+            if key not in _MODELS:
+                from clipexport import load_exported
+                _MODELS[key] = load_exported(name, backend, download_root)
+                _MODEL_IDS[id(_MODELS[key][0])] = f"{name}+{backend}"
+            return _MODELS[key]
+
+        key = (name, str(device))
+        if key not in _MODELS:
+            model, preprocess = clip.load_from_name(name, device=device, download_root=download_root)
+            model.eval()
+            _MODELS[key] = (model, preprocess)
+        if not quantize:
+            return _MODELS[key]
+
+        quant_key = (name, str(device), quantize)
+        if quant_key not in _MODELS:
+            from clipquant import load_quantized
+            model, preprocess = _MODELS[key]
+            quantized = load_quantized(model, preprocess, name, quantize, download_root)
+            if quantized is not model:  # 未通过精度闸门时返回的是 fp32 模型，沿用 eager 的标识
+                _MODEL_IDS[id(quantized)] = f"{name}+{quantize}"
+            _MODELS[quant_key] = (quantized, preprocess)
+        return _MODELS[quant_key]
+
+
+def model_id(model, name: str = MODEL_NAME) -> str:
+    """get_model 返回的模型的标识：本地 eager 模型为模型名，其他为 <模型名>+<后端或量化方式>（如 ViT-B-16+int8）"""
+    return _MODEL_IDS.get(id(model), name)
+
+
+def _available_memory_mb(device: str) -> Optional[int]:
+    """当前设备可用内存（MB），取不到时返回 None"""
+    if str(device).startswith("cuda") and torch.cuda.is_available():
+        free, _ = torch.cuda.mem_get_info()
+        return free // (1024 * 1024)
+    try:
+        import psutil
+        return psutil.virtual_memory().available // (1024 * 1024)
+    except ImportError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        return None  # Windows 下没有 sysconf
+
+
+def auto_batch_size(device: str = DEVICE, per_item_mb: int = PER_IMAGE_MB,
+                    fraction: float = 0.25, default: int = 16) -> int:
+    """按可用内存推算编码批大小：只占用 fraction 比例的空闲内存"""
+    avail = _available_memory_mb(device)
+    if avail is None:
+        return default
+    return max(MIN_BATCH, min(MAX_BATCH, int(avail * fraction) // per_item_mb))
+
+
+def encode_images(model, images: List[torch.Tensor], batch_size: Optional[int] = None,
+                  device: str = DEVICE) -> torch.Tensor:
+    """
+    将预处理后的 [3,H,W] 图像张量分成小批次送入 encode_image，
+    返回归一化后的特征矩阵 [N, D]（与 images 顺序一致）。
+    """
+    batch_size = batch_size or auto_batch_size(device)
+    feats = []
+    with torch.no_grad():
+        for start in range(0, len(images), batch_size):
+            batch = torch.stack(images[start:start + batch_size]).to(device)
+            feat = model.encode_image(batch)
+            feats.append(feat / feat.norm(dim=-1, keepdim=True))  # 归一化
+    return torch.cat(feats)
+
+
+def _input_size(preprocess) -> Optional[int]:
+    """从 cn_clip 的 image_transform 中取出输入分辨率（第一个变换是 Resize）"""
+    size = getattr(getattr(preprocess, "transforms", [None])[0], "size", None)
+    if isinstance(size, (tuple, list)):
+        return max(size)
+    return size
+
+
+def decode_image(image_path: str, preprocess, size: Optional[int] = None) -> Optional[torch.Tensor]:
+    """
+    读取并预处理单张图片，失败时打印警告并返回 None。
+    JPEG 使用 draft 模式在解码阶段直接缩小到不低于 size 的尺寸，省掉大图的全尺寸解码。
+    """
+    try:
+        with timer("image_decode"):
+            img = Image.open(image_path)
+            if size and img.format == "JPEG":
+                img.draft("RGB", (size, size))
+            return preprocess(img)
+    except UnidentifiedImageError:
+        print(f"警告: 无法处理图像文件 '{image_path}': 图片无法识别")
+    except Exception as e:
+        print(f"警告: 无法处理图像文件 '{image_path}': {e}")
+    return None
+
+
+def load_images(image_paths: Sequence[str], preprocess,
+                workers: Optional[int] = None) -> Tuple[List[torch.Tensor], List[str]]:
+    """并行读取并预处理图片，跳过无法识别的文件，返回 ([3,H,W] 张量列表, 有效路径)"""
+    size = _input_size(preprocess)
+    with ThreadPoolExecutor(workers or DECODE_WORKERS) as pool:
+        tensors = list(pool.map(lambda p: decode_image(p, preprocess, size), image_paths))
+    images = [t for t in tensors if t is not None]
+    valid_image_paths = [p for p, t in zip(image_paths, tensors) if t is not None]
+    return images, valid_image_paths
+
+
+def iter_image_batches(image_paths: Sequence[str], preprocess, batch_size: int,
+                       workers: Optional[int] = None,
+                       prefetch: int = PREFETCH_BATCHES) -> Iterator[Tuple[torch.Tensor, List[str]]]:
+    """
+    生产者/消费者流水线：后台线程池解码、预处理并组批，有界队列最多预取 prefetch 批，
+    调用方（模型线程）只负责前向计算。按输入顺序产出 ([B,3,H,W] 张量, 有效路径)。
+    """
+    size = _input_size(preprocess)
+    batches: queue.Queue = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def produce():
+        try:
+            with ThreadPoolExecutor(workers or DECODE_WORKERS) as pool:
+                paths = iter(image_paths)
+                pending = deque()
+                window = batch_size * (prefetch + 1)  # 同时在解码的图片数上限
+
+                def fill():
+                    while len(pending) < window:
+                        path = next(paths, None)
+                        if path is None:
+                            return
+                        pending.append((path, pool.submit(decode_image, path, preprocess, size)))
+
+                fill()
+                while pending and not stop.is_set():
+                    start = time.perf_counter()
+                    images, valid = [], []
+                    for _ in range(min(batch_size, len(pending))):
+                        path, future = pending.popleft()
+                        tensor = future.result()
+                        if tensor is not None:
+                            images.append(tensor)
+                            valid.append(path)
+                    fill()
+                    if images:
+                        batch = torch.stack(images)
+                        DECODE_STATS.add(len(images), time.perf_counter() - start)
+                        put((batch, valid))
+                put(done)
+        except BaseException as e:  # 交给消费者线程重新抛出
+            put(e)
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = batches.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def encode_image_paths(model, preprocess, image_paths: Sequence[str], cache=None,
+                       batch_size: Optional[int] = None,
+                       device: str = DEVICE) -> Tuple[Optional[torch.Tensor], List[str]]:
+    """
+    先查特征缓存，只对未命中的图片做解码和编码，新特征写回缓存。
+    返回 (归一化特征矩阵 [M, D], 有效路径)；没有有效图片时特征为 None。
+    """
+    keys, hits = {}, {}
+    if cache is not None:
+        for image_path in image_paths:
+            try:
+                keys[image_path] = cache.image_key(image_path)
+            except OSError:
+                pass  # 读不到的文件交给 decode_image 报告
+        hits = cache.get_many(list(keys.values()))
+
+    misses = [p for p in image_paths if keys.get(p) not in hits]
+    batch_size = batch_size or auto_batch_size(device)
+    fresh = {}
+    with torch.no_grad():
+        for batch, loaded in iter_image_batches(misses, preprocess, batch_size):
+            start = time.perf_counter()
+            with timer("image_encode"):
+                feats = model.encode_image(batch.to(device)).float()
+                feats /= feats.norm(dim=-1, keepdim=True)  # 归一化
+            ENCODE_STATS.add(len(loaded), time.perf_counter() - start)
+            count("images_encoded", len(loaded))
+            if cache is not None:
+                cached = [(keys[p], i) for i, p in enumerate(loaded) if p in keys]
+                cache.put_many([k for k, _ in cached], feats[[i for _, i in cached]].cpu().numpy())
+            fresh.update(zip(loaded, feats))
+
+    rows, valid_image_paths = [], []
+    for image_path in image_paths:
+        if image_path in fresh:
+            rows.append(fresh[image_path])
+        elif keys.get(image_path) in hits:
+            rows.append(torch.from_numpy(hits[keys[image_path]]).to(device))
+        else:
+            continue
+        valid_image_paths.append(image_path)
+    if not rows:
+        return None, []
+    return torch.stack(rows), valid_image_paths
+
+
+def tokenize_windows(texts: Sequence[str], context_length: int = CONTEXT_LENGTH,
+                     overlap: int = WINDOW_OVERLAP) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    把每段文本切成 clip.tokenize 同样格式的 token 窗口（[CLS] + 片段 + [SEP]），
+    相邻窗口重叠 overlap 个 token，最后一个窗口与文本末尾对齐。
+    返回 (tokens [W, context_length], owner [W])，owner[w] 为窗口所属文本的下标。
+    """
+    tokenizer = clip._tokenizer
+    cls_id, sep_id = tokenizer.vocab['[CLS]'], tokenizer.vocab['[SEP]']
+    span = context_length - 2
+    step = max(1, span - overlap)
+    windows, owner = [], []
+    for i, text in enumerate(texts):
+        ids = tokenizer.convert_tokens_to_ids(tokenizer.tokenize(text))
+        starts = list(range(0, max(len(ids) - span, 0) + 1, step))
+        if starts[-1] + span < len(ids):
+            starts.append(len(ids) - span)
+        for start in starts:
+            windows.append([cls_id] + ids[start:start + span] + [sep_id])
+            owner.append(i)
+    tokens = torch.zeros(len(windows), context_length, dtype=torch.long)
+    for w, ids in enumerate(windows):
+        tokens[w, :len(ids)] = torch.tensor(ids)
+    return tokens, torch.tensor(owner)
+
+
+def pool_windows(feats: torch.Tensor, owner: torch.Tensor, n: int, mode: str = "mean") -> torch.Tensor:
+    """把窗口特征按 owner 池化回 n 个段落（mean / max），再归一化"""
+    pooled = torch.zeros(n, feats.shape[1], dtype=feats.dtype, device=feats.device)
+    if mode == "max":
+        pooled.scatter_reduce_(0, owner.unsqueeze(1).expand_as(feats), feats, "amax", include_self=False)
+    elif mode == "mean":
+        pooled.index_add_(0, owner, feats)
+        pooled /= torch.bincount(owner, minlength=n).unsqueeze(1)
+    else:
+        raise ValueError(f"未知的池化方式 '{mode}'，可选 mean / max")
+    return pooled / pooled.norm(dim=-1, keepdim=True)
+
+
+def encode_texts(model, texts: Sequence[str], cache=None, device: str = DEVICE,
+                 window_pool: Optional[str] = None, window_overlap: int = WINDOW_OVERLAP) -> torch.Tensor:
+    """
+    编码文本（段落或类别名），返回归一化特征矩阵 [N, D]；命中缓存的文本不再编码。
+    window_pool 为 None 时超出上下文长度的部分被截断；为 "mean" / "max" 时长段落按重叠窗口切分，
+    所有窗口一次性送入 encode_text，再池化回段落。
+    """
+    variant = f":win{window_overlap}-{window_pool}" if window_pool else ""
+    keys = [cache.text_key(t, variant) for t in texts] if cache is not None else [None] * len(texts)
+    hits = cache.get_many(keys) if cache is not None else {}
+    misses = [i for i, k in enumerate(keys) if k not in hits]
+    rows: List[Optional[torch.Tensor]] = [None] * len(texts)
+    if misses:
+        miss_texts = [texts[i] for i in misses]
+        if window_pool:
+            text_tokens, owner = tokenize_windows(miss_texts, overlap=window_overlap)
+        else:
+            text_tokens = clip.tokenize(miss_texts)
+        with torch.no_grad(), timer("text_encode"):
+            feats = model.encode_text(text_tokens.to(device)).float()
+            feats /= feats.norm(dim=-1, keepdim=True)  # 归一化
+            if window_pool:
+                feats = pool_windows(feats, owner.to(feats.device), len(misses), window_pool)
+        count("texts_encoded", len(misses))
+        if cache is not None:
+            cache.put_many([keys[i] for i in misses], feats.cpu().numpy())
+        for i, feat in zip(misses, feats):
+            rows[i] = feat
+    for i, k in enumerate(keys):
+        if rows[i] is None:
+            rows[i] = torch.from_numpy(hits[k]).to(device)
+    return torch.stack(rows)
+
+
+def prompt_set_hash(model_name: str, categories: Sequence[str], templates: Sequence[str]) -> str:
+    """(模型标识, 类别, 模板) 的哈希，用作类别矩阵文件名；类别顺序不同视为不同的提示集"""
+    payload = json.dumps([model_name, list(categories), list(templates)], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def encode_categories(model, categories: Sequence[str], templates: Sequence[str] = PROMPT_TEMPLATES,
+                      cache=None, device: str = DEVICE) -> torch.Tensor:
+    """
+    提示集成的类别特征 [C, D]：每个类别按所有模板生成提示，取归一化文本特征的均值后再归一化。
+    有缓存时类别矩阵按 (模型标识, 提示集哈希) 存为 cache.root/categories/*.npy，类别与模板都不变时
+    直接读取、不调用文本编码器；单条提示的特征仍写入特征缓存，新增类别或模板时只编码新的提示。
+    """
+    matrix_path = None
+    if cache is not None:
+        digest = prompt_set_hash(model_id(model, cache.model_name), categories, templates)
+        matrix_path = os.path.join(cache.root, "categories", f"{digest}.npy")
+        if os.path.exists(matrix_path):
+            return torch.from_numpy(np.load(matrix_path)).to(device)
+
+    prompts = [t.format(c) for c in categories for t in templates]
+    feats = encode_texts(model, prompts, cache, device).view(len(categories), len(templates), -1).mean(dim=1)
+    feats /= feats.norm(dim=-1, keepdim=True)
+    if matrix_path is not None:
+        os.makedirs(os.path.dirname(matrix_path), exist_ok=True)
+        tmp_path = f"{matrix_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, feats.cpu().numpy())
+        os.replace(tmp_path, matrix_path)  # 原子替换，并发运行时不会读到半个文件
+    return feats
+
+
+def score_topk(image_features: torch.Tensor, text_features: torch.Tensor, k: int = 3,
+               candidates: Optional[Sequence[Optional[Sequence[int]]]] = None):
+    """
+    一次矩阵运算为整篇文章的所有图片打分，返回 numpy 数组 (余弦相似度, softmax 概率, 段落下标)，
+    形状均为 [N, min(k, 段落数)]，按相似度降序。softmax 在全部段落上计算，与原先 argmax 的口径一致。
+    candidates 给出每张图片的候选段落下标（None 或空列表表示全部段落）：其余段落的相似度置为 -inf，
+    softmax 只在候选段落上计算；候选少于 k 个时多出的位置相似度为 -inf（match_rows 会丢弃）。
+    """
+    with torch.no_grad():
+        similarities = torch.matmul(image_features, text_features.T)
+        if candidates is not None:
+            mask = torch.zeros_like(similarities, dtype=torch.bool)
+            for row, cand in enumerate(candidates):
+                if cand:
+                    mask[row] = True
+                    mask[row, list(cand)] = False
+            similarities = similarities.masked_fill(mask, float("-inf"))
+        probs = similarities.softmax(dim=-1)
+        scores, idx = similarities.topk(min(k, similarities.shape[1]), dim=-1)
+        return scores.cpu().numpy(), probs.gather(1, idx).cpu().numpy(), idx.cpu().numpy()
@@ -0,0 +1,254 @@
+# dedup.py
+"""
+按内容查找重复文件：先按文件大小分桶，大小唯一的文件不可能有重复，无需读取；
+其余文件在线程池中流式计算 BLAKE2b 哈希（按块读取，内存与文件大小无关），再按 (大小, 哈希) 分组。
+quick=True 时在两者之间先比较首尾两块的哈希，只有首尾也相同的文件才读取全文（适合大量 PDF）。
+
+哈希记录在持久化索引（SQLite，(路径, 大小, mtime) -> 哈希）中，重跑时只对新增或改动过的文件重新计算；
+移动文件后调用 HashIndex.move 更新路径，移动后的文件也无需重算。
+内存占用只与文件个数有关，与文件内容大小无关。
+"""
+from __future__ import annotations
+import hashlib
+import os
+import re
+import sqlite3
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from metrics import count, timer
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, hash TEXT
+);
+CREATE TABLE IF NOT EXISTS quick (
+    path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, hash TEXT
+);
+"""
+TABLES = ("files", "quick")
+
+HASH_BLOCK = 1 << 20
+QUICK_BLOCK = 1 << 16  # 首尾块大小；不超过两块的文件，首尾哈希就是全文哈希
+HASH_WORKERS = min(32, (os.cpu_count() or 4) * 4)  # 以读文件为主，线程数可以多于核数
+
+# PDF 元数据中的 DOI：文档信息字典的 /DOI 项，或 XMP 的 prism:doi / pdfx:doi / dc:identifier，首尾都可信
+DOI_META_PATTERN = re.compile(rb"(?:/DOI\s*\(|<(?:prism|pdfx):doi>\s*|<dc:identifier>\s*(?:doi:\s*)?)"
+                              rb"(10\.\d{4,9}/[^\s()<>\"']+)", re.I)
+# 其他位置的 doi 字样只在文件头部可信：末尾往往是未压缩的参考文献（或其链接注释），是被引文献的 DOI
+DOI_PATTERN = re.compile(rb"(?:doi[:=/]\s*|doi\.org/)(10\.\d{4,9}/[^\s()<>\"']+)", re.I)
+DOI_SCAN = 1 << 14     # 只读文件首尾各 16 KB（XMP 通常在前面，增量更新后的信息字典在末尾）
+
+# 浏览器重复下载时自动加的 "(1)" 等后缀，保留文件时优先保留没有后缀的
+copy_suffix = re.compile(r'\s*\(\d+\)\.pdf$', re.I)
+
+Stat = Tuple[int, int]  # (大小, mtime_ns)
+
+
+def blake2_file(path: str, block: int = HASH_BLOCK) -> str:
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(block), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def head_tail_hash(path: str, block: int = QUICK_BLOCK) -> str:
+    """首尾两块的哈希；文件不超过两块时读取的就是全文"""
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        h.update(f.read(block))
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size > block:
+            f.seek(max(block, size - block))
+            h.update(f.read(block))
+    return h.hexdigest()
+
+
+def pdf_doi(path: str, scan: int = DOI_SCAN) -> Optional[str]:
+    """
+    从 PDF 首尾的原始字节中找本文的 DOI（不解析 PDF，压缩流里的不会被找到），统一为小写：
+    优先取元数据中的 DOI（末尾的信息字典较新），其次取文件头部出现的 doi 字样
+    """
+    with open(path, "rb") as f:
+        head = f.read(scan)
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        tail = b""
+        if size > scan:
+            f.seek(max(scan, size - scan))
+            tail = f.read(scan)
+    m = DOI_META_PATTERN.search(tail) or DOI_META_PATTERN.search(head) or DOI_PATTERN.search(head)
+    return m.group(1).decode("ascii", "replace").rstrip(".,;").lower() if m else None
+
+
+def pdf_dois(paths: Sequence[str], workers: int = HASH_WORKERS) -> Dict[str, Optional[str]]:
+    """多线程读取每个 PDF 的 DOI，返回 {路径: DOI 或 None}"""
+    with timer("dedup_doi"), ThreadPoolExecutor(workers) as pool:
+        return dict(zip(paths, pool.map(pdf_doi, paths)))
+
+
+def walk_files(root: str, suffixes: Optional[Tuple[str, ...]] = None, workers: int = HASH_WORKERS,
+               skip_dirs: Sequence[str] = ()) -> Dict[str, Stat]:
+    """多线程遍历目录树：每个目录由一个线程 scandir，子目录继续提交；返回 {路径: (大小, mtime_ns)}"""
+    skip = {os.path.abspath(d) for d in skip_dirs}
+
+    def scan(folder):
+        files, subdirs = {}, []
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if os.path.abspath(entry.path) not in skip:
+                        subdirs.append(entry.path)
+                elif entry.is_file() and (suffixes is None or entry.name.lower().endswith(suffixes)):
+                    st = entry.stat()
+                    files[entry.path] = (st.st_size, st.st_mtime_ns)
+        return files, subdirs
+
+    found: Dict[str, Stat] = {}
+    with timer("dedup_walk"), ThreadPoolExecutor(workers) as pool:
+        pending = {pool.submit(scan, root)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                found.update(files)
+                pending.update(pool.submit(scan, d) for d in subdirs)
+    return dict(sorted(found.items()))  # 与线程调度无关的稳定顺序
+
+
+class HashIndex:
+    """(绝对路径, 大小, mtime_ns) -> 哈希 的持久化索引（全文哈希与首尾哈希各一张表）；path 为 None 时只在内存中"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.db = sqlite3.connect(path or ":memory:")
+        self.db.executescript(SCHEMA)
+
+    def get(self, path: str, size: int, mtime_ns: int, table: str = "files") -> Optional[str]:
+        row = self.db.execute(f"SELECT size, mtime_ns, hash FROM {table} WHERE path=?",
+                              (os.path.abspath(path),)).fetchone()
+        if row and row[0] == size and row[1] == mtime_ns:
+            return row[2]
+        return None
+
+    def put_many(self, records: Iterable[Tuple[str, int, int, str]], table: str = "files"):
+        self.db.executemany(f"INSERT OR REPLACE INTO {table} VALUES (?,?,?,?)",
+                            [(os.path.abspath(p), size, mtime_ns, digest) for p, size, mtime_ns, digest in records])
+        self.db.commit()
+
+    def move(self, src: str, dst: str):
+        """文件被移动 / 改名后更新路径（os.rename / shutil.move 在同一磁盘上保留 mtime）"""
+        for table in TABLES:
+            self.db.execute(f"INSERT OR REPLACE INTO {table} SELECT ?, size, mtime_ns, hash FROM {table} WHERE path=?",
+                            (os.path.abspath(dst), os.path.abspath(src)))
+            self.db.execute(f"DELETE FROM {table} WHERE path=?", (os.path.abspath(src),))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def hash_files(paths: List[str], stats: Dict[str, Stat], index: Optional[HashIndex] = None,
+               workers: int = HASH_WORKERS, fn: Callable[[str], str] = blake2_file,
+               table: str = "files") -> Dict[str, str]:
+    """返回 {路径: 哈希}；索引中大小和 mtime 都没变的文件直接取记录，其余在线程池中计算"""
+    digests, todo = {}, []
+    for path in paths:
+        size, mtime_ns = stats[path]
+        digest = index.get(path, size, mtime_ns, table) if index is not None else None
+        if digest is None:
+            todo.append(path)
+        else:
+            digests[path] = digest
+    count("dedup_hash_cached", len(digests), table=table)
+    if todo:
+        with timer("dedup_hash", table=table), ThreadPoolExecutor(workers) as pool:
+            for path, digest in zip(todo, pool.map(fn, todo)):
+                digests[path] = digest
+        count("dedup_hashed", len(todo), table=table)
+        if index is not None:
+            index.put_many(((p, *stats[p], digests[p]) for p in todo), table)
+    return digests
+
+
+def _collisions(groups: Dict[tuple, List[str]]) -> List[str]:
+    return [p for group in groups.values() if len(group) > 1 for p in group]
+
+
+def group_by_content(paths: Iterable[str], index: Optional[HashIndex] = None, workers: int = HASH_WORKERS,
+                     include_unique: bool = False, stats: Optional[Dict[str, Stat]] = None,
+                     quick: bool = False) -> List[List[str]]:
+    """把内容完全相同的文件分为一组，组按首个成员在 paths 中出现的顺序排列，组内保持原顺序；
+    include_unique 为 False 时只返回有重复的组；stats 可传入 walk_files 的结果，省去再次 stat"""
+    paths = list(paths)
+    if stats is None:
+        stats = {}
+        for p in paths:
+            st = os.stat(p)
+            stats[p] = (st.st_size, st.st_mtime_ns)
+    keys: Dict[str, tuple] = {p: (stats[p][0],) for p in paths}
+
+    def refine(fn, table, only=lambda p: True):
+        """对仍有冲突的文件追加一级哈希"""
+        groups: Dict[tuple, List[str]] = defaultdict(list)
+        for p in paths:
+            groups[keys[p]].append(p)
+        todo = [p for p in _collisions(groups) if only(p)]
+        for p, digest in hash_files(todo, stats, index, workers, fn, table).items():
+            keys[p] += (digest,)
+
+    # 只有大小相同的文件才需要继续比较
+    if quick:
+        refine(head_tail_hash, "quick")
+        refine(blake2_file, "files", only=lambda p: stats[p][0] > 2 * QUICK_BLOCK)
+    else:
+        refine(blake2_file, "files")
+
+    groups: Dict[tuple, List[str]] = {}  # dict 保持插入顺序 = 首个成员的出现顺序
+    for path in paths:
+        groups.setdefault(keys[path], []).append(path)
+    return [g for g in groups.values() if include_unique or len(g) > 1]
+
+
+def keep_order(path: str) -> tuple:
+    """同组中保留排在最前的文件：没有 (n) 后缀 > 文件名短 > 路径字典序"""
+    name = os.path.basename(path)
+    return bool(copy_suffix.search(name)), len(name), path
+
+
+def merge_by_key(groups: List[List[str]], paths: Sequence[str], key_of: Dict[str, Optional[str]]) -> List[List[str]]:
+    """把 key_of 中键相同（如 DOI 相同）的文件并入同一组（并查集），返回至少两个成员的组"""
+    parent = {p: p for p in paths}
+
+    def find(p):
+        while parent[p] != p:
+            parent[p] = parent[parent[p]]
+            p = parent[p]
+        return p
+
+    def union(a, b):
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[rb] = ra
+
+    for group in groups:
+        for p in group[1:]:
+            union(group[0], p)
+    first_with_key: Dict[str, str] = {}
+    for p in paths:
+        key = key_of.get(p)
+        if key:
+            union(first_with_key.setdefault(key, p), p)
+
+    merged: Dict[str, List[str]] = {}
+    for p in paths:
+        merged.setdefault(find(p), []).append(p)
+    return [g for g in merged.values() if len(g) > 1]
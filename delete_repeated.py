@@ -1,33 +1,58 @@
 '''
-删除重复下载的pdf文件
+删除重复下载的pdf文件：按内容查找重复的 PDF，每组保留一个，其余移动到目标文件夹（保持相对路径）。
+先比较文件大小，大小相同的再比较首尾块的哈希，仍然相同的才计算全文哈希；多线程遍历目录和计算哈希，
+哈希保存在源文件夹的索引中，重跑时只处理新增或改动过的文件。
+match_doi 为 True 时，PDF 元数据中 DOI 相同的文件（如出版社版与预印本）也视为重复。
 '''
 import os
 import shutil
 
-def move_pdf_files(src_folder, dest_folder, endings):
+from dedup import HashIndex, group_by_content, keep_order, merge_by_key, pdf_dois, walk_files
+from metrics import count, run
+
+index_name = ".dedup_index.sqlite"
+
+
+def find_duplicate_pdfs(src_folder, index=None, match_doi=False, skip_dirs=()):
+    """返回重复 PDF 的分组，每组第一个为保留的文件"""
+    stats = walk_files(src_folder, ('.pdf',), skip_dirs=skip_dirs)
+    paths = list(stats)
+    print(f"共找到 {len(paths)} 个 PDF 文件")
+    groups = group_by_content(paths, index, stats=stats, quick=True)
+    if match_doi:
+        dois = pdf_dois(paths)
+        groups = merge_by_key(groups, paths, dois)
+    return [sorted(group, key=keep_order) for group in groups]
+
+
+def move_pdf_files(src_folder, dest_folder, match_doi=False):
     # 确保目标文件夹存在
     if not os.path.exists(dest_folder):
         os.makedirs(dest_folder)
-    
-    # 遍历源文件夹
-    for root, dirs, files in os.walk(src_folder):
-        for file in files:
-            # 检查文件名是否以指定的结尾之一结束
-            if any(file.endswith(ending) for ending in endings):
-                # 构建完整的文件路径
-                src_file_path = os.path.join(root, file)
-                dest_file_path = os.path.join(dest_folder, file)
-                
+
+    with HashIndex(os.path.join(src_folder, index_name)) as index:
+        groups = find_duplicate_pdfs(src_folder, index, match_doi, skip_dirs=[dest_folder])
+        for keep, *duplicates in groups:
+            for src_file_path in duplicates:
+                # 构建目标路径（保持相对路径，不同子目录中的同名文件不会互相覆盖）
+                dest_file_path = os.path.join(dest_folder, os.path.relpath(src_file_path, src_folder))
+                os.makedirs(os.path.dirname(dest_file_path), exist_ok=True)
+
                 # 移动文件
                 shutil.move(src_file_path, dest_file_path)
-                print(f"Moved: {src_file_path} to {dest_file_path}")
+                index.move(src_file_path, dest_file_path)
+                count("pdf_files", result="duplicate")
+                print(f"Moved: {src_file_path} to {dest_file_path} (same as {keep})")
+    print(f"共 {len(groups)} 组重复，移动了 {sum(len(g) - 1 for g in groups)} 个文件")
+
 
-# 指定源文件夹和目标文件夹
-source_folder = r'D:\多模态\人工智能\CNKI-deleted'
-destination_folder = r'D:\多模态\人工智能\temp'
+if __name__ == "__main__":
+    # 指定源文件夹和目标文件夹
+    source_folder = r'D:\多模态\人工智能\CNKI-deleted'
+    destination_folder = r'D:\多模态\人工智能\temp'
 
-# 指定文件结尾
-endings = ['(1).pdf', '(2).pdf', '(3).pdf', '(4).pdf', '(5).pdf', '(6).pdf',]
+    # 是否按 PDF 元数据中的 DOI 合并（需要额外读取每个 PDF 的首尾各 16 KB）
+    match_doi = False
 
-# 调用函数
-move_pdf_files(source_folder, destination_folder, endings)
\ No newline at end of file
+    # 调用函数
+    run(move_pdf_files, source_folder, destination_folder, match_doi)
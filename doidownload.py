@@ -0,0 +1,303 @@
+# doidownload.py
+"""
+异步 DOI 下载引擎（aiohttp）：全局连接数上限 + 每个主机的连接数上限，连接池保持长连接复用；
+每个 DOI 同时向 race_width 个镜像请求落地页，最先解析出 PDF 链接的镜像胜出，其余请求被取消，
+胜出者下载失败时继续使用剩下的镜像；PDF 按块流式写入 .part 临时文件，校验 %PDF 文件头后再改名，
+网络中断留下的 .part 在下次下载同一地址时用 HTTP Range 续传。
+
+传入 pdfstore.DownloadStore 时文件按内容哈希入库，已在清单中的 DOI 不发任何请求直接跳过。
+
+本地测试可用 mirrorstub.py 启动几个行为不同（正常 / 慢 / 出错）的替身镜像。
+"""
+from __future__ import annotations
+import asyncio
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Sequence, Tuple
+from urllib.parse import urljoin, urlsplit
+
+import aiohttp
+
+from metrics import count, timer
+from pdfstore import DownloadStore, content_range_start, file_sha256, make_key
+
+MIRRORS = [
+    "https://sci-hub.ren/",
+    "https://sci-hub.se/",
+    "https://sci-hub.st/",
+    "https://sci-hub.shop/",
+    "https://sci-hub.do/",
+    "https://libgen.ggfwzs.net/",
+]
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+                  "Chrome/120.0 Safari/537.36",
+}
+
+CONCURRENCY = 64      # 同时处理的 DOI 数
+GLOBAL_LIMIT = 128    # 连接池总连接数
+PER_HOST_LIMIT = 16   # 每个镜像的连接数
+RACE_WIDTH = 3        # 每个 DOI 同时竞速的镜像数
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 30     # 两次读到数据之间的最长间隔，大文件不会因总时长超时
+CHUNK_SIZE = 1 << 16
+
+# 落地页中的 PDF 链接：完整 URL、省略协议的 //host/path.pdf 或站内路径 /path.pdf
+PDF_LINK = re.compile(r"""(?:https?:)?//[^\s"'<>]+?\.pdf|/[^\s"'<>]+?\.pdf""")
+
+
+@dataclass
+class Result:
+    doi: str
+    status: str                      # "done" / "skipped"（已在仓库中）/ "failed"
+    path: Optional[str] = None
+    mirror: Optional[str] = None
+    bytes: int = 0
+    seconds: float = 0.0
+    errors: Dict[str, str] = field(default_factory=dict)  # 镜像 -> 失败原因
+
+
+def find_pdf_url(html: str, page_url: str) -> Optional[str]:
+    """
+    落地页里第一个 PDF 链接的绝对地址（跳过落地页地址本身）。
+    原 scrawler01 用 '/.*?\\.pdf' 匹配并取第二个结果（download_url[1]），因为那个正则的第一个匹配
+    从页面里更早的 "/" 开始、跨过标签，不是链接；PDF_LINK 不匹配引号和尖括号，第一个匹配就是链接
+    """
+    for link in PDF_LINK.findall(html):
+        url = urljoin(page_url, link)
+        if url != page_url:
+            return url
+    return None
+
+
+def pdf_file_name(pdf_url: str) -> str:
+    """沿用 scrawler01 的命名：URL 最后两段用 % 连接"""
+    parts = urlsplit(pdf_url).path.rstrip("/").split("/")
+    return f"{parts[-2]}%{parts[-1]}" if len(parts) >= 2 else parts[-1]
+
+
+class Downloader:
+    def __init__(self, out_dir: str, mirrors: Sequence[str] = MIRRORS, concurrency: int = CONCURRENCY,
+                 global_limit: int = GLOBAL_LIMIT, per_host_limit: int = PER_HOST_LIMIT,
+                 race_width: int = RACE_WIDTH, headers: Optional[dict] = None,
+                 store: Optional[DownloadStore] = None):
+        self.out_dir = out_dir
+        self.store = store
+        self.mirrors = list(dict.fromkeys(mirrors))  # 去掉重复的镜像
+        self.concurrency = concurrency
+        self.race_width = max(1, race_width)
+        self.global_limit = global_limit
+        self.per_host_limit = per_host_limit
+        self.headers = headers or HEADERS
+        self.session: Optional[aiohttp.ClientSession] = None
+        os.makedirs(out_dir, exist_ok=True)
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.global_limit, limit_per_host=self.per_host_limit,
+                                         ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout, headers=self.headers)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    def mirror_order(self, doi: str) -> List[str]:
+        """该 DOI 尝试镜像的顺序"""
+        return list(self.mirrors)
+
+    # ---------------- 单个镜像 ----------------
+    async def resolve(self, mirror: str, doi: str) -> str:
+        """请求镜像落地页并解析出 PDF 地址，失败时抛出异常"""
+        page_url = mirror + doi
+        with timer("http_fetch", stage="page", host=urlsplit(mirror).hostname):
+            async with self.session.get(page_url) as resp:
+                count("http_responses", host=urlsplit(mirror).hostname, status=resp.status)
+                resp.raise_for_status()
+                if resp.content_type == "application/pdf":  # 镜像直接返回 PDF
+                    return str(resp.url)
+                html = await resp.text(errors="replace")
+        pdf_url = find_pdf_url(html, str(resp.url))
+        if pdf_url is None:
+            raise LookupError("落地页中没有 PDF 链接")
+        return pdf_url
+
+    async def _stream(self, pdf_url: str, tmp_path: str) -> int:
+        """流式写入 tmp_path，已有部分内容时先尝试 Range 续传，返回文件总字节数"""
+        offset = os.path.getsize(tmp_path) if os.path.exists(tmp_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else None
+        with timer("http_fetch", stage="pdf", host=urlsplit(pdf_url).hostname):
+            async with self.session.get(pdf_url, headers=headers) as resp:
+                if resp.status == 416:  # 临时文件与服务器上的文件对不上，从头下载
+                    os.remove(tmp_path)
+                    return await self._stream(pdf_url, tmp_path)
+                resp.raise_for_status()
+                if offset and (resp.status != 206 or content_range_start(resp.headers.get("Content-Range")) != offset):
+                    offset = 0  # 服务器不支持续传，返回了完整文件
+                if offset:
+                    count("download_resumed")
+                size = offset
+                with open(tmp_path, "ab" if offset else "wb") as f:
+                    async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                        if size == 0 and not chunk.startswith(b"%PDF"):
+                            raise ValueError("返回的内容不是 PDF")
+                        f.write(chunk)
+                        size += len(chunk)
+                count("download_bytes", size - offset)
+        if size == 0:
+            raise ValueError("返回的内容为空")
+        return size
+
+    async def fetch_pdf(self, pdf_url: str, doi: str) -> Tuple[str, int]:
+        """下载到 .part 临时文件，确认是 PDF 后改名或入库，返回 (路径, 字节数)；
+        网络错误或被取消时保留 .part 以便续传，内容不对时删除"""
+        if self.store is not None:
+            path, tmp_path = None, self.store.partial_path(make_key("doi", doi), pdf_url)
+        else:
+            path = os.path.join(self.out_dir, pdf_file_name(pdf_url))
+            tmp_path = f"{path}.part"
+        try:
+            size = await self._stream(pdf_url, tmp_path)
+        except ValueError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if self.store is None:
+            os.replace(tmp_path, path)
+            return path, size
+        sha256 = await asyncio.to_thread(file_sha256, tmp_path)
+        return self.store.commit(make_key("doi", doi), tmp_path, sha256, source=pdf_url), size
+
+    # ---------------- 单个 DOI ----------------
+    async def _cancel(self, racing: Dict[asyncio.Task, str]) -> List[str]:
+        """取消仍在进行的落地页请求并等待其释放连接，返回这些镜像（按发起顺序）"""
+        for task in racing:
+            task.cancel()
+        await asyncio.gather(*racing, return_exceptions=True)
+        mirrors = list(racing.values())
+        racing.clear()
+        return mirrors
+
+    async def download(self, doi: str) -> Result:
+        """
+        镜像竞速：保持最多 race_width 个落地页请求，第一个拿到 PDF 链接的镜像负责下载；
+        拿到链接后立即取消其余落地页请求（不占用连接、不更新镜像状态），下载失败时才重新竞速；
+        结束时没有得到结果的镜像（被取消、已解析但未下载或未发起）逐个交给 on_cancel
+        """
+        if self.store is not None and (path := self.store.lookup(make_key("doi", doi))):
+            count("dois", status="skipped")
+            return Result(doi, "skipped", path)
+        start = time.perf_counter()
+        result = Result(doi, "failed")
+        waiting = self.mirror_order(doi)
+        unsettled = dict.fromkeys(waiting)  # 还没有调用 on_success / on_failure 的镜像
+        racing: Dict[asyncio.Task, str] = {}
+        started: Dict[str, float] = {}
+        resolved: List[Tuple[str, str, float]] = []  # 已拿到链接、尚未下载的 (镜像, PDF 地址, 落地页耗时)
+        try:
+            while waiting or racing or resolved:
+                if not resolved:
+                    while waiting and len(racing) < self.race_width:
+                        mirror = waiting.pop(0)
+                        racing[asyncio.create_task(self.resolve(mirror, doi))] = mirror
+                        started[mirror] = time.perf_counter()
+                    done, _ = await asyncio.wait(racing, return_when=asyncio.FIRST_COMPLETED)
+                    now = time.perf_counter()
+                    for task in done:
+                        mirror = racing.pop(task)
+                        try:
+                            resolved.append((mirror, task.result(), now - started[mirror]))
+                        except Exception as e:  # 落地页请求失败或没有 PDF 链接
+                            result.errors[mirror] = repr(e)
+                            unsettled.pop(mirror, None)
+                            self.on_failure(mirror, e, doi)
+                    if not resolved:
+                        continue
+                    # 被取消的镜像放回队首，下载失败时按原顺序重新竞速
+                    waiting[:0] = await self._cancel(racing)
+
+                mirror, pdf_url, latency = resolved.pop(0)
+                try:
+                    result.path, result.bytes = await self.fetch_pdf(pdf_url, doi)
+                except Exception as e:  # 网络错误、超时、不是 PDF 等，换下一个镜像
+                    result.errors[mirror] = repr(e)
+                    unsettled.pop(mirror, None)
+                    self.on_failure(mirror, e, doi)
+                    continue
+                result.status, result.mirror = "done", mirror
+                unsettled.pop(mirror, None)
+                self.on_success(mirror, latency, doi)
+                return result
+        finally:
+            await self._cancel(racing)
+            for mirror in unsettled:
+                self.on_cancel(mirror, doi)
+            result.seconds = round(time.perf_counter() - start, 3)
+            count("dois", status=result.status)
+        return result
+
+    def on_success(self, mirror: str, seconds: float, doi: str):
+        """某个镜像成功给出 PDF 时调用（seconds 为落地页响应耗时），可在子类中记录镜像状态"""
+
+    def on_failure(self, mirror: str, error: BaseException, doi: str):
+        """某个镜像失败时调用"""
+
+    def on_cancel(self, mirror: str, doi: str):
+        """本次下载结束时该镜像既没有成功也没有失败（竞速落败被取消、或没有轮到）"""
+
+    # ---------------- 批量 ----------------
+    async def run(self, dois: Iterable[str]) -> AsyncIterator[Result]:
+        """固定数量的协程从队列中取 DOI，内存占用与 DOI 总数无关；按完成顺序产出结果"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        results: asyncio.Queue = asyncio.Queue()
+
+        async def feed():
+            for doi in dois:
+                await queue.put(doi)
+            for _ in range(self.concurrency):
+                await queue.put(None)
+
+        async def work():
+            while (doi := await queue.get()) is not None:
+                await results.put(await self.download(doi))
+            await results.put(None)
+
+        tasks = [asyncio.create_task(feed())] + [asyncio.create_task(work()) for _ in range(self.concurrency)]
+        finished = 0
+        try:
+            while finished < self.concurrency:
+                item = await results.get()
+                if item is None:
+                    finished += 1
+                else:
+                    yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _download_all(dois: Sequence[str], out_dir: str, downloader_cls=Downloader, report_every: int = 100,
+                        **kwargs) -> List[Result]:
+    results = []
+    start = time.perf_counter()
+    async with downloader_cls(out_dir, **kwargs) as downloader:
+        async for result in downloader.run(dois):
+            results.append(result)
+            if result.status == "done":
+                print(f"下载成功 {result.doi} <- {result.mirror}（{result.bytes / 1e6:.1f} MB, {result.seconds:.1f} 秒）")
+            elif result.status == "skipped":
+                print(f"已存在 {result.doi}: {result.path}")
+            else:
+                print(f"下载失败 {result.doi}: {'; '.join(f'{m} {e}' for m, e in result.errors.items())}")
+            if len(results) % report_every == 0:
+                elapsed = time.perf_counter() - start
+                print(f"进度: {len(results)}/{len(dois)}, {len(results) / elapsed:.1f} 个/秒")
+    return results
+
+
+def download_all(dois: Sequence[str], out_dir: str, **kwargs) -> List[Result]:
+    """同步入口：下载全部 DOI，返回按完成顺序排列的结果"""
+    return asyncio.run(_download_all(list(dois), out_dir, **kwargs))
@@ -0,0 +1,101 @@
+# exportutil.py
+"""
+零拷贝导出：格式不变时不解码图片，依次尝试硬链接、reflink（写时复制）和字节复制；
+只有明确指定了不同的目标格式时才用 PIL 转码。
+"""
+from __future__ import annotations
+import os
+import shutil
+from typing import List, Optional, Sequence
+
+from PIL import Image
+
+FICLONE = 0x40049409  # Linux ioctl：btrfs / xfs 等文件系统上的 reflink
+
+# 扩展名 -> 规范格式名，同一格式的不同扩展名视为相同
+FORMATS = {".jpg": "jpeg", ".jpeg": "jpeg", ".png": "png", ".bmp": "bmp", ".gif": "gif",
+           ".tif": "tiff", ".tiff": "tiff", ".webp": "webp"}
+
+
+def _reflink(src: str, dst: str) -> bool:
+    try:
+        import fcntl
+    except ImportError:  # Windows
+        return False
+    with open(src, "rb") as fs, open(dst, "wb") as fd:
+        try:
+            fcntl.ioctl(fd.fileno(), FICLONE, fs.fileno())
+            return True
+        except OSError:
+            pass
+    os.remove(dst)
+    return False
+
+
+def copy_file(src: str, dst: str, link: bool = True) -> str:
+    """
+    把 src 原样放到 dst，返回使用的方式："link" / "reflink" / "copy"。
+    link=True 时优先硬链接（同一磁盘分区内不占额外空间）；注意硬链接与源文件共享内容。
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if link:
+        try:
+            os.link(src, dst)
+            return "link"
+        except OSError:
+            pass  # 跨分区、文件系统不支持等
+        if _reflink(src, dst):
+            return "reflink"
+    shutil.copyfile(src, dst)  # 内部使用 sendfile / copy_file_range 等快速路径
+    return "copy"
+
+
+def export_image(src: str, dst_stem: str, target_format: Optional[str] = None, link: bool = True) -> str:
+    """
+    导出图片到 dst_stem + 扩展名并返回实际路径。target_format 为 None 或与源格式相同时保留原扩展名、
+    不解码；否则（如 "png"）用 PIL 转码成该格式。
+    """
+    ext = os.path.splitext(src)[1].lower()
+    if target_format is None or FORMATS.get(ext) == FORMATS.get(f".{target_format.lower()}"):
+        dst = dst_stem + ext
+        copy_file(src, dst, link)
+        return dst
+    dst = f"{dst_stem}.{target_format.lower()}"
+    with Image.open(src) as img:
+        img.save(dst)
+    return dst
+
+
+def export_matched_pairs(article_folder: str, output_folder: str, valid_image_paths: Sequence[str],
+                         rows: Sequence[dict], target_format: Optional[str] = None,
+                         link: bool = True) -> List[List[str]]:
+    """
+    旧的输出方式：每张图片导出一份图片文件和最佳段落的 .txt（rows 为 results.match_rows 的结果），
+    图片按 export_image 导出；返回 [[图片路径, 文本路径], ...]
+    """
+    # 创建目录以保存配对结果
+    match_folder = os.path.join(output_folder, article_folder)
+    os.makedirs(match_folder, exist_ok=True)
+
+    outputs = []
+    for n, (image_path, row) in enumerate(zip(valid_image_paths, rows), start=1):
+        if row["text"] is None:
+            continue  # 没有高于阈值的段落
+
+        # 保存配对结果到指定文件夹
+        output_stem = os.path.join(match_folder, f"{article_folder}_{n}")
+        output_text_path = f"{output_stem}.txt"
+
+        # 导出图片：格式不变时直接链接或复制原文件，不再解码后重新保存
+        try:
+            output_image_path = export_image(image_path, output_stem, target_format, link)
+        except Exception as e:
+            print(f"保存图片时出错 '{image_path}' 到 '{output_stem}': {e}")
+            continue
+
+        # 保存匹配的段落文本
+        with open(output_text_path, "w", encoding="utf-8") as f:
+            f.write(row["text"])
+        outputs.append([output_image_path, output_text_path])
+    return outputs
@@ -0,0 +1,229 @@
+# featcache.py
+"""
+CLIP 特征的磁盘缓存：SQLite 索引 + float16 分片文件（按需 memmap 读取）。
+
+键 = SHA-256(模型名 + 类型 + 内容)，内容为图片原始字节或归一化后的段落文本；
+总大小超过 max_bytes 时按最近使用时间（LRU）淘汰并压缩分片。
+多个进程可以共用同一个缓存目录：索引使用 WAL 模式，追加分片和淘汰都在 SQLite 写锁（BEGIN IMMEDIATE）内进行。
+分片编号自增且从不复用，其他进程按编号缓存的 memmap 不会指向被压缩删除后重建的同名文件。
+"""
+from __future__ import annotations
+import hashlib
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from typing import Dict, Sequence
+
+import numpy as np
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS features (
+    key TEXT PRIMARY KEY, shard INTEGER, row INTEGER, dim INTEGER, last_used REAL
+);
+CREATE INDEX IF NOT EXISTS idx_features_lru ON features(last_used);
+CREATE TABLE IF NOT EXISTS shards (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, dim INTEGER, rows INTEGER
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha256 TEXT
+);
+"""
+
+DEFAULT_MAX_BYTES = 2 << 30   # 2 GiB
+SHARD_ROWS = 65536            # 单个分片最多行数
+HASH_BLOCK = 1 << 20
+LOCK_TIMEOUT = 600            # 等待其他进程释放写锁的秒数
+SHARD_FILE = re.compile(r"shard_(\d+)\.f16$")
+
+
+def normalize_text(text: str) -> str:
+    """段落文本归一化：NFKC + 合并空白，保证同一段落得到同一个键"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class FeatureCache:
+    def __init__(self, root: str, model_name: str, max_bytes: int = DEFAULT_MAX_BYTES,
+                 shard_rows: int = SHARD_ROWS):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.model_name = model_name
+        self.max_bytes = max_bytes
+        self.shard_rows = shard_rows
+        self.db = sqlite3.connect(os.path.join(root, "index.sqlite"), timeout=LOCK_TIMEOUT)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        self._migrate()
+        self._maps: Dict[int, np.memmap] = {}
+
+    def _migrate(self):
+        """旧版索引的 shards 表没有 AUTOINCREMENT（删除最大编号的分片后编号会被复用），重建该表"""
+        sql = "SELECT sql FROM sqlite_master WHERE type='table' AND name='shards'"
+        if "AUTOINCREMENT" in self.db.execute(sql).fetchone()[0].upper():
+            return
+        self._begin_write()
+        if "AUTOINCREMENT" not in self.db.execute(sql).fetchone()[0].upper():  # 其他进程可能已经迁移
+            self.db.execute("ALTER TABLE shards RENAME TO shards_old")
+            self.db.execute("CREATE TABLE shards (id INTEGER PRIMARY KEY AUTOINCREMENT, dim INTEGER, rows INTEGER)")
+            self.db.execute("INSERT INTO shards SELECT id, dim, rows FROM shards_old")
+            self.db.execute("DROP TABLE shards_old")
+            # 已删除但残留在磁盘上的分片文件编号也不再使用
+            on_disk = [int(m.group(1)) for m in map(SHARD_FILE.match, os.listdir(self.root)) if m]
+            last = max(on_disk + [self.db.execute("SELECT COALESCE(MAX(id), 0) FROM shards").fetchone()[0]])
+            self.db.execute("DELETE FROM sqlite_sequence WHERE name='shards'")
+            self.db.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('shards', ?)", (last,))
+        self.db.commit()
+
+    # ---------------- 键 ----------------
+    def _key(self, kind: str, digest: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{kind}\0{digest}".encode("utf-8")).hexdigest()
+
+    def image_key(self, path: str) -> str:
+        """图片键：文件内容的 SHA-256；(路径, 大小, mtime) 未变时复用上次的哈希，不再读文件"""
+        st = os.stat(path)
+        apath = os.path.abspath(path)
+        row = self.db.execute("SELECT size, mtime_ns, sha256 FROM files WHERE path=?", (apath,)).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            digest = row[2]
+        else:
+            digest = file_sha256(path)
+            self.db.execute("INSERT OR REPLACE INTO files VALUES (?,?,?,?)",
+                            (apath, st.st_size, st.st_mtime_ns, digest))
+        return self._key("image", digest)
+
+    def text_key(self, text: str, variant: str = "") -> str:
+        """文本键；variant 区分同一文本的不同编码方式（如滑动窗口池化）"""
+        digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+        return self._key(f"text{variant}", digest)
+
+    # ---------------- 分片 ----------------
+    def _shard_path(self, shard: int) -> str:
+        return os.path.join(self.root, f"shard_{shard:06d}.f16")
+
+    def _shard_map(self, shard: int, dim: int, need_rows: int) -> np.memmap:
+        m = self._maps.get(shard)
+        if m is None or m.shape[0] < need_rows:  # 分片在追加后需要重新映射
+            rows = os.path.getsize(self._shard_path(shard)) // (dim * 2)
+            m = np.memmap(self._shard_path(shard), dtype=np.float16, mode="r", shape=(rows, dim))
+            self._maps[shard] = m
+        return m
+
+    def _append(self, dim: int, feats: np.ndarray):
+        """把 feats 追加到 dim 对应的活动分片，返回 [(shard, row), ...]"""
+        out = []
+        feats = np.ascontiguousarray(feats, dtype=np.float16)
+        start = 0
+        while start < len(feats):
+            row = self.db.execute("SELECT id, rows FROM shards WHERE dim=? ORDER BY id DESC LIMIT 1",
+                                  (dim,)).fetchone()
+            if row is None or row[1] >= self.shard_rows:
+                shard = self.db.execute("INSERT INTO shards (dim, rows) VALUES (?, 0)", (dim,)).lastrowid
+                used = 0
+            else:
+                shard, used = row
+            n = min(self.shard_rows - used, len(feats) - start)
+            with open(self._shard_path(shard), "ab") as f:
+                f.write(feats[start:start + n].tobytes())
+            self.db.execute("UPDATE shards SET rows=? WHERE id=?", (used + n, shard))
+            out.extend((shard, used + i) for i in range(n))
+            start += n
+        return out
+
+    # ---------------- 读写 ----------------
+    def get_many(self, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        """返回命中的 {key: float32 特征}，未命中的键不出现在结果里"""
+        hits: Dict[str, np.ndarray] = {}
+        uniq = list(dict.fromkeys(keys))
+        for start in range(0, len(uniq), 900):  # SQLite 变量个数上限
+            chunk = uniq[start:start + 900]
+            rows = self.db.execute(
+                f"SELECT key, shard, row, dim FROM features WHERE key IN ({','.join('?' * len(chunk))})",
+                chunk).fetchall()
+            for key, shard, row, dim in rows:
+                try:
+                    hits[key] = np.asarray(self._shard_map(shard, dim, row + 1)[row], dtype=np.float32)
+                except (OSError, ValueError, IndexError):
+                    self._maps.pop(shard, None)  # 分片刚被其他进程压缩掉，按未命中处理
+        if hits:
+            now = time.time()
+            self.db.executemany("UPDATE features SET last_used=? WHERE key=?", [(now, k) for k in hits])
+        self.db.commit()  # 同时提交 image_key 写入的文件哈希，不在编码期间占着写锁
+        return hits
+
+    def _begin_write(self):
+        """提交未完成的隐式事务后获取写锁，读分片行数、追加文件、更新索引之间不会插入其他进程的写入"""
+        if self.db.in_transaction:
+            self.db.commit()
+        self.db.execute("BEGIN IMMEDIATE")
+
+    def put_many(self, keys: Sequence[str], feats: np.ndarray):
+        """写入 [N, D] 特征（与 keys 一一对应），超出容量时触发淘汰"""
+        if not len(keys):
+            return
+        dim = feats.shape[1]
+        now = time.time()
+        self._begin_write()
+        locs = self._append(dim, feats)
+        self.db.executemany("INSERT OR REPLACE INTO features VALUES (?,?,?,?,?)",
+                            [(k, s, r, dim, now) for k, (s, r) in zip(keys, locs)])
+        self.db.commit()
+        if self.disk_bytes() > self.max_bytes:
+            self.evict()
+
+    # ---------------- 淘汰 ----------------
+    def disk_bytes(self) -> int:
+        return self.db.execute("SELECT COALESCE(SUM(rows * dim * 2), 0) FROM shards").fetchone()[0]
+
+    def evict(self, target_ratio: float = 0.8):
+        """按 LRU 删除条目直到存活数据不超过 target_ratio * max_bytes，再压缩稀疏分片"""
+        self._begin_write()
+        live = self.db.execute("SELECT COALESCE(SUM(dim * 2), 0) FROM features").fetchone()[0]
+        target = int(self.max_bytes * target_ratio)
+        if live > target:
+            drop, freed = [], 0
+            for key, dim in self.db.execute("SELECT key, dim FROM features ORDER BY last_used"):
+                if live - freed <= target:
+                    break
+                drop.append((key,))
+                freed += dim * 2
+            self.db.executemany("DELETE FROM features WHERE key=?", drop)
+        self._compact()
+        self.db.commit()
+
+    def _compact(self):
+        """存活率低于一半的分片：把存活行搬到活动分片后删除原文件"""
+        shards = self.db.execute("""
+            SELECT s.id, s.dim, s.rows, COUNT(f.key) FROM shards s
+            LEFT JOIN features f ON f.shard = s.id GROUP BY s.id""").fetchall()
+        for shard, dim, rows, alive in shards:
+            if rows and alive * 2 >= rows:
+                continue
+            if alive:
+                moved = self.db.execute("SELECT key, row FROM features WHERE shard=? ORDER BY row",
+                                        (shard,)).fetchall()
+                data = np.array(self._shard_map(shard, dim, rows)[[r for _, r in moved]])
+                # 先把原分片标记为已满，避免追加回自己
+                self.db.execute("UPDATE shards SET rows=? WHERE id=?", (self.shard_rows, shard))
+                locs = self._append(dim, data)
+                self.db.executemany("UPDATE features SET shard=?, row=? WHERE key=?",
+                                    [(s, r, k) for (k, _), (s, r) in zip(moved, locs)])
+            self._maps.pop(shard, None)
+            self.db.execute("DELETE FROM shards WHERE id=?", (shard,))
+            try:
+                os.remove(self._shard_path(shard))
+            except OSError as e:
+                print(f"删除缓存分片 '{self._shard_path(shard)}' 时出错: {e}")
+
+    def close(self):
+        self._maps.clear()
+        self.db.commit()
+        self.db.close()
@@ -0,0 +1,54 @@
+# journal.py
+"""
+追加写入的 JSONL 运行日志（manifest）：每处理完一项写一行记录，
+重启时读取日志即可跳过已完成的项；崩溃时写了一半的末行会被忽略。
+"""
+from __future__ import annotations
+import json
+import os
+import time
+from typing import Dict, Iterable, Optional
+
+FINISHED = ("done",)  # "skipped" 等状态由调用方按需重新检查（如文章目录还没有解析完）
+
+
+class Journal:
+    def __init__(self, path: str, key: str = "id"):
+        self.path = path
+        self.key = key
+        self.records: Dict[str, dict] = {}  # 每个键只保留最后一条记录
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # 崩溃时未写完的行
+                    self.records[record[key]] = record
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._f = open(path, "a", encoding="utf-8")
+
+    def is_finished(self, item_id: str, statuses: Iterable[str] = FINISHED) -> bool:
+        record = self.records.get(item_id)
+        return record is not None and record.get("status") in statuses
+
+    def get(self, item_id: str) -> Optional[dict]:
+        return self.records.get(item_id)
+
+    def append(self, item_id: str, status: str, **fields) -> dict:
+        """写入一条记录并立即落盘"""
+        record = {self.key: item_id, "status": status, "time": time.strftime("%Y-%m-%d %H:%M:%S"), **fields}
+        self._f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self.records[item_id] = record
+        return record
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
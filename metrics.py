@@ -0,0 +1,236 @@
+# metrics.py
+"""
+流水线各脚本共用的轻量指标：计数器、计时直方图，定期输出一行结构化日志（JSON），
+并写出 Prometheus 文本格式的指标文件；可选用 cProfile 剖析整个运行。
+
+用法：
+    from metrics import count, timer
+    with timer("http_fetch", site="neurips"):
+        html = session.get(url).text
+    count("pdf_files", result="moved")
+
+脚本入口用 metrics.run(main, ...) 启动：每 PIPELINE_METRICS_INTERVAL 秒（默认 60）在 stderr 打印一行
+"[metrics] {...}"，并把全部指标写入 PIPELINE_METRICS_FILE（默认 ./metrics.<脚本名>.<pid>.prom）；
+设置 PIPELINE_PROFILE=<路径> 时用 cProfile 剖析整个运行，结果可用 snakeviz / pstats 查看。
+日志行里带有 pid，需要采样剖析时可直接 py-spy record --pid <pid> 附加到正在运行的进程。
+"""
+from __future__ import annotations
+import atexit
+import bisect
+import contextlib
+import cProfile
+import functools
+import io
+import json
+import math
+import os
+import pstats
+import sys
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+PREFIX = "pipeline_"
+# 直方图桶上界（秒），覆盖从单张图片解码到整篇 PDF 下载
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+
+REPORT_INTERVAL = float(os.environ.get("PIPELINE_METRICS_INTERVAL", 60))
+
+
+def _default_dump_path() -> str:
+    """默认指标文件按脚本名和 pid 区分，同时运行的多个脚本不会互相覆盖"""
+    script = os.path.splitext(os.path.basename(sys.argv[0] if sys.argv else ""))[0]
+    if not script or script.startswith("-"):  # python -c / 交互式
+        script = "python"
+    return f"metrics.{script}.{os.getpid()}.prom"
+
+
+DUMP_PATH = os.environ.get("PIPELINE_METRICS_FILE") or _default_dump_path()
+PROFILE_PATH = os.environ.get("PIPELINE_PROFILE")
+
+_Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: dict) -> _Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _label_text(labels) -> str:
+    return ",".join(f'{k}="{v}"' for k, v in labels)
+
+
+def _series(name: str, labels) -> str:
+    """Prometheus 序列名：标签值按文本格式转义，没有标签时省略花括号"""
+    if not labels:
+        return name
+    escaped = ((k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in labels)
+    return f"{name}{{{_label_text(escaped)}}}"
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count", "max")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """按桶估计分位数（返回所在桶的上界，最后一桶返回最大值）"""
+        target, seen = q * self.count, 0
+        for bound, n in zip(BUCKETS, self.counts):
+            seen += n
+            if seen >= target:
+                return self.max if math.isinf(bound) else bound
+        return self.max
+
+
+class Metrics:
+    """进程内指标注册表（线程安全）；多进程时每个进程各自统计"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[_Key, float] = {}
+        self.histograms: Dict[_Key, _Histogram] = {}
+        self.started = time.time()
+
+    def count(self, name: str, value: float = 1, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = _Histogram()
+            hist.observe(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels):
+        """计时代码块，记入直方图 name；块内抛出异常时另记 name_errors 计数"""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.count(f"{name}_errors", **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed(self, name: str, **labels):
+        """装饰器版本的 timer"""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # ---------------- 输出 ----------------
+    def log_line(self) -> str:
+        """一行 JSON：计数器总数，计时器的次数 / 总耗时 / 均值 / p50 / p95 / 最大值"""
+        with self.lock:
+            counters = {f"{n}{{{_label_text(l)}}}" if l else n: v for (n, l), v in self.counters.items()}
+            timers = {f"{n}{{{_label_text(l)}}}" if l else n: {
+                "count": h.count, "sum": round(h.sum, 3), "mean": round(h.sum / h.count, 4),
+                "p50": h.quantile(0.5), "p95": h.quantile(0.95), "max": round(h.max, 4),
+            } for (n, l), h in self.histograms.items()}
+        return json.dumps({"ts": time.strftime("%Y-%m-%dT%H:%M:%S"), "pid": os.getpid(),
+                           "uptime": round(time.time() - self.started, 1),
+                           "counters": counters, "timers": timers}, ensure_ascii=False)
+
+    def prometheus_text(self) -> str:
+        lines = []
+        with self.lock:
+            for name in sorted({n for n, _ in self.counters}):
+                lines.append(f"# TYPE {PREFIX}{name}_total counter")
+                for (n, labels), value in sorted(self.counters.items()):
+                    if n == name:
+                        lines.append(f"{_series(PREFIX + name + '_total', labels)} {value:g}")
+            for name in sorted({n for n, _ in self.histograms}):
+                lines.append(f"# TYPE {PREFIX}{name}_seconds histogram")
+                for (n, labels), hist in sorted(self.histograms.items(), key=lambda kv: kv[0]):
+                    if n != name:
+                        continue
+                    cumulative = 0
+                    for bound, c in zip(BUCKETS, hist.counts):
+                        cumulative += c
+                        le = "+Inf" if math.isinf(bound) else f"{bound:g}"
+                        lines.append(f"{_series(PREFIX + name + '_seconds_bucket', labels + (('le', le),))} "
+                                     f"{cumulative}")
+                    lines.append(f"{_series(PREFIX + name + '_seconds_sum', labels)} {hist.sum:.6f}")
+                    lines.append(f"{_series(PREFIX + name + '_seconds_count', labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str = DUMP_PATH):
+        """原子写出 Prometheus 文本（可交给 node_exporter 的 textfile collector）"""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+
+METRICS = Metrics()
+count = METRICS.count
+observe = METRICS.observe
+timer = METRICS.timer
+timed = METRICS.timed
+
+_reporter: Optional[threading.Thread] = None
+
+
+def report(dump_path: Optional[str] = DUMP_PATH, stream=None):
+    print(f"[metrics] {METRICS.log_line()}", file=stream or sys.stderr, flush=True)
+    if dump_path:
+        METRICS.dump(dump_path)
+
+
+def start_reporter(interval: float = REPORT_INTERVAL, dump_path: Optional[str] = DUMP_PATH):
+    """启动后台线程定期输出日志行并写指标文件，进程退出时再输出一次；重复调用无效"""
+    global _reporter
+    if _reporter is not None or interval <= 0:
+        return
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            report(dump_path)
+
+    _reporter = threading.Thread(target=loop, name="metrics-reporter", daemon=True)
+    _reporter.start()
+    atexit.register(report, dump_path)
+
+
+@contextlib.contextmanager
+def profiled(path: Optional[str] = PROFILE_PATH, top: int = 25):
+    """path 不为空时用 cProfile 剖析代码块，保存到 path 并打印累计耗时最多的 top 个函数"""
+    if not path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(top)
+        print(f"[profile] 已保存到 '{path}'\n{out.getvalue()}", file=sys.stderr)
+
+
+def run(fn, *args, **kwargs):
+    """脚本入口：启动定期指标输出，按 PIPELINE_PROFILE 决定是否剖析，然后调用 fn"""
+    start_reporter()
+    with profiled():
+        return fn(*args, **kwargs)
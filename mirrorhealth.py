@@ -0,0 +1,214 @@
+# mirrorhealth.py
+"""
+镜像健康登记与自适应路由：为每个镜像记录成功率（EWMA）、落地页延迟（EWMA）和连续失败次数，
+按"期望耗时 = 延迟 / 成功率"从小到大排序，每个 DOI 先发往当前最好的镜像。
+
+熔断：连续失败 BREAKER_THRESHOLD 次后断开 BREAKER_COOLDOWN 秒，期间不再路由到该镜像；
+冷却结束后进入半开状态，只放行一个探测请求（排在竞速的第一位），成功则恢复，失败则冷却时间翻倍；
+探测属于某个 DOI 的下载，熔断前已发出的其他请求此时失败不算探测失败，探测竞速落败被取消时立即释放探测名额。
+"论文不在该镜像上"（落地页没有 PDF 链接 / 404）只计入成功率，不算镜像故障。
+
+状态保存在一个小 JSON 文件中，下次运行继续使用（熔断截止时间为墙钟时间，重启后仍然有效）。
+"""
+from __future__ import annotations
+import json
+import os
+import time
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import aiohttp
+
+from doidownload import Downloader, READ_TIMEOUT
+from metrics import count
+
+EWMA_ALPHA = 0.2           # 新观测值的权重
+DEFAULT_LATENCY = 5.0      # 没有记录的镜像的初始延迟估计（秒），第一次成功后被实测值取代
+DEFAULT_SUCCESS = 0.5      # 以及初始成功率
+MIN_SUCCESS = 0.05         # 排序时成功率的下限，避免除零
+BREAKER_THRESHOLD = 5      # 连续失败多少次后熔断
+BREAKER_COOLDOWN = 300.0   # 首次熔断时长（秒），之后每次翻倍
+MAX_COOLDOWN = 6 * 3600.0
+PROBE_TIMEOUT = 2 * READ_TIMEOUT  # 半开探测超过这个时间没有结果，允许再次探测
+SAVE_EVERY = 50            # 每记录多少次结果保存一次状态文件
+
+
+@dataclass
+class MirrorStats:
+    successes: int = 0
+    failures: int = 0
+    misses: int = 0                    # 镜像正常但没有这篇论文
+    success_rate: float = DEFAULT_SUCCESS
+    latency: float = DEFAULT_LATENCY
+    consecutive_failures: int = 0
+    open_until: float = 0.0            # 熔断截止时间（time.time()），0 表示闭合
+    cooldown: float = BREAKER_COOLDOWN
+    last_error: str = ""
+
+    def cost(self) -> float:
+        """期望耗时：越小越优先；还没有任何记录的镜像排最前，先试一次"""
+        if self.successes + self.failures + self.misses == 0:
+            return 0.0
+        return self.latency / max(self.success_rate, MIN_SUCCESS)
+
+
+def is_miss(error: BaseException) -> bool:
+    """论文不在该镜像上，而不是镜像出了问题"""
+    return isinstance(error, LookupError) or (
+        isinstance(error, aiohttp.ClientResponseError) and error.status == 404)
+
+
+class MirrorRegistry:
+    def __init__(self, path: Optional[str] = None, mirrors: Sequence[str] = ()):
+        self.path = path
+        self.stats: Dict[str, MirrorStats] = {}
+        self.probing: Dict[str, Tuple[str, float]] = {}  # 半开状态下正在探测的镜像 -> (DOI, 开始时间)
+        self.pending = 0
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for mirror, record in json.load(f).get("mirrors", {}).items():
+                    self.stats[mirror] = MirrorStats(**record)
+        for mirror in mirrors:
+            self.stats.setdefault(mirror, MirrorStats())
+
+    def get(self, mirror: str) -> MirrorStats:
+        return self.stats.setdefault(mirror, MirrorStats())
+
+    # ---------------- 路由 ----------------
+    def route(self, mirrors: Sequence[str], doi: str = "") -> List[str]:
+        """本次请求（doi）的镜像顺序：半开镜像的探测排第一，其余闭合镜像按期望耗时排序；
+        全部熔断时只返回最快恢复的一个，避免整批 DOI 直接失败"""
+        now = time.time()
+        closed, probes, blocked = [], [], []
+        for mirror in dict.fromkeys(mirrors):
+            stats = self.get(mirror)
+            if stats.open_until == 0:
+                closed.append(mirror)
+            elif stats.open_until <= now and now - self.probing.get(mirror, ("", 0.0))[1] > PROBE_TIMEOUT:
+                probes.append(mirror)
+            else:
+                blocked.append(mirror)
+        closed.sort(key=lambda m: self.stats[m].cost())
+        order = probes[:1] + closed
+        for mirror in probes[:1]:
+            self.probing[mirror] = (doi, now)
+        if not order and blocked:
+            order = [min(blocked, key=lambda m: self.stats[m].open_until)]
+        return order
+
+    # ---------------- 记录结果 ----------------
+    def record_success(self, mirror: str, seconds: float):
+        stats = self.get(mirror)
+        stats.successes += 1
+        stats.success_rate += EWMA_ALPHA * (1.0 - stats.success_rate)
+        stats.latency = seconds if stats.successes == 1 else stats.latency + EWMA_ALPHA * (seconds - stats.latency)
+        self._close(mirror, stats)
+        self._changed()
+
+    def is_probe(self, mirror: str, doi: str) -> bool:
+        return mirror in self.probing and self.probing[mirror][0] == doi
+
+    def release_probe(self, mirror: str, doi: str):
+        """探测请求没有结果（竞速落败被取消），让下一个 DOI 重新探测"""
+        if self.is_probe(mirror, doi):
+            del self.probing[mirror]
+
+    def record_failure(self, mirror: str, error: BaseException, doi: str = ""):
+        stats = self.get(mirror)
+        stats.last_error = f"{type(error).__name__}: {error}"[:200]
+        stats.success_rate -= EWMA_ALPHA * stats.success_rate
+        if is_miss(error):  # 镜像能正常响应，视同存活
+            stats.misses += 1
+            self._close(mirror, stats)
+            self._changed()
+            return
+        stats.failures += 1
+        stats.consecutive_failures += 1
+        if stats.open_until:
+            if self.is_probe(mirror, doi):  # 半开探测失败，冷却时间翻倍
+                stats.cooldown = min(stats.cooldown * 2, MAX_COOLDOWN)
+                self._open(mirror, stats)
+            # 否则是熔断前已发出的请求（探测进行中也一样），不再延长
+        elif stats.consecutive_failures >= BREAKER_THRESHOLD:
+            self._open(mirror, stats)
+        self._changed()
+
+    def _open(self, mirror: str, stats: MirrorStats):
+        stats.open_until = time.time() + stats.cooldown
+        self.probing.pop(mirror, None)
+        count("mirror_breaker_open", mirror=mirror)
+        print(f"镜像熔断 {stats.cooldown:.0f} 秒: {mirror}（{stats.last_error}）")
+
+    def _close(self, mirror: str, stats: MirrorStats):
+        if stats.open_until:
+            print(f"镜像恢复: {mirror}")
+        stats.consecutive_failures = 0
+        stats.open_until = 0.0
+        stats.cooldown = BREAKER_COOLDOWN
+        self.probing.pop(mirror, None)
+
+    def _changed(self):
+        self.pending += 1
+        if self.pending >= SAVE_EVERY:
+            self.save()
+
+    # ---------------- 持久化 ----------------
+    def save(self):
+        self.pending = 0
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"saved": time.strftime("%Y-%m-%d %H:%M:%S"),
+                       "mirrors": {m: asdict(s) for m, s in self.stats.items()}}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def summary(self) -> str:
+        now = time.time()
+        lines = []
+        for mirror, stats in sorted(self.stats.items(), key=lambda kv: kv[1].cost()):
+            state = "熔断" if stats.open_until > now else "半开" if stats.open_until else "正常"
+            lines.append(f"{mirror}  {state}  成功率 {stats.success_rate:.2f}  延迟 {stats.latency:.2f}s  "
+                         f"成功/失败/无此文 {stats.successes}/{stats.failures}/{stats.misses}")
+        return "\n".join(lines)
+
+
+class RoutedDownloader(Downloader):
+    """按 MirrorRegistry 的排序选择镜像，并把每个镜像的结果记回登记表"""
+
+    def __init__(self, out_dir: str, registry: Optional[MirrorRegistry] = None, **kwargs):
+        super().__init__(out_dir, **kwargs)
+        self.registry = registry or MirrorRegistry(mirrors=self.mirrors)
+
+    async def __aexit__(self, *exc):
+        self.registry.save()
+        await super().__aexit__(*exc)
+
+    def mirror_order(self, doi: str) -> List[str]:
+        return self.registry.route(self.mirrors, doi)
+
+    def on_success(self, mirror: str, seconds: float, doi: str):
+        self.registry.record_success(mirror, seconds)
+
+    def on_failure(self, mirror: str, error: BaseException, doi: str):
+        self.registry.record_failure(mirror, error, doi)
+
+    def on_cancel(self, mirror: str, doi: str):
+        self.registry.release_probe(mirror, doi)
+
+
+def write_retry_queue(path: str, results) -> List[str]:
+    """把失败的 DOI 写入重试队列文件（每行一个），返回失败列表；全部成功时写空文件"""
+    fails = [r.doi for r in results if r.status == "failed"]
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.writelines(f"{doi}\n" for doi in fails)
+    return fails
+
+
+def read_retry_queue(path: str) -> List[str]:
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
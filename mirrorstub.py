@@ -0,0 +1,112 @@
+# mirrorstub.py
+"""
+本地替身镜像（aiohttp.web），用于离线测试 doidownload：
+GET /<doi> 返回带 PDF 链接的落地页，GET /pdf/<名字>.pdf 分块返回一个假 PDF。
+每个端口一个镜像，可分别设置延迟和出错概率，模拟慢镜像与挂掉的镜像；
+PDF 支持 Range 请求，并可按 cut_rate 的概率传到一半断开连接，用来测试续传。
+
+启动：python mirrorstub.py --ports 8001 8002 8003 --delays 0 2 0 --fail-rates 0 0 1
+然后用 http://127.0.0.1:8001/ 等地址作为 doidownload 的镜像列表。
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import random
+import re
+from typing import List, Sequence
+
+from aiohttp import web
+
+PDF_SIZE = 1 << 20   # 假 PDF 的大小
+CHUNK_SIZE = 1 << 16
+
+
+def fake_pdf(name: str, size: int = PDF_SIZE) -> bytes:
+    head = f"%PDF-1.4\n% {name}\n".encode("utf-8")
+    return head + b"0" * max(0, size - len(head))
+
+
+def make_app(delay: float = 0.0, fail_rate: float = 0.0, pdf_size: int = PDF_SIZE,
+             cut_rate: float = 0.0) -> web.Application:
+    """delay 秒后响应；按 fail_rate 的概率返回 503（落地页和 PDF 都适用）"""
+    stats = {"pages": 0, "pdfs": 0, "cancelled": 0, "ranges": 0, "cuts": 0}
+
+    async def maybe_fail():
+        await asyncio.sleep(delay)
+        if random.random() < fail_rate:
+            raise web.HTTPServiceUnavailable()
+
+    async def page(request: web.Request):
+        stats["pages"] += 1
+        try:
+            await maybe_fail()
+        except asyncio.CancelledError:  # 客户端取消了竞速失败的请求
+            stats["cancelled"] += 1
+            raise
+        doi = request.match_info["doi"]
+        name = doi.replace("/", "_")
+        return web.Response(text=f'<html><body><iframe src="//{request.host}/pdf/{name}.pdf"></iframe></body></html>',
+                            content_type="text/html")
+
+    async def pdf(request: web.Request):
+        stats["pdfs"] += 1
+        await maybe_fail()
+        body = fake_pdf(request.match_info["name"], pdf_size)
+        offset = 0
+        m = re.match(r"bytes=(\d+)-$", request.headers.get("Range", ""))
+        if m:
+            offset = int(m.group(1))
+            if offset >= len(body):
+                raise web.HTTPRequestRangeNotSatisfiable()
+            stats["ranges"] += 1
+        resp = web.StreamResponse(status=206 if offset else 200, headers={"Content-Type": "application/pdf"})
+        if offset:
+            resp.headers["Content-Range"] = f"bytes {offset}-{len(body) - 1}/{len(body)}"
+        resp.content_length = len(body) - offset
+        await resp.prepare(request)
+        cut = len(body) // 2 if random.random() < cut_rate else len(body)
+        for start in range(offset, len(body), CHUNK_SIZE):
+            if start >= cut:  # 模拟传输中断
+                stats["cuts"] += 1
+                request.transport.close()
+                return resp
+            await resp.write(body[start:start + CHUNK_SIZE])
+        await resp.write_eof()
+        return resp
+
+    app = web.Application()
+    app["stats"] = stats
+    app.router.add_get("/pdf/{name}.pdf", pdf)
+    app.router.add_get("/{doi:.+}", page)
+    return app
+
+
+async def start(ports: Sequence[int], delays: Sequence[float], fail_rates: Sequence[float],
+                host: str = "127.0.0.1", cut_rate: float = 0.0) -> List[web.AppRunner]:
+    """在当前事件循环中启动多个镜像，返回 runner 列表（用 runner.cleanup() 关闭）"""
+    runners = []
+    for port, delay, fail_rate in zip(ports, delays, fail_rates):
+        runner = web.AppRunner(make_app(delay, fail_rate, cut_rate=cut_rate), handler_cancellation=True)  # 客户端断开时取消处理函数
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        runners.append(runner)
+    return runners
+
+
+async def _serve_forever(ports, delays, fail_rates, host, cut_rate):
+    await start(ports, delays, fail_rates, host, cut_rate)
+    print(f"替身镜像已启动: {', '.join(f'http://{host}:{p}/' for p in ports)}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地替身镜像，用于测试 doidownload")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--ports", type=int, nargs="+", default=[8001, 8002, 8003])
+    parser.add_argument("--delays", type=float, nargs="+")
+    parser.add_argument("--fail-rates", type=float, nargs="+")
+    parser.add_argument("--cut-rate", type=float, default=0.0, help="PDF 传到一半断开连接的概率")
+    args = parser.parse_args()
+    delays = args.delays or [0.0] * len(args.ports)
+    fail_rates = args.fail_rates or [0.0] * len(args.ports)
+    asyncio.run(_serve_forever(args.ports, delays, fail_rates, args.host, args.cut_rate))
@@ -1,89 +1,99 @@
+'''
+查找文本内容重复的图文对（.txt + .jpg），移动到输出目录并按内容分组。
+重复判断由 dedup 完成：先按文件大小分桶，再对大小相同的文件多线程流式计算哈希；
+哈希保存在输入目录下的索引中，重跑时只重新计算新增或改动过的文件。
+near_duplicates 为 True 时改用 neardup 的 MinHash 近重复簇（只差空白、标点等的段落也算重复）。
+'''
 import os
 import shutil
-from collections import defaultdict
 
-def read_file_content(file_path):
-    """读取文本文件的内容"""
-    with open(file_path, 'r', encoding='utf-8') as file:
-        return file.read()
+from dedup import HashIndex, group_by_content
 
-def find_duplicates(input_dir, output_dir):
+index_name = ".dedup_index.sqlite"
+near_duplicates = False
+
+
+def duplicate_groups(txt_paths, index, include_unique=False):
+    """内容相同（或近重复）的文件分组"""
+    if not near_duplicates:
+        return group_by_content(txt_paths, index, include_unique=include_unique)
+    from neardup import cluster_text_files  # 近重复模式才需要（会导入 PIL 等）
+    groups = cluster_text_files(txt_paths)
+    if include_unique:
+        grouped = {p for g in groups for p in g}
+        groups += [[p] for p in txt_paths if p not in grouped]
+    return groups
+
+
+def move_with_index(src, dst, index):
+    shutil.move(src, dst)
+    if index is not None:
+        index.move(src, dst)
+
+
+def find_duplicates(input_dir, output_dir, index=None):
     """查找重复的.txt文件，并移动相应的.jpg和.txt文件到输出目录"""
-    # 存储文本内容及其对应的文件路径
-    content_dict = defaultdict(list)
-    
-    # 遍历输入目录下的所有子目录
+    # 遍历输入目录下的所有子目录，收集其中的所有.txt文件
+    txt_paths = []
     for subdir in os.scandir(input_dir):
         if subdir.is_dir():
-            # 对于每个子目录，遍历其中的所有文件
             for file in os.scandir(subdir.path):
                 if file.name.endswith('.txt'):
-                    content = read_file_content(file.path)
-                    # 将内容相同的文件路径添加到列表中
-                    content_dict[content].append((subdir.name, file.name[:-4]))
-    
+                    txt_paths.append(file.path)
+
     # 根据找到的重复项进行操作
-    for duplicates in content_dict.values():
-        if len(duplicates) > 1:
-            for (subdir_name, base_name) in duplicates:
-                src_jpg = os.path.join(input_dir, subdir_name, f"{base_name}.jpg")
-                src_txt = os.path.join(input_dir, subdir_name, f"{base_name}.txt")
-                
-                dst_subdir = os.path.join(output_dir, subdir_name)
-                if not os.path.exists(dst_subdir):
-                    os.makedirs(dst_subdir)
-                
-                shutil.move(src_jpg, os.path.join(dst_subdir, f"{base_name}.jpg"))
-                shutil.move(src_txt, os.path.join(dst_subdir, f"{base_name}.txt"))
-
-def group_files_by_content(source_folder):
-    # 创建一个字典来存储内容相同的所有文件路径
-    content_to_files = {}
-
-    # 遍历源文件夹中的所有文件
-    for filename in os.listdir(source_folder):
-        if filename.endswith('.txt'):
-            file_path = os.path.join(source_folder, filename)
-            with open(file_path, 'r') as file:
-                content = read_file_content(file_path)
-                
-                # 如果内容不在字典中，则创建一个新的键值对
-                if content not in content_to_files:
-                    content_to_files[content] = []
-                    
-                # 将文件路径添加到对应的内容列表中
-                content_to_files[content].append(filename)
+    for duplicates in duplicate_groups(txt_paths, index):
+        for txt_path in duplicates:
+            subdir_name = os.path.basename(os.path.dirname(txt_path))
+            base_name = os.path.basename(txt_path)[:-4]
+            src_jpg = os.path.join(input_dir, subdir_name, f"{base_name}.jpg")
+            src_txt = os.path.join(input_dir, subdir_name, f"{base_name}.txt")
+
+            dst_subdir = os.path.join(output_dir, subdir_name)
+            if not os.path.exists(dst_subdir):
+                os.makedirs(dst_subdir)
+
+            shutil.move(src_jpg, os.path.join(dst_subdir, f"{base_name}.jpg"))
+            move_with_index(src_txt, os.path.join(dst_subdir, f"{base_name}.txt"), index)
+
+
+def group_files_by_content(source_folder, index=None):
+    # 内容相同的所有文件分为一组（包括没有重复的文件，单独成组）
+    txt_paths = [os.path.join(source_folder, filename) for filename in os.listdir(source_folder)
+                 if filename.endswith('.txt')]
+    groups = duplicate_groups(txt_paths, index, include_unique=True)
 
     # 按顺序编号创建新文件夹并将文件移动进去
-    folder_index = 1
-    for content, files in content_to_files.items():
+    for folder_index, files in enumerate(groups, start=1):
         new_folder_name = f"group_{folder_index}"
         new_folder_path = os.path.join(source_folder, new_folder_name)
         os.makedirs(new_folder_path, exist_ok=True)
-        
-        for file in files:
-            base_filename = os.path.splitext(file)[0]
-            
+
+        for txt_file_path in files:
+            base_filename = os.path.splitext(os.path.basename(txt_file_path))[0]
+
             # 移动.txt文件
-            txt_file_path = os.path.join(source_folder, file)
-            shutil.move(txt_file_path, new_folder_path)
-            
+            move_with_index(txt_file_path, os.path.join(new_folder_path, os.path.basename(txt_file_path)), index)
+
             # 移动.jpg文件（如果有）
             jpg_file_path = os.path.join(source_folder, f"{base_filename}.jpg")
             if os.path.exists(jpg_file_path):
                 shutil.move(jpg_file_path, new_folder_path)
-        
-        folder_index += 1
 
-def same_content(dir):
+
+def same_content(dir, index=None):
     """主处理函数，遍历输入文件夹并处理每个子文件夹"""
     for folder in os.listdir(dir):
         folder_path = os.path.join(dir, folder)
         if os.path.isdir(folder_path):  # 确保是文件夹
-            group_files_by_content(folder_path)
-# 设置输入和输出目录
-input_directory = r"D:\多模态\自定义\图文对\origin"
-output_directory = r"D:\多模态\自定义\图文对\repeated"
+            group_files_by_content(folder_path, index)
+
+
+if __name__ == "__main__":
+    # 设置输入和输出目录
+    input_directory = r"D:\多模态\自定义\图文对\origin"
+    output_directory = r"D:\多模态\自定义\图文对\repeated"
 
-find_duplicates(input_directory, output_directory)
-same_content(output_directory)
\ No newline at end of file
+    with HashIndex(os.path.join(input_directory, index_name)) as index:
+        find_duplicates(input_directory, output_directory, index)
+        same_content(output_directory, index)
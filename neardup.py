@@ -0,0 +1,298 @@
+# neardup.py
+"""
+近重复检测：段落用 MinHash（去掉空白的归一化文本的字符 k-gram），图片用感知哈希（pHash + dHash，NumPy 计算）；
+两者都用分段（banded）LSH 查找候选：签名切成若干段，任一段完全相同才比较，不做两两比较。
+
+每个 LSH 桶最多保留 MAX_BUCKET_REPS 个"代表"，新条目只与候选桶里的代表比较，
+命中则并入该代表的簇，否则自己成为新代表；单个条目的开销与总条目数无关，可扩展到百万级。
+
+输出 JSONL，每行一个簇：{"kind": "paragraph" | "image", "representative": ..., "members": [...]}；
+图片路径相对于 root_folder。clip_match_1 可以读取图片簇，近重复图片复用代表图片的特征；
+move_repeated 的 near_duplicates 模式用段落簇代替逐字节比较。
+
+用法：python neardup.py [root_folder] [--out clusters.jsonl]
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import re
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from articleutil import iter_articles
+from featcache import normalize_text
+from metrics import count, run, timer
+
+# ---------------- 段落 MinHash ----------------
+SHINGLE_SIZE = 5          # 字符 k-gram 长度（中文按字）
+NUM_PERM = 64             # MinHash 签名长度
+TEXT_BANDS = 8            # 8 段 x 8 行：Jaccard 约 0.77 以上大概率成为候选
+JACCARD_THRESHOLD = 0.8   # 估计的 Jaccard 相似度不低于该值视为近重复
+
+# ---------------- 图片感知哈希 ----------------
+HASH_SIZE = 8             # pHash / dHash 各 64 位
+PHASH_SIZE = 32           # pHash 先缩小到 32x32 再做 DCT
+IMAGE_BANDS = 8           # 128 位（pHash + dHash）切成 8 段，每段 16 位
+PHASH_DISTANCE = 8        # 汉明距离上限
+DHASH_DISTANCE = 12
+HASH_WORKERS = os.cpu_count() or 4
+HASH_PREFETCH = 4         # 每个线程最多领先入库的图片数，图片路径可以流式给出
+
+MAX_BUCKET_REPS = 16      # 每个桶最多比较的代表数，防止常见签名的桶退化为两两比较
+SEED = 1
+
+
+class LSHIndex:
+    """分段 LSH + 代表聚类；similar(a, b) 判断两个签名是否近重复"""
+
+    def __init__(self, similar: Callable[[object, object], bool], max_reps: int = MAX_BUCKET_REPS):
+        self.similar = similar
+        self.max_reps = max_reps
+        self.buckets: Dict[Tuple[int, Hashable], List[Hashable]] = {}
+        self.signatures: Dict[Hashable, object] = {}  # 只保存代表的签名
+        self.clusters: Dict[Hashable, List[Hashable]] = {}
+
+    def add(self, item: Hashable, band_keys: Sequence[Hashable], signature) -> Hashable:
+        """加入一个条目，返回它所属簇的代表（可能就是它自己）"""
+        checked = set()
+        for band, key in enumerate(band_keys):
+            for rep in self.buckets.get((band, key), ()):
+                if rep in checked:
+                    continue
+                checked.add(rep)
+                if self.similar(signature, self.signatures[rep]):
+                    self.clusters[rep].append(item)
+                    count("neardup_matches")
+                    return rep
+        self.signatures[item] = signature
+        self.clusters[item] = [item]
+        for band, key in enumerate(band_keys):
+            reps = self.buckets.setdefault((band, key), [])
+            if len(reps) < self.max_reps:
+                reps.append(item)
+        return item
+
+    def duplicate_clusters(self) -> List[List[Hashable]]:
+        return [members for members in self.clusters.values() if len(members) > 1]
+
+
+# ---------------- 段落 ----------------
+def shingle_hashes(text: str, k: int = SHINGLE_SIZE) -> np.ndarray:
+    """归一化文本（NFKC 并去掉全部空白）的字符 k-gram 的 64 位哈希（NumPy 滚动哈希，不逐个构造子串）"""
+    text = re.sub(r"\s+", "", normalize_text(text))
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if len(codes) == 0:
+        return codes
+    k = min(k, len(codes))
+    n = len(codes) - k + 1
+    h = np.zeros(n, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for j in range(k):
+            h = h * np.uint64(1000003) + codes[j:j + n]
+        # splitmix64 末段混合，让相邻 k-gram 的哈希充分打散
+        h ^= h >> np.uint64(30)
+        h *= np.uint64(0xBF58476D1CE4E5B9)
+        h ^= h >> np.uint64(27)
+        h *= np.uint64(0x94D049BB133111EB)
+        h ^= h >> np.uint64(31)
+    return h
+
+
+class MinHasher:
+    """乘移位（multiply-shift）哈希族的 MinHash，签名为 NUM_PERM 个 uint32"""
+
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = SEED):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 1 << 63, num_perm, dtype=np.uint64) | np.uint64(1)  # 奇数
+        self.b = rng.integers(0, 1 << 63, num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        h = shingle_hashes(text)
+        if len(h) == 0:
+            return None
+        with np.errstate(over="ignore"):
+            values = (h[None, :] * self.a[:, None] + self.b[:, None]) >> np.uint64(32)
+        return values.min(axis=1).astype(np.uint32)
+
+
+def text_band_keys(signature: np.ndarray, bands: int = TEXT_BANDS) -> List[bytes]:
+    return [band.tobytes() for band in np.split(signature, bands)]
+
+
+def jaccard_estimate(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.mean(a == b))
+
+
+def text_index(threshold: float = JACCARD_THRESHOLD) -> LSHIndex:
+    return LSHIndex(lambda a, b: jaccard_estimate(a, b) >= threshold)
+
+
+def add_texts(index: LSHIndex, items: Iterable[Tuple[Hashable, str]], hasher: MinHasher) -> int:
+    """把 (编号, 文本) 逐条加入段落索引，只保留签名和编号，返回条目数"""
+    n = 0
+    for item, text in items:
+        n += 1
+        signature = hasher.signature(text)
+        if signature is not None:
+            index.add(item, text_band_keys(signature), signature)
+    return n
+
+
+def cluster_texts(items: Iterable[Tuple[Hashable, str]], threshold: float = JACCARD_THRESHOLD,
+                  hasher: Optional[MinHasher] = None) -> List[List[Hashable]]:
+    """items 为 (编号, 文本)，返回近重复的编号簇（每簇至少两个，首个为代表）"""
+    index = text_index(threshold)
+    with timer("neardup_texts"):
+        add_texts(index, items, hasher or MinHasher())
+    return index.duplicate_clusters()
+
+
+def cluster_text_files(paths: Sequence[str], threshold: float = JACCARD_THRESHOLD) -> List[List[str]]:
+    """文本文件的近重复簇，供 move_repeated 使用"""
+    def read(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+    return cluster_texts(((p, read(p)) for p in paths), threshold)
+
+
+# ---------------- 图片 ----------------
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    return np.cos(np.pi * (2 * x + 1) * k / (2 * n))
+
+
+_DCT = _dct_matrix(PHASH_SIZE)
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def perceptual_hashes(image_path: str) -> Optional[Tuple[int, int]]:
+    """(pHash, dHash) 两个 64 位整数；JPEG 用 draft 模式直接解码出缩略图"""
+    try:
+        with timer("image_hash"):
+            with Image.open(image_path) as img:
+                if img.format == "JPEG":
+                    img.draft("L", (PHASH_SIZE * 2, PHASH_SIZE * 2))
+                gray = img.convert("L")
+            small = np.asarray(gray.resize((PHASH_SIZE, PHASH_SIZE), Image.BILINEAR), dtype=np.float64)
+            coeffs = (_DCT @ small @ _DCT.T)[:HASH_SIZE, :HASH_SIZE]
+            phash = coeffs > np.median(coeffs.ravel()[1:])  # 不计直流分量
+            tiny = np.asarray(gray.resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR), dtype=np.int16)
+            dhash = tiny[:, 1:] > tiny[:, :-1]
+            return _bits_to_int(phash), _bits_to_int(dhash)
+    except Exception as e:
+        print(f"警告: 无法计算图片哈希 '{image_path}': {e}")
+        return None
+
+
+def image_band_keys(hashes: Tuple[int, int], bands: int = IMAGE_BANDS) -> List[int]:
+    combined = (hashes[0] << 64) | hashes[1]
+    width = 128 // bands
+    return [(combined >> (width * i)) & ((1 << width) - 1) for i in range(bands)]
+
+
+def images_similar(a: Tuple[int, int], b: Tuple[int, int]) -> bool:
+    return bin(a[0] ^ b[0]).count("1") <= PHASH_DISTANCE and bin(a[1] ^ b[1]).count("1") <= DHASH_DISTANCE
+
+
+def hash_images(items: Iterable[Tuple[Hashable, str]], pool: Executor,
+                window: int) -> Iterator[Tuple[Hashable, Optional[Tuple[int, int]]]]:
+    """按输入顺序产出 (编号, 感知哈希)；items 为 (编号, 图片路径)，逐个读取，最多 window 张在计算中"""
+    pending = deque()
+    for item, path in items:
+        pending.append((item, pool.submit(perceptual_hashes, path)))
+        if len(pending) >= window:
+            item, future = pending.popleft()
+            yield item, future.result()
+    while pending:
+        item, future = pending.popleft()
+        yield item, future.result()
+
+
+def add_images(index: LSHIndex, items: Iterable[Tuple[Hashable, str]], workers: int = HASH_WORKERS) -> int:
+    """哈希在线程池中计算，按输入顺序加入图片索引，返回图片数"""
+    n = 0
+    with ThreadPoolExecutor(workers) as pool:
+        for item, hashes in hash_images(items, pool, workers * HASH_PREFETCH):
+            n += 1
+            if hashes is not None:
+                index.add(item, image_band_keys(hashes), hashes)
+    return n
+
+
+def cluster_images(paths: Iterable[str], workers: int = HASH_WORKERS) -> List[List[str]]:
+    """图片近重复簇（每簇至少两张，首个为代表）；paths 可以是生成器"""
+    index = LSHIndex(images_similar)
+    add_images(index, ((p, p) for p in paths), workers)
+    return index.duplicate_clusters()
+
+
+# ---------------- 簇文件 ----------------
+def write_clusters(f, kind: str, clusters: Iterable[List]):
+    n = 0
+    for members in clusters:
+        f.write(json.dumps({"kind": kind, "representative": members[0], "members": members},
+                           ensure_ascii=False) + "\n")
+        n += 1
+    return n
+
+
+def load_representatives(clusters_path: str, kind: str = "image",
+                         root: Optional[str] = None) -> Dict[str, str]:
+    """{成员: 代表}（不含代表自身）；root 不为空时把相对路径拼成完整路径"""
+    mapping = {}
+    with open(clusters_path, "r", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record["kind"] != kind:
+                continue
+            rep = record["representative"]
+            for member in record["members"][1:]:
+                if root is not None:
+                    mapping[os.path.join(root, member)] = os.path.join(root, rep)
+                else:
+                    mapping[member] = rep
+    return mapping
+
+
+def main(root_folder: str, out_path: Optional[str] = None, threshold: float = JACCARD_THRESHOLD):
+    out_path = out_path or os.path.join(root_folder, "neardup_clusters.jsonl")
+    texts, images = text_index(threshold), LSHIndex(images_similar)
+    hasher = MinHasher()
+    n_paragraphs = 0
+
+    def article_images():
+        """逐篇读取文章：段落当场加入段落索引，图片交给线程池；两个索引都只保存签名和编号"""
+        nonlocal n_paragraphs
+        for article, paragraphs, image_paths in iter_articles(root_folder, require_text=False):
+            n_paragraphs += add_texts(texts, ((f"{article}#{i}", para) for i, para in enumerate(paragraphs)),
+                                      hasher)
+            for path in image_paths:
+                yield os.path.relpath(path, root_folder), path
+
+    n_images = add_images(images, article_images())
+    text_clusters, image_clusters = texts.duplicate_clusters(), images.duplicate_clusters()
+    with open(out_path, "w", encoding="utf-8") as f:
+        n_text = write_clusters(f, "paragraph", text_clusters)
+        n_image = write_clusters(f, "image", image_clusters)
+    print(f"{n_paragraphs} 个段落中有 {n_text} 个近重复簇（{sum(map(len, text_clusters))} 个段落），"
+          f"{n_images} 张图片中有 {n_image} 个近重复簇（{sum(map(len, image_clusters))} 张），"
+          f"已写入 '{out_path}'")
+    return out_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="段落与图片的近重复检测（MinHash / 感知哈希 + LSH）")
+    parser.add_argument("root_folder", nargs="?", default=r"D:\move11\result", help="clip_match_1 的输入目录")
+    parser.add_argument("--out", default=None, help="簇文件，默认 <root_folder>/neardup_clusters.jsonl")
+    parser.add_argument("--threshold", type=float, default=JACCARD_THRESHOLD, help="段落 Jaccard 相似度阈值")
+    args = parser.parse_args()
+    run(main, args.root_folder, args.out, args.threshold)
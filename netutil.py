@@ -1,9 +1,12 @@
 # crawlers/netutil.py
 from __future__ import annotations
 import random, time, requests
+from urllib.parse import urlsplit
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+from metrics import count, timer
+
 DEFAULT_HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120 Safari/537.36",
     "Connection": "close",  # 关键：关闭 keep-alive，避免远端无响应的半开连接
@@ -35,7 +38,10 @@ def robust_get(session: requests.Session, url: str, timeout=(8, 30), jitter=(0.0
     """
     # 轻微随机等待，避免被判定为机器人
     time.sleep(random.uniform(*jitter))
-    resp = session.get(url, timeout=timeout)
+    host = urlsplit(url).hostname
+    with timer("http_fetch", host=host):
+        resp = session.get(url, timeout=timeout)
+    count("http_responses", host=host, status=resp.status_code)
     resp.raise_for_status()
     # 一些站点 gzip/encoding 有问题：显式使用 apparent_encoding
     resp.encoding = resp.apparent_encoding or resp.encoding
@@ -1,45 +1,93 @@
 '''
 移动没有图表编号的pdf文件到指定文件夹
+
+多进程筛查：每个 PDF 交给进程池中的一个进程，逐页只取纯文本（不保留连字和空白，开销更小），
+一旦某页匹配 "图\s*\d+" 立即停止读取后面的页；结果写入运行日志（manifest），
+重跑时大小和修改时间都没变的 PDF 直接跳过。
 '''
+import multiprocessing as mp
 import os
-import re
 import fitz  # PyMuPDF
 import shutil
+import time
+from journal import Journal
+from metrics import count, observe, run
+from pdfextract import figure_number_pattern
+
+# 只要纯文本：去掉默认的保留连字 / 保留空白，相邻字符间也不补空格，正则里的 \s* 仍然兼容
+TEXT_FLAGS = fitz.TEXT_MEDIABOX_CLIP | fitz.TEXT_INHIBIT_SPACES
+
+num_workers = os.cpu_count() or 4
+manifest_name = "screen_manifest.jsonl"  # 保存在源文件夹中
+SCREENED = ("kept", "moved")
+
 
-def move_pdfs_without_figure_numbers(source_folder, target_folder):
+def screen_pdf(pdf_path):
+    """子进程：逐页检查是否包含图表编号，返回 (路径, 是否包含, 读取页数, 耗时, 错误)"""
+    start = time.perf_counter()
+    pages = 0
+    try:
+        with fitz.open(pdf_path) as pdf:
+            for page in pdf:
+                pages += 1
+                text = page.get_text("text", flags=TEXT_FLAGS)
+                # 检查文本中是否包含图表编号
+                if '图' in text and figure_number_pattern.search(text):
+                    return pdf_path, True, pages, time.perf_counter() - start, None
+    except Exception as e:  # 损坏的 PDF
+        return pdf_path, False, pages, time.perf_counter() - start, repr(e)
+    return pdf_path, False, pages, time.perf_counter() - start, None
+
+
+def move_pdfs_without_figure_numbers(source_folder, target_folder, workers=num_workers):
     if not os.path.exists(target_folder):
         os.makedirs(target_folder)
+    journal = Journal(os.path.join(source_folder, manifest_name), key="file")
 
-    # 匹配字样
-    figure_number_pattern = re.compile(r'(图)\s*(\d+)')
-
-    # 遍历源文件夹中的所有 PDF 文件
-    for filename in os.listdir(source_folder):
-        if filename.lower().endswith(".pdf"):
-            pdf_path = os.path.join(source_folder, filename)
-
-            # 打开 PDF 文件
-            with fitz.open(pdf_path) as pdf:
-                # 检查每一页是否包含图表编号
-                contains_figure_number = False
-                for page_num in range(pdf.page_count):
-                    page = pdf[page_num]
-                    text = page.get_text()
-                    # 检查文本中是否包含图表编号
-                    if figure_number_pattern.search(text):
-                        contains_figure_number = True
-                        break
+    # 遍历源文件夹中的所有 PDF 文件，跳过上次已筛查且未改动的
+    todo, stats, skipped = [], {}, 0
+    with os.scandir(source_folder) as entries:
+        for entry in entries:
+            if not (entry.is_file() and entry.name.lower().endswith(".pdf")):
+                continue
+            st = entry.stat()
+            stats[entry.path] = (st.st_size, st.st_mtime_ns)
+            record = journal.get(entry.name)
+            if (journal.is_finished(entry.name, SCREENED)
+                    and (record.get("size"), record.get("mtime_ns")) == stats[entry.path]):
+                skipped += 1
+                continue
+            todo.append(entry.path)
+    print(f"共 {len(todo)} 个 PDF 待筛查，跳过 {skipped} 个已筛查的。")
 
+    with mp.Pool(max(1, min(workers, len(todo)))) as pool:
+        for pdf_path, contains_figure_number, pages, seconds, error in pool.imap_unordered(screen_pdf, todo,
+                                                                                            chunksize=4):
+            filename = os.path.basename(pdf_path)
+            size, mtime_ns = stats[pdf_path]
+            observe("pdf_screen", seconds)
+            count("pdf_pages", pages)
+            if error is not None:
+                count("pdf_files", result="failed")
+                journal.append(filename, "failed", size=size, mtime_ns=mtime_ns, error=error)
+                print(f"读取 '{filename}' 出错: {error}")
             # 如果 PDF 中不包含图表编号
-            if not contains_figure_number:
+            elif not contains_figure_number:
                 # 将 PDF 文件移动到目标文件夹
                 target_path = os.path.join(target_folder, filename)
                 shutil.move(pdf_path, target_path)
+                count("pdf_files", result="moved")
+                journal.append(filename, "moved", size=size, mtime_ns=mtime_ns, pages=pages)
                 print(f"Moved '{filename}' to '{target_folder}'.")
             else:
+                count("pdf_files", result="kept")
+                journal.append(filename, "kept", size=size, mtime_ns=mtime_ns, pages=pages)
                 print(f"'{filename}' contains figure numbers and will not be moved.")
+    journal.close()
+
 
-# 使用示例
-source_folder = r"D:\多模态\人工智能\CNKI-pdf\24.10" 
-target_folder = r"D:\多模态\人工智能\CNKI-deleted\24.10"
-move_pdfs_without_figure_numbers(source_folder, target_folder)
+if __name__ == "__main__":
+    # 使用示例
+    source_folder = r"D:\多模态\人工智能\CNKI-pdf\24.10"
+    target_folder = r"D:\多模态\人工智能\CNKI-deleted\24.10"
+    run(move_pdfs_without_figure_numbers, source_folder, target_folder)
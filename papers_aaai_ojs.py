@@ -5,6 +5,7 @@ from bs4 import BeautifulSoup
 from typing import List, Dict
 
 from crawlers.netutil import make_session, robust_get
+from metrics import run, timed
 
 ARCHIVE = "https://ojs.aaai.org/index.php/AAAI/issue/archive"
 UA = {"User-Agent":"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120 Safari/537.36"}
@@ -12,13 +13,15 @@ RS = make_session()
 RS.headers.update(UA)
 
 
+_soup = timed("html_parse", crawler="aaai")(BeautifulSoup)  # 计时的 BeautifulSoup
+
 def _get(url: str, timeout=25) -> str:
     return robust_get(RS, url, timeout=(8, 30))
 
 def list_issue_urls(year_start: int, year_end: int) -> List[str]:
     """在档案页枚举所有 issue 链接，并按年份范围过滤"""
     html = _get(ARCHIVE)
-    soup = BeautifulSoup(html, "lxml")
+    soup = _soup(html, "lxml")
     urls: List[str] = []
     # OJS 档案页每个期刊块通常是 .obj_issue_summary 或包含 issue 链接的 <a>
     for a in soup.select("a[href*='/issue/view/']"):
@@ -39,7 +42,7 @@ def list_issue_urls(year_start: int, year_end: int) -> List[str]:
 
 def crawl_issue(issue_url: str, fast: bool = False) -> List[Dict]:
     html = _get(issue_url)
-    soup = BeautifulSoup(html, "lxml")
+    soup = _soup(html, "lxml")
     rows: List[Dict] = []
     for art in soup.select(".obj_article_summary"):
         a = art.select_one("a.title, a.obj_galley_link, a[href*='/article/view/']")
@@ -58,7 +61,7 @@ def crawl_issue(issue_url: str, fast: bool = False) -> List[Dict]:
         if not fast:
             try:
                 ph = _get(href)
-                ps = BeautifulSoup(ph, "lxml")
+                ps = _soup(ph, "lxml")
                 doi_a = ps.select_one("a[href*='doi.org/']")
                 if doi_a: doi = doi_a.get_text(" ", strip=True)
                 abs_div = ps.select_one("section.item.abstract, div#articleAbstract, div.abstract")
@@ -97,5 +100,5 @@ def crawl_aaai(year_start=2021, year_end=2025, fast: bool = False) -> list[dict]
 
 if __name__ == "__main__":
     from core.sink import save_papers
-    rows = crawl_aaai(2021, 2025)
+    rows = run(crawl_aaai, 2021, 2025)
     save_papers("aaai", rows, mode="w")
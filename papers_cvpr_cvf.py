@@ -7,6 +7,7 @@ import requests
 from bs4 import BeautifulSoup
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
+from metrics import run, timed
 
 # -----------------------------
 # 网络层（禁代理 / 关闭 keep-alive / 自动重试）
@@ -37,6 +38,9 @@ def make_session() -> requests.Session:
 
 RS = make_session()
 
+_soup = timed("html_parse", crawler="cvpr")(BeautifulSoup)  # 计时的 BeautifulSoup
+
+@timed("http_fetch", crawler="cvpr")
 def _get(url: str, timeout=(8, 30), jitter=(0.05, 0.2)) -> str:
     """稳健 GET：带随机退避与编码修正。"""
     time.sleep(random.uniform(*jitter))
@@ -56,7 +60,7 @@ def list_cvpr_years() -> List[int]:
     years: List[int] = []
     try:
         html = _get(MENU)
-        soup = BeautifulSoup(html, "lxml")
+        soup = _soup(html, "lxml")
         for a in soup.select("a[href*='CVPR20'], a[href*='cvpr20']"):
             h = a.get("href") or ""
             m = re.search(r"[Cc][Vv][Pp][Rr](20\d{2})", h)
@@ -98,7 +102,7 @@ def _extract_papers_from_html(html: str, year: int, fast: bool = True) -> List[D
     - 兼容大小写与不同content路径（/content/CVPR2024/html/... 或 /content_cvpr_2017/html/...）
     - fast=True 时不再逐条进详情页（DOI/摘要留空）
     """
-    soup = BeautifulSoup(html, "lxml")
+    soup = _soup(html, "lxml")
     rows: List[Dict] = []
 
     # 选择器1：标准 ptitle
@@ -120,7 +124,7 @@ def _extract_papers_from_html(html: str, year: int, fast: bool = True) -> List[D
         if not fast:
             try:
                 ph = _get(href, jitter=(0.02, 0.08))
-                ps = BeautifulSoup(ph, "lxml")
+                ps = _soup(ph, "lxml")
                 doi_a = ps.select_one("a[href*='doi.org/']")
                 if doi_a:
                     doi = doi_a.get_text(" ", strip=True)
@@ -155,7 +159,7 @@ def crawl_cvpr_dblp(year: int) -> List[Dict]:
     except Exception as e:
         print(f"[CVPR][DBLP] {year} fetch failed: {e}")
         return []
-    soup = BeautifulSoup(html, "lxml")
+    soup = _soup(html, "lxml")
     rows: List[Dict] = []
     for li in soup.select("li.entry.inproceedings"):
         t = li.select_one("span.title")
@@ -231,6 +235,6 @@ def crawl_cvpr(year_start=2017, year_end=2025, fast: bool = True) -> List[Dict]:
 # -----------------------------
 if __name__ == "__main__":
     from core.sink import save_papers
-    rows = crawl_cvpr(2017, 2025, fast=True)  # 快跑，不进详情页
+    rows = run(crawl_cvpr, 2017, 2025, fast=True)  # 快跑，不进详情页
     save_papers("cvpr", rows, mode="w")
     print("[CVPR] done.")
@@ -7,6 +7,7 @@ import requests
 from bs4 import BeautifulSoup
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
+from metrics import run, timed
 
 # -----------------------------
 # 网络层（禁用系统代理、关闭 keep-alive、自动重试）
@@ -37,6 +38,9 @@ def make_session() -> requests.Session:
 
 RS = make_session()
 
+_soup = timed("html_parse", crawler="emnlp")(BeautifulSoup)  # 计时的 BeautifulSoup
+
+@timed("http_fetch", crawler="emnlp")
 def _get(url: str, timeout=(8, 30), jitter=(0.05, 0.2)) -> str:
     """稳健 GET：附带少量随机退避，显式设定编码。"""
     time.sleep(random.uniform(*jitter))
@@ -62,7 +66,7 @@ def _volume_url_for_year(year: int) -> Optional[str]:
     # fallback: 从 events 页解析卷链接
     try:
         ev_html = _get(EVENT.format(year=year))
-        soup = BeautifulSoup(ev_html, "lxml")
+        soup = _soup(ev_html, "lxml")
         for a in soup.select("a[href]"):
             href = a.get("href") or ""
             if re.search(fr"/volumes/{year}\.emnlp-main/?$", href):
@@ -76,7 +80,7 @@ def _volume_url_for_year(year: int) -> Optional[str]:
 # -----------------------------
 def crawl_volume(vol_url: str, year: int, fast: bool = True) -> List[Dict]:
     html = _get(vol_url)
-    soup = BeautifulSoup(html, "lxml")
+    soup = _soup(html, "lxml")
     rows: List[Dict] = []
     # 详情页：/{year}.emnlp-main.NNN
     for a in soup.select(f'a[href^="/{year}.emnlp-main."]'):
@@ -92,7 +96,7 @@ def crawl_volume(vol_url: str, year: int, fast: bool = True) -> List[Dict]:
         if not fast:
             try:
                 ih = _get(item_url, jitter=(0.03, 0.12))
-                isoup = BeautifulSoup(ih, "lxml")
+                isoup = _soup(ih, "lxml")
                 doi_a = isoup.select_one("a[href*='doi.org']")
                 if doi_a:
                     doi = doi_a.get_text(" ", strip=True)
@@ -128,7 +132,7 @@ def crawl_emnlp_dblp(year: int) -> List[Dict]:
     except Exception as e:
         print(f"[EMNLP][DBLP] {year} fetch failed: {e}")
         return []
-    soup = BeautifulSoup(html, "lxml")
+    soup = _soup(html, "lxml")
     rows: List[Dict] = []
     for li in soup.select("li.entry.inproceedings"):
         t = li.select_one("span.title")
@@ -186,6 +190,6 @@ def crawl_emnlp(year_start=2021, year_end=2025, fast: bool = True) -> List[Dict]
 # -----------------------------
 if __name__ == "__main__":
     from core.sink import save_papers
-    rows = crawl_emnlp(2021, 2025, fast=True)  # 快跑：不进详情页
+    rows = run(crawl_emnlp, 2021, 2025, fast=True)  # 快跑：不进详情页
     save_papers("emnlp", rows, mode="w")
     print("[EMNLP] done.")
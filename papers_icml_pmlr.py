@@ -3,6 +3,7 @@ from __future__ import annotations
 import re, time, requests
 from bs4 import BeautifulSoup
 from typing import List, Dict
+from metrics import run, timed
 
 IDX = "https://proceedings.mlr.press/"
 UA = {"User-Agent":"Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 Chrome/120 Safari/537.36"}
@@ -10,6 +11,9 @@ RS = requests.Session()
 RS.headers.update(UA)
 RS.timeout = 20
 
+_soup = timed("html_parse", crawler="icml")(BeautifulSoup)  # 计时的 BeautifulSoup
+
+@timed("http_fetch", crawler="icml")
 def _get(url: str) -> str:
     r = RS.get(url, timeout=20)
     r.raise_for_status()
@@ -18,7 +22,7 @@ def _get(url: str) -> str:
 def list_icml_volumes() -> List[str]:
     """从 PMLR 索引页枚举卷，并仅保留“ICML”卷链接"""
     html = _get(IDX)
-    soup = BeautifulSoup(html, "lxml")
+    soup = _soup(html, "lxml")
     vols = []
     # PMLR 索引页是 <a href="/vXXX/">
     for a in soup.select('a[href^="/v"]'):
@@ -38,7 +42,7 @@ def list_icml_volumes() -> List[str]:
 def crawl_volume(vol_url: str) -> List[Dict]:
     """在单个 ICML 卷页抓所有论文。PMLR 卷页结构：每篇论文一个 .paper 区块"""
     html = _get(vol_url + "/")
-    soup = BeautifulSoup(html, "lxml")
+    soup = _soup(html, "lxml")
 
     # 页面文本里通常能找到年份
     txt = soup.get_text(" ", strip=True)
@@ -65,7 +69,7 @@ def crawl_volume(vol_url: str) -> List[Dict]:
         # 进入论文详情页，抓摘要和 DOI（若有）
         try:
             ph = _get(paper_url)
-            ps = BeautifulSoup(ph, "lxml")
+            ps = _soup(ph, "lxml")
             abs_div = ps.select_one("div.abstract")
             if abs_div:
                 abstract = abs_div.get_text(" ", strip=True)
@@ -102,7 +106,7 @@ def crawl_icml_dblp(year_start=2015, year_end=2025) -> List[Dict]:
             h = _get(url)
         except Exception:
             continue
-        s = BeautifulSoup(h, "lxml")
+        s = _soup(h, "lxml")
         # DBLP 论文条目选择器：li.entry inproceedings
         for li in s.select("li.entry.inproceedings"):
             t = li.select_one("span.title")
@@ -147,5 +151,5 @@ def crawl_icml() -> List[Dict]:
 
 if __name__ == "__main__":
     from core.sink import save_papers
-    rows = crawl_icml()
+    rows = run(crawl_icml)
     save_papers("icml", rows, mode="w")
@@ -3,11 +3,15 @@ from __future__ import annotations
 import re, time, requests
 from bs4 import BeautifulSoup
 from typing import List, Dict
+from metrics import run, timed
 
 BASE1 = "https://proceedings.neurips.cc/paper_files/paper/{year}"
 BASE2 = "https://proceedings.neurips.cc/paper/{year}"
 HEADERS = {"User-Agent":"Mozilla/5.0"}
 
+_soup = timed("html_parse", crawler="neurips")(BeautifulSoup)  # 计时的 BeautifulSoup
+
+@timed("http_fetch", crawler="neurips")
 def _fetch(url: str, timeout=20):
     r = requests.get(url, headers=HEADERS, timeout=timeout)
     r.raise_for_status()
@@ -29,7 +33,7 @@ def crawl_year(year: int) -> List[Dict]:
     if not url:
         return []
     html = _fetch(url)
-    soup = BeautifulSoup(html, "lxml")
+    soup = _soup(html, "lxml")
     papers = []
     for a in soup.select("a"):
         href = a.get("href") or ""
@@ -69,5 +73,5 @@ def crawl_neurips(year_start=2021, year_end=2025) -> List[Dict]:
 
 if __name__ == "__main__":
     from core.sink import save_papers
-    rows = crawl_neurips()
+    rows = run(crawl_neurips)
     save_papers("neurips", rows, mode="w")
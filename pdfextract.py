@@ -0,0 +1,219 @@
+# pdfextract.py
+"""
+用 PyMuPDF 直接从 PDF 生成 clip_match_1 读取的目录结构（取代在 AutoDL 服务器上的解析）：
+
+    <result>/<文章>/<文章>.txt     段落之间空一行（与 clip_match_1.split_paragraphs 对应）
+    <result>/<文章>/图片/           PDF 中嵌入的图片，JPEG / PNG 原样写出字节，不重新编码
+    <result>/<文章>/figures.jsonl  每张图片一行：页码、页面坐标、图注（"图 N ..."）及引用该图的段落编号
+
+段落取自每页的文本块，块内换行按中英文规则合并；只有数字的块（页码）被丢弃。
+嵌入图片按 xref 去重，过小的图片（图标、公式碎片）被跳过；clip_match_1 不读取的格式（JPX、JBIG2 等）转成 PNG。
+
+图注：同一页上与图片水平方向有重叠、紧挨在图片下方（其次上方）、以 "图 N" 开头的文本块。
+图注所在段落和正文中提到 "图N" 的段落作为该图片的候选段落，clip_match_1 只在这些段落中排序。
+
+单独运行：python pdfextract.py <PDF 目录> <result 目录> [--workers N]，多进程并行解析。
+"""
+from __future__ import annotations
+import argparse
+import json
+import multiprocessing as mp
+import os
+import re
+import shutil
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import fitz  # PyMuPDF
+
+IMAGE_FOLDER = "图片"
+MIN_IMAGE_SIZE = 64               # 宽或高小于该像素数的图片视为图标，跳过
+RAW_EXTENSIONS = {"jpeg": "jpg", "jpg": "jpg", "png": "png"}  # 可直接写出原始字节的格式
+FIGURES_NAME = "figures.jsonl"
+CAPTION_MAX_GAP = 72              # 图注与图片的最大竖直间距（pt，约 2.5 cm）
+CAPTION_ABOVE_PENALTY = 24        # 图注在图片上方时的额外距离，优先选下方的图注
+
+caption_pattern = re.compile(r'^\s*图\s*(\d+(?:[-.．]\d+)*)')
+# 正文中任意位置的图表编号：no_keywords 和 pdfingest 据此筛掉没有图的 PDF
+figure_number_pattern = re.compile(r'(图)\s*(\d+)')
+
+Block = Tuple[int, Tuple[float, float, float, float], str]  # (页码, 坐标, 段落文本)
+
+_CJK = re.compile(r"[\u3000-\u303f\u3400-\u9fff\uff00-\uffef]")
+
+
+def join_lines(text: str) -> str:
+    """合并文本块内的换行：两侧有中文（含全角标点）时直接相连，否则加一个空格"""
+    out = ""
+    for line in (l.strip() for l in text.splitlines()):
+        if not line:
+            continue
+        if out and not (_CJK.match(out[-1]) or _CJK.match(line[0])):
+            out += " "
+        out += line
+    return out
+
+
+def page_blocks(page) -> List[Block]:
+    """一页中按阅读顺序排列的文本块，每块作为一个段落"""
+    blocks = []
+    for block in page.get_text("blocks", flags=fitz.TEXT_MEDIABOX_CLIP, sort=True):
+        if block[6] != 0:  # 图片块
+            continue
+        text = join_lines(block[4])
+        if text and not text.isdigit():
+            blocks.append((page.number, tuple(block[:4]), text))
+    return blocks
+
+
+def page_paragraphs(page) -> List[str]:
+    return [text for _, _, text in page_blocks(page)]
+
+
+def find_caption(bbox, page_no: int, blocks: Sequence[Block]) -> Optional[int]:
+    """图片的图注所在段落编号（blocks 中的下标），找不到时返回 None"""
+    x0, y0, x1, y1 = bbox
+    best, best_rank = None, float("inf")
+    for i, (page, (bx0, by0, bx1, by1), text) in enumerate(blocks):
+        if page != page_no or bx1 <= x0 or bx0 >= x1 or not caption_pattern.match(text):
+            continue
+        if by0 >= y1 - 5:    # 图片下方（允许少量重叠）
+            gap, rank = by0 - y1, by0 - y1
+        elif by1 <= y0 + 5:  # 图片上方
+            gap, rank = y0 - by1, y0 - by1 + CAPTION_ABOVE_PENALTY
+        else:
+            continue
+        if gap <= CAPTION_MAX_GAP and rank < best_rank:
+            best, best_rank = i, rank
+    return best
+
+
+def citing_paragraphs(label: str, blocks: Sequence[Block], caption: int) -> List[int]:
+    """正文中提到 "图<label>" 的段落编号（不含图注本身）"""
+    pattern = re.compile(rf'图\s*{re.escape(label)}(?!\d|[.．]\d)')
+    return [i for i, (_, _, text) in enumerate(blocks) if i != caption and pattern.search(text)]
+
+
+def link_figures(images: List[dict], blocks: Sequence[Block]) -> List[dict]:
+    """为每张图片补上图注和候选段落（图注段落 + 引用该图的段落）"""
+    cited: Dict[str, List[int]] = {}
+    for image in images:
+        caption = find_caption(image["bbox"], image["page"] - 1, blocks) if image["bbox"] else None
+        if caption is None:
+            image.update(figure=None, caption=None, paragraphs=[])
+            continue
+        label = caption_pattern.match(blocks[caption][2]).group(1)
+        if label not in cited:
+            cited[label] = citing_paragraphs(label, blocks, caption)
+        image.update(figure=label, caption=caption, paragraphs=sorted({caption, *cited[label]}))
+    return images
+
+
+def save_image(doc, xref: int, stem: str) -> Optional[str]:
+    """写出嵌入图片：JPEG / PNG 直接写原始字节，其他格式转为 PNG；返回路径，太小或失败时返回 None"""
+    info = doc.extract_image(xref)
+    if not info or min(info["width"], info["height"]) < MIN_IMAGE_SIZE:
+        return None
+    ext = RAW_EXTENSIONS.get(info["ext"])
+    if ext is not None and not info.get("smask"):
+        path = f"{stem}.{ext}"
+        with open(path, "wb") as f:
+            f.write(info["image"])
+        return path
+    pix = fitz.Pixmap(doc, xref)  # 需要解码的格式，或带透明蒙版的图片
+    if info.get("smask"):
+        pix = fitz.Pixmap(pix, fitz.Pixmap(doc, info["smask"]))
+    if pix.n - pix.alpha >= 4:  # CMYK 等转成 RGB
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+    path = f"{stem}.png"
+    pix.save(path)
+    return path
+
+
+def extract_images(doc, image_folder: str) -> List[dict]:
+    """按页序写出所有嵌入图片，文件名为 p<页码>_<序号>；返回 [{"image", "page", "bbox"}]"""
+    os.makedirs(image_folder, exist_ok=True)
+    seen, images = set(), []
+    for page in doc:
+        for n, image in enumerate(page.get_images(full=True), start=1):
+            xref = image[0]
+            if xref in seen:  # 同一图片在多页重复出现（如页眉 logo）
+                continue
+            seen.add(xref)
+            try:
+                path = save_image(doc, xref, os.path.join(image_folder, f"p{page.number + 1}_{n}"))
+                rects = page.get_image_rects(xref) if path else []
+            except Exception as e:
+                print(f"警告: 第 {page.number + 1} 页的图片 {xref} 无法导出: {e}")
+                continue
+            if path:
+                bbox = [round(v, 1) for v in rects[0]] if rects else None
+                images.append({"image": os.path.basename(path), "page": page.number + 1, "bbox": bbox})
+    return images
+
+
+def write_article(doc, blocks: List[Block], result_folder: str, article: str, overwrite: bool = False) -> dict:
+    """
+    写出 <result>/<文章>/ 目录：先写到临时目录再改名，中断时不会留下不完整的文章。
+    文章目录已存在时（可能是其他方式解析的文章）抛出 FileExistsError，overwrite 为 True 时才替换：
+    旧目录先改名为备份，新目录改名到位后再删除备份，任何时刻中断都至少保留新旧之一的完整目录
+    """
+    final_path = os.path.join(result_folder, article)
+    if os.path.exists(final_path) and not overwrite:
+        raise FileExistsError(f"文章目录 '{final_path}' 已存在")
+    tmp_path = os.path.join(result_folder, f".{article}.tmp")
+    backup_path = os.path.join(result_folder, f".{article}.old")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    with open(os.path.join(tmp_path, f"{article}.txt"), "w", encoding="utf-8") as f:
+        f.write("\n\n".join(text for _, _, text in blocks))
+    images = link_figures(extract_images(doc, os.path.join(tmp_path, IMAGE_FOLDER)), blocks)
+    with open(os.path.join(tmp_path, FIGURES_NAME), "w", encoding="utf-8") as f:
+        for image in images:
+            f.write(json.dumps(image, ensure_ascii=False) + "\n")
+    if os.path.exists(final_path):
+        shutil.rmtree(backup_path, ignore_errors=True)
+        os.replace(final_path, backup_path)
+    os.replace(tmp_path, final_path)
+    shutil.rmtree(backup_path, ignore_errors=True)
+    return {"article": article, "paragraphs": len(blocks), "images": len(images),
+            "linked": sum(bool(image["paragraphs"]) for image in images)}
+
+
+def extract_pdf(pdf_path: str, result_folder: str, article: Optional[str] = None, overwrite: bool = False) -> dict:
+    """把一个 PDF 解析为 clip_match_1 的文章目录，文章名默认取文件名"""
+    article = article or os.path.splitext(os.path.basename(pdf_path))[0]
+    with fitz.open(pdf_path) as doc:
+        blocks = [b for page in doc for b in page_blocks(page)]
+        return write_article(doc, blocks, result_folder, article, overwrite)
+
+
+def _extract_job(job):
+    pdf_path, result_folder, overwrite = job
+    try:
+        return pdf_path, extract_pdf(pdf_path, result_folder, overwrite=overwrite), None
+    except Exception as e:
+        return pdf_path, None, repr(e)
+
+
+def main(pdf_folder: str, result_folder: str, workers: int = os.cpu_count() or 4, overwrite: bool = False):
+    """多进程解析目录中的所有 PDF；overwrite 为 False 时跳过已存在的文章目录"""
+    os.makedirs(result_folder, exist_ok=True)
+    jobs = [(os.path.join(pdf_folder, name), result_folder, overwrite) for name in sorted(os.listdir(pdf_folder))
+            if name.lower().endswith(".pdf")]
+    with mp.Pool(max(1, min(workers, len(jobs)))) as pool:
+        for pdf_path, fields, error in pool.imap_unordered(_extract_job, jobs):
+            if error:
+                print(f"解析 '{pdf_path}' 出错: {error}")
+            else:
+                print(f"'{pdf_path}' -> {fields['article']}（{fields['paragraphs']} 段，{fields['images']} 张图片，"
+                      f"{fields['linked']} 张找到图注）")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="用 PyMuPDF 把 PDF 解析为 clip_match_1 的文章目录")
+    parser.add_argument("pdf_folder")
+    parser.add_argument("result_folder")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--overwrite", action="store_true", help="替换已存在的同名文章目录")
+    args = parser.parse_args()
+    main(args.pdf_folder, args.result_folder, args.workers, args.overwrite)
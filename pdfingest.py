@@ -0,0 +1,162 @@
+# pdfingest.py
+"""
+PDF 处理阶段合并为一次遍历（取代 pdf_correct.py、delete_repeated.py、no_keywords.py 三次全目录扫描
+以及 AutoDL 上的解析）：
+
+1. 遍历一次源目录，把解压产生的 ".pdf1" 等后缀改回 ".pdf"；
+2. 按内容去重（dedup：大小 -> 首尾块哈希 -> 全文哈希），重复的 PDF 移到 duplicate_folder；
+3. 进程池中逐个打开 PDF：逐页取文本块，整篇都没有 "图\s*\d+" 的移到 rejected_folder，
+   有的直接写出 clip_match_1 使用的 <result>/<文章>/<文章>.txt、图片/ 和 figures.jsonl（见 pdfextract）。
+
+每个 PDF 的结果写入 result_folder 下的运行日志，重跑时跳过大小和修改时间都没变的已处理 PDF。
+"""
+from __future__ import annotations
+import multiprocessing as mp
+import os
+import re
+import shutil
+import time
+
+import fitz  # PyMuPDF
+
+from dedup import HashIndex, group_by_content, keep_order, walk_files
+from journal import Journal
+from metrics import count, observe, run
+from pdfextract import figure_number_pattern, page_blocks, write_article
+
+# 设置文件路径
+source_folder = r"D:\多模态\人工智能\CNKI-pdf"        # 下载 / 解压得到的 PDF
+result_folder = r"D:\move11\result"                  # clip_match_1 的 root_folder
+rejected_folder = r"D:\多模态\人工智能\CNKI-deleted"  # 没有图表编号的 PDF
+duplicate_folder = r"D:\多模态\人工智能\temp"         # 重复的 PDF
+
+manifest_name = "ingest_manifest.jsonl"  # 保存在 result_folder 下
+index_name = ".dedup_index.sqlite"       # 保存在 source_folder 下
+num_workers = os.cpu_count() or 4
+
+pdf_name_pattern = re.compile(r'\.pdf\d*$', re.I)
+extra_suffix = re.compile(r'\.pdf\d+$', re.I)
+FINISHED = ("extracted", "rejected", "duplicate")
+
+
+def ingest_pdf(job):
+    """子进程：取全文段落并检查图表编号，有图表编号时写出文章目录（overwrite：文章目录归本运行日志所有）"""
+    pdf_path, result_folder, article, overwrite = job
+    start = time.perf_counter()
+    try:
+        with fitz.open(pdf_path) as doc:
+            blocks, has_figure = [], False
+            for page in doc:
+                page_texts = page_blocks(page)
+                blocks.extend(page_texts)
+                if not has_figure and any('图' in t and figure_number_pattern.search(t) for _, _, t in page_texts):
+                    has_figure = True
+            if not has_figure:
+                return pdf_path, "rejected", {"pages": doc.page_count}, time.perf_counter() - start
+            fields = write_article(doc, blocks, result_folder, article, overwrite)
+            fields["pages"] = doc.page_count
+            return pdf_path, "extracted", fields, time.perf_counter() - start
+    except Exception as e:  # 损坏的 PDF
+        return pdf_path, "failed", {"error": repr(e)}, time.perf_counter() - start
+
+
+def normalize_names(stats):
+    """把 ".pdf<数字>" 改回 ".pdf"；同名文件已存在时保持原名（交给去重判断）"""
+    renamed = {}
+    for path, st in stats.items():
+        new_path = extra_suffix.sub('.pdf', path) if extra_suffix.search(path) else path
+        if new_path != path and not os.path.exists(new_path):
+            os.rename(path, new_path)
+            count("pdf_files", result="renamed")
+            print(f'Renamed "{path}" to "{new_path}"')
+        else:
+            new_path = path
+        renamed[new_path] = st
+    return renamed
+
+
+def move_relative(path, src_root, dst_root):
+    dst = os.path.join(dst_root, os.path.relpath(path, src_root))
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    shutil.move(path, dst)
+    return dst
+
+
+def article_names(paths, journal, source_folder, result_folder):
+    """
+    文章名取文件名（不含扩展名），与运行日志中的文章或 result_folder 中已有的目录（如在 AutoDL 上解析的文章）
+    重名时加序号；返回 {路径: (文章名, 文章目录是否归本运行日志所有)}
+    """
+    owned = {r["article"] for r in journal.records.values() if r.get("article")}
+    taken = owned | {entry.name for entry in os.scandir(result_folder) if entry.is_dir()}
+    names = {}
+    for path in paths:
+        record = journal.get(os.path.relpath(path, source_folder))
+        if record and record.get("article"):  # 重新处理改动过的 PDF 时沿用原来的文章名
+            names[path] = (record["article"], True)
+            continue
+        stem = name = os.path.splitext(os.path.basename(path))[0]
+        n = 1
+        while name in taken:
+            n += 1
+            name = f"{stem}_{n}"
+        taken.add(name)
+        names[path] = (name, False)
+    return names
+
+
+def ingest(source_folder=source_folder, result_folder=result_folder, rejected_folder=rejected_folder,
+           duplicate_folder=duplicate_folder, workers=num_workers):
+    os.makedirs(result_folder, exist_ok=True)
+    journal = Journal(os.path.join(result_folder, manifest_name), key="pdf")
+
+    def finished(path, st):
+        record = journal.get(os.path.relpath(path, source_folder))
+        return (record is not None and record["status"] in FINISHED
+                and (record.get("size"), record.get("mtime_ns")) == st)
+
+    # 1. 一次遍历 + 改名
+    stats = walk_files(source_folder, skip_dirs=[rejected_folder, duplicate_folder, result_folder])
+    stats = normalize_names({p: st for p, st in stats.items() if pdf_name_pattern.search(p)})
+    print(f"共找到 {len(stats)} 个 PDF 文件")
+
+    # 2. 去重：每组优先保留已经解析过的 PDF，其余移走
+    with HashIndex(os.path.join(source_folder, index_name)) as index:
+        groups = group_by_content(list(stats), index, stats=stats, quick=True)
+        for group in groups:
+            keep, *duplicates = sorted(group, key=lambda p: (not finished(p, stats[p]), keep_order(p)))
+            for path in duplicates:
+                dst = move_relative(path, source_folder, duplicate_folder)
+                index.move(path, dst)
+                count("pdf_files", result="duplicate")
+                size, mtime_ns = stats[path]
+                journal.append(os.path.relpath(path, source_folder), "duplicate", size=size, mtime_ns=mtime_ns,
+                               same_as=keep)
+                del stats[path]
+        print(f"共 {len(groups)} 组重复，移走 {sum(len(g) - 1 for g in groups)} 个 PDF")
+
+    # 3. 筛查 + 解析
+    todo = [p for p, st in stats.items() if not finished(p, st)]
+    print(f"{len(todo)} 个 PDF 待处理，跳过 {len(stats) - len(todo)} 个已处理的")
+    names = article_names(todo, journal, source_folder, result_folder)
+    jobs = [(p, result_folder, *names[p]) for p in todo]
+    with mp.Pool(max(1, min(workers, len(jobs)))) as pool:
+        for pdf_path, status, fields, seconds in pool.imap_unordered(ingest_pdf, jobs, chunksize=2):
+            observe("pdf_ingest", seconds)
+            count("pdf_files", result=status)
+            size, mtime_ns = stats[pdf_path]
+            if status == "rejected":
+                move_relative(pdf_path, source_folder, rejected_folder)
+                print(f"'{pdf_path}' 没有图表编号，已移到 '{rejected_folder}'")
+            elif status == "extracted":
+                print(f"'{pdf_path}' -> {fields['article']}（{fields['paragraphs']} 段，{fields['images']} 张图片，"
+                      f"{fields['linked']} 张找到图注）")
+            else:
+                print(f"处理 '{pdf_path}' 出错: {fields['error']}")
+            journal.append(os.path.relpath(pdf_path, source_folder), status, size=size, mtime_ns=mtime_ns,
+                           seconds=round(seconds, 3), **fields)
+    journal.close()
+
+
+if __name__ == "__main__":
+    run(ingest)
@@ -0,0 +1,158 @@
+# pdfstore.py
+"""
+内容寻址的下载仓库：文件以内容的 SHA-256 命名（<sha256>.pdf / .txt），SQLite 清单记录
+标识符（doi:… / arxiv:… / pmcid:…）到文件的映射。
+
+- 下载前先查清单，已有且文件完好的直接跳过，不发任何网络请求；
+- 未完成的下载保存在 .partial/ 下，再次下载同一地址时用 HTTP Range 续传；
+- 内容相同的文件只保存一份（不同标识符可以指向同一个文件），不会再出现按标题截断命名时的
+  互相覆盖或浏览器式的 "(1).pdf" 重复文件。
+"""
+from __future__ import annotations
+import glob
+import hashlib
+import os
+import re
+import sqlite3
+import time
+from typing import Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    key TEXT PRIMARY KEY, sha256 TEXT NOT NULL, ext TEXT, size INTEGER, source TEXT, title TEXT, added REAL
+);
+CREATE INDEX IF NOT EXISTS idx_items_sha256 ON items(sha256);
+"""
+
+MANIFEST = "manifest.sqlite"
+PARTIAL_DIR = ".partial"
+HASH_BLOCK = 1 << 20
+CHUNK_SIZE = 1 << 16
+
+
+def make_key(scheme: str, ident: str) -> str:
+    """规范化的清单键：doi 小写并去掉 doi.org 前缀，arXiv 编号去掉链接前缀和版本号，PMCID 大写"""
+    ident = ident.strip()
+    if scheme == "doi":
+        ident = re.sub(r"^(https?://(dx\.)?doi\.org/|doi:)", "", ident, flags=re.I).lower()
+    elif scheme == "arxiv":
+        ident = re.sub(r"v\d+$", "", re.sub(r"^https?://arxiv\.org/(abs|pdf)/", "", ident))
+    elif scheme == "pmcid":
+        ident = ident.upper()
+    return f"{scheme}:{ident}"
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _short_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def content_range_start(header: Optional[str]) -> Optional[int]:
+    """解析 "bytes 100-999/1000" 中的起始偏移"""
+    m = re.match(r"bytes (\d+)-", header or "")
+    return int(m.group(1)) if m else None
+
+
+class DownloadStore:
+    def __init__(self, root: str):
+        os.makedirs(os.path.join(root, PARTIAL_DIR), exist_ok=True)
+        self.root = root
+        self.db = sqlite3.connect(os.path.join(root, MANIFEST))
+        self.db.executescript(SCHEMA)
+
+    def path_for(self, sha256: str, ext: str = ".pdf") -> str:
+        return os.path.join(self.root, f"{sha256}{ext}")
+
+    def lookup(self, key: str) -> Optional[str]:
+        """已下载且文件仍在（大小一致）时返回路径；文件被删掉的记录视为未下载"""
+        row = self.db.execute("SELECT sha256, ext, size FROM items WHERE key=?", (key,)).fetchone()
+        if row is None:
+            return None
+        path = self.path_for(row[0], row[1])
+        if os.path.exists(path) and os.path.getsize(path) == row[2]:
+            return path
+        self.db.execute("DELETE FROM items WHERE key=?", (key,))
+        self.db.commit()
+        return None
+
+    def __contains__(self, key: str) -> bool:
+        return self.lookup(key) is not None
+
+    # ---------------- 部分下载 ----------------
+    def partial_path(self, key: str, url: str) -> str:
+        """同一标识符、同一下载地址对应固定的临时文件；换了地址（镜像）内容可能不同，不能接着续传"""
+        return os.path.join(self.root, PARTIAL_DIR, f"{_short_hash(key)}-{_short_hash(url)}.part")
+
+    def discard_partials(self, key: str):
+        for path in glob.glob(os.path.join(self.root, PARTIAL_DIR, f"{_short_hash(key)}-*.part")):
+            os.remove(path)
+
+    # ---------------- 入库 ----------------
+    def commit(self, key: str, tmp_path: str, sha256: Optional[str] = None, ext: str = ".pdf",
+               source: Optional[str] = None, title: Optional[str] = None) -> str:
+        """把下载完成的临时文件按内容哈希入库并记录清单，返回最终路径；内容已存在时删除临时文件"""
+        sha256 = sha256 or file_sha256(tmp_path)
+        path = self.path_for(sha256, ext)
+        size = os.path.getsize(tmp_path)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+        self.db.execute("INSERT OR REPLACE INTO items VALUES (?,?,?,?,?,?,?)",
+                        (key, sha256, ext, size, source, title, time.time()))
+        self.db.commit()
+        self.discard_partials(key)
+        return path
+
+    def put_bytes(self, key: str, data: bytes, ext: str = ".pdf", source: Optional[str] = None,
+                  title: Optional[str] = None) -> str:
+        """直接入库一段内容（如 Europe PMC 的全文文本）"""
+        tmp_path = os.path.join(self.root, PARTIAL_DIR, f"{_short_hash(key)}-bytes.part")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        return self.commit(key, tmp_path, hashlib.sha256(data).hexdigest(), ext, source, title)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def fetch(store: DownloadStore, session, key: str, url: str, ext: str = ".pdf", magic: Optional[bytes] = b"%PDF",
+          title: Optional[str] = None, timeout: float = 60) -> str:
+    """用 requests 会话下载 url 并入库（同步版本，供 arXiv 等脚本使用），支持 Range 续传；
+    magic 不为空时检查文件头，不符合时删除临时文件并抛出 ValueError"""
+    tmp_path = store.partial_path(key, url)
+    offset = os.path.getsize(tmp_path) if os.path.exists(tmp_path) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as resp:
+        if resp.status_code == 416:  # 临时文件与服务器上的文件对不上，从头下载
+            os.remove(tmp_path)
+            return fetch(store, session, key, url, ext, magic, title, timeout)
+        resp.raise_for_status()
+        if offset and (resp.status_code != 206 or content_range_start(resp.headers.get("Content-Range")) != offset):
+            offset = 0  # 服务器不支持续传，返回了完整文件
+        size = offset
+        with open(tmp_path, "ab" if offset else "wb") as f:
+            for chunk in resp.iter_content(CHUNK_SIZE):
+                if size == 0 and magic and not chunk.startswith(magic):
+                    f.close()
+                    os.remove(tmp_path)
+                    raise ValueError("返回的内容不是 PDF")
+                f.write(chunk)
+                size += len(chunk)
+    if size == 0:
+        os.remove(tmp_path)
+        raise ValueError("返回的内容为空")
+    return store.commit(key, tmp_path, ext=ext, source=url, title=title)
@@ -0,0 +1,89 @@
+# results.py
+"""
+图文匹配结果文件：每次运行写一个文件，每张图片一行，包含 top-k 段落的编号、余弦相似度与 softmax 概率。
+默认 JSONL（逐行追加，崩溃后已写入的行仍然有效）；后缀为 .parquet 时用 pyarrow 按批写入。
+ResultsWriter 也用于其他按行的结果表（如 clip_classify 的标签表），传入对应的 parquet 结构即可。
+"""
+from __future__ import annotations
+import json
+import os
+import time
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+
+def run_results_path(output_folder: str, prefix: str = "matches", fmt: str = "jsonl") -> str:
+    """按运行时间命名的结果文件路径"""
+    return os.path.join(output_folder, f"{prefix}_{time.strftime('%Y%m%d_%H%M%S')}.{fmt}")
+
+
+def match_rows(article: str, image_paths: Sequence[str], paragraphs: Sequence[str],
+               scores: np.ndarray, probs: np.ndarray, idx: np.ndarray,
+               min_score: Optional[float] = None) -> List[dict]:
+    """
+    把 [N, k] 的打分结果转成每张图片一行的记录；低于 min_score 的候选（以及 score_topk 按候选段落
+    屏蔽后的 -inf）被丢弃，text 为最佳段落的原文（没有候选时为 None）。段落编号从 1 开始，与打印输出一致。
+    """
+    keep = np.isfinite(scores) if min_score is None else scores >= min_score
+    rows = []
+    for image_path, s, p, i, k in zip(image_paths, scores, probs, idx, keep):
+        rows.append({
+            "article": article,
+            "image": image_path,
+            "paragraphs": (i[k] + 1).tolist(),
+            "scores": np.round(s[k].astype(np.float64), 4).tolist(),
+            "probs": np.round(p[k].astype(np.float64), 4).tolist(),
+            "text": paragraphs[i[k][0]] if k.any() else None,
+        })
+    return rows
+
+
+def match_schema(pa):
+    """图文匹配结果的 parquet 结构（参数为 pyarrow 模块，只在写 parquet 时才导入）"""
+    return pa.schema([
+        ("article", pa.string()), ("image", pa.string()),
+        ("paragraphs", pa.list_(pa.int32())), ("scores", pa.list_(pa.float32())),
+        ("probs", pa.list_(pa.float32())), ("text", pa.string()),
+    ])
+
+
+class ResultsWriter:
+    def __init__(self, path: str, schema: Callable = match_schema):
+        self.path = path
+        self.schema = schema
+        self.parquet = path.endswith(".parquet")
+        self.count = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if self.parquet:
+            import pyarrow  # noqa: F401  只在需要 parquet 时才依赖 pyarrow
+            self._writer = None
+        else:
+            self._f = open(path, "a", encoding="utf-8")
+
+    def write_rows(self, rows: List[dict]):
+        if not rows:
+            return
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, self.schema(pa))
+            self._writer.write_table(pa.Table.from_pylist(rows, schema=self._writer.schema))
+        else:
+            self._f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in rows))
+            self._f.flush()
+        self.count += len(rows)
+
+    def close(self):
+        if self.parquet:
+            if self._writer is not None:
+                self._writer.close()
+        else:
+            self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
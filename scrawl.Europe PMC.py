@@ -1,11 +1,12 @@
 import requests
 import xml.etree.ElementTree as ET
-import os
 import time
 
+from pdfstore import DownloadStore, make_key
+
 def search_open_access_fulltext(query, max_count=5, save_dir='epmc_articles'):
-    # 创建保存目录
-    os.makedirs(save_dir, exist_ok=True)
+    # 保存目录即下载仓库：全文以内容的 SHA-256 命名，manifest.sqlite 记录 PMCID 到文件的映射
+    store = DownloadStore(save_dir)
 
     print(f"🔍 开始搜索关键词: {query}，最多获取 {max_count} 篇文章...")
 
@@ -27,6 +28,13 @@ def search_open_access_fulltext(query, max_count=5, save_dir='epmc_articles'):
             print(f"[{i+1}]  无 PMCID，跳过：{title}")
             continue
 
+        # 已抓取过的直接跳过，不发请求
+        key = make_key("pmcid", pmcid)
+        filename = store.lookup(key)
+        if filename:
+            print(f"[{i+1}]  已存在：{filename}")
+            continue
+
         print(f"[{i+1}] 📖 正在抓取：{title}")
         fulltext_url = f"https://www.ebi.ac.uk/europepmc/webservices/rest/{pmcid}/fullTextXML"
         r = requests.get(fulltext_url)
@@ -40,11 +48,8 @@ def search_open_access_fulltext(query, max_count=5, save_dir='epmc_articles'):
             if body is not None:
                 # 提取正文纯文本
                 text_content = ''.join(body.itertext())
-                # 简化文件名
-                safe_title = ''.join(c for c in title if c.isalnum() or c in " _-")[:50]
-                filename = os.path.join(save_dir, f"{safe_title}.txt")
-                with open(filename, 'w', encoding='utf-8') as f:
-                    f.write(text_content)
+                filename = store.put_bytes(key, text_content.encode('utf-8'), ext=".txt",
+                                           source=fulltext_url, title=title)
                 print(f"   已保存为：{filename}")
             else:
                 print("   没有正文部分")
@@ -53,6 +58,7 @@ def search_open_access_fulltext(query, max_count=5, save_dir='epmc_articles'):
 
         time.sleep(1)  # 避免请求过快被限制
 
+    store.close()
     print("\n 文献抓取完成！")
 
 # 调用，前面是关键词，后面是抓取文献数量
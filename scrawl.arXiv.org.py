@@ -1,11 +1,13 @@
 import feedparser
 import requests
-import os
 import time
 
+from pdfstore import DownloadStore, fetch, make_key
+
 def download_arxiv_papers(query="bioinformatics", max_results=5, save_dir="arxiv_pdfs"):
-    # 创建保存目录
-    os.makedirs(save_dir, exist_ok=True)
+    # 保存目录即下载仓库：PDF 以内容的 SHA-256 命名，manifest.sqlite 记录 arXiv 编号到文件的映射
+    store = DownloadStore(save_dir)
+    session = requests.Session()
 
     # 构造搜索 URL（ 基于 RSS）
     feed_url = f"http://export.arxiv.org/api/query?search_query=all:{query}&start=0&max_results={max_results}"
@@ -17,28 +19,27 @@ def download_arxiv_papers(query="bioinformatics", max_results=5, save_dir="arxiv
         title = entry.title.strip().replace('\n', ' ')
         print(f"\n[{i+1}] 📄 {title}")
 
+        # 已下载过的直接跳过，不发请求
+        key = make_key("arxiv", entry.id)
+        filename = store.lookup(key)
+        if filename:
+            print(f" 已存在：{filename}")
+            continue
+
         # PDF 下载链接
         pdf_url = entry.id.replace('abs', 'pdf') + ".pdf"
 
         try:
-            # 构造保存路径
-            safe_title = ''.join(c for c in title if c.isalnum() or c in " _-")[:50]
-            filename = os.path.join(save_dir, f"{safe_title}.pdf")
-
-            # 下载 PDF
-            response = requests.get(pdf_url)
-            if response.status_code == 200:
-                with open(filename, 'wb') as f:
-                    f.write(response.content)
-                print(f" 下载成功：{filename}")
-            else:
-                print(f" 下载失败，状态码：{response.status_code}")
+            # 下载 PDF（中断的下载下次运行时续传）
+            filename = fetch(store, session, key, pdf_url, title=title)
+            print(f" 下载成功：{filename}")
 
         except Exception as e:
             print(f" 出错：{e}")
 
         time.sleep(1)  # 避免请求过快
 
+    store.close()
     print(f" 已完成下载，文件保存在文件夹：{save_dir}/")
 
 # 改query里的关键词就好
@@ -1,120 +1,60 @@
-import requests
-import re
+'''
+按 DOI 批量下载论文 PDF：读取 Excel（Web of Science 导出）中的 DOI 列表，交给 doidownload 的异步下载引擎，
+多个 SCI-Hub / libgen 镜像并行竞速，连接池复用长连接，PDF 分块写入磁盘。
+镜像按 mirrorhealth 记录的成功率和延迟排序，故障镜像自动熔断；下载失败的 DOI 写入重试队列文件，
+把 from_retry_queue 改为 True 即可只重试这些 DOI。
+PDF 以内容的 SHA-256 命名存入 save_path，manifest.sqlite 记录 DOI 到文件的映射，已下载的 DOI 不再请求，
+中断的下载下次续传。
+'''
 import os
-import urllib.request
-import openpyxl
-
-# headers 保持与服务器的会话连接
-headers = {
-    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/63.0.3239.108 Safari/537.36',
-}
-
-
-def getPaperPdf(url):
-    pattern = '/.*?\.pdf'
-    content = requests.get(url, headers=headers)
-    download_url = re.findall(pattern, content.text)
-    # print(download_url)
-    download_url[1] = "https:" + download_url[1]
-    print(download_url[1])
-    path = r"D:\move11\sci"
-    if os.path.exists(path):
-        pass
-    else:
-        os.makedirs(path)
-
-    # 使用 urllib.request 来包装请求
-    req = urllib.request.Request(download_url[1], headers=headers)
-    # 使用 urllib.request 模块中的 urlopen方法获取页面
-    u = urllib.request.urlopen(req, timeout=5)
-
-    file_name = download_url[1].split('/')[-2] + '%' + download_url[1].split('/')[-1]
-    f = open(path + '/' + file_name, 'wb')
-
-    block_sz = 8192
-    while True:
-        buffer = u.read(block_sz)
-        if not buffer:
-            break
-        f.write(buffer)
-    f.close()
-    print("Successful to download" + " " + file_name)
 
+import openpyxl
 
-#读取存放doi的excel
-wb = openpyxl.load_workbook('D:\move11\doi.xlsx')
-
-sheet1 = wb.get_sheet_by_name('Sheet1')
-
-col_range = sheet1['A']
-
-fails = []
-
-# 以下代码加入了我找的其他SCI-hub网址，不需要可以删除一些
-for col in col_range:
-    doi = col.value
-    print(doi)
-    if __name__ == '__main__':
-        sci_Hub_Url = "https://sci-hub.ren/"
-        paper_url = sci_Hub_Url + doi
-        print(paper_url)
-        nmm = 0
-        try:
-            getPaperPdf(paper_url)  # 通过文献的url下载pdf
-            continue
-        except Exception:
-            nmm = 1
-            print("Failed to get pdf 1")
-        if nmm == 1:
-            try:
-                sci_Hub_Url_2 = "https://sci-hub.se/"
-                paper_url_2 = sci_Hub_Url_2 + doi
-                getPaperPdf(paper_url_2)
-
-                continue
-            except Exception:
-                print("Failed to get pdf 2")
-        if nmm == 1:
-            try:
-                sci_Hub_Url_3 = "https://sci-hub.st/"
-                paper_url_3 = sci_Hub_Url_3 + doi
-                getPaperPdf(paper_url_3)
-                continue
-            except Exception:
-                print("Failed to get pdf 3")
-        if nmm == 1:
-            try:
-                sci_Hub_Url_4 = "https://sci-hub.shop/"
-                paper_url_4 = sci_Hub_Url_4 + doi
-                getPaperPdf(paper_url_4)
-                continue
-            except Exception:
-                print("Failed to get pdf 4")
-        if nmm == 1:
-            try:
-                sci_Hub_Url_5 = "https://sci-hub.shop/"
-                paper_url_5 = sci_Hub_Url_5 + doi
-                getPaperPdf(paper_url_5)
-                continue
-            except Exception:
-                print("Failed to get pdf 5")
-        if nmm == 1:
-            try:
-                sci_Hub_Url_7 = "https://sci-hub.do/"
-                paper_url_7 = sci_Hub_Url_7 + doi
-                getPaperPdf(paper_url_7)
-                continue
-            except Exception:
-                print("Failed to get pdf 7")
-        if nmm == 1:
-            try:
-                sci_Hub_Url_6 = "https://libgen.ggfwzs.net/"
-                paper_url_6 = sci_Hub_Url_6 + doi
-                getPaperPdf(paper_url_6)
-                continue
-            except Exception:
-                print("Failed to get pdf 6")
-                fails.append(doi)
-
-# 获取下载失败的doi
-print(fails)
+from doidownload import CONCURRENCY, MIRRORS, PER_HOST_LIMIT, RACE_WIDTH, download_all
+from metrics import run
+from mirrorhealth import MirrorRegistry, RoutedDownloader, read_retry_queue, write_retry_queue
+from pdfstore import DownloadStore
+
+# 存放 doi 的 excel（Sheet1 的 A 列）与 PDF 保存目录
+excel_path = r'D:\move11\doi.xlsx'
+sheet_name = 'Sheet1'
+save_path = r"D:\move11\sci"
+state_path = os.path.join(save_path, "mirror_state.json")  # 镜像健康状态，跨运行保存
+retry_path = os.path.join(save_path, "retry_dois.txt")     # 下载失败的 DOI，每行一个
+from_retry_queue = False  # True 时只下载重试队列中的 DOI
+
+# 以下为我找的 SCI-hub 网址，不需要可以删除一些（见 doidownload.MIRRORS）
+mirrors = MIRRORS
+
+concurrency = CONCURRENCY        # 同时下载的 DOI 数
+per_host_limit = PER_HOST_LIMIT  # 每个镜像的并发连接数
+race_width = RACE_WIDTH          # 每个 DOI 同时请求的镜像数
+
+
+def read_dois(excel_path, sheet_name):
+    wb = openpyxl.load_workbook(excel_path, read_only=True)
+    dois = [str(value).strip() for (value,) in wb[sheet_name].iter_rows(min_col=1, max_col=1, values_only=True)
+            if value and str(value).strip()]
+    wb.close()
+    return list(dict.fromkeys(dois))  # 去掉重复的 DOI
+
+
+def main():
+    dois = read_retry_queue(retry_path) if from_retry_queue else read_dois(excel_path, sheet_name)
+    print(f"共 {len(dois)} 个 DOI")
+    registry = MirrorRegistry(state_path, mirrors)
+    with DownloadStore(save_path) as store:
+        results = download_all(dois, save_path, downloader_cls=RoutedDownloader, registry=registry, store=store,
+                               mirrors=mirrors, concurrency=concurrency, per_host_limit=per_host_limit,
+                               race_width=race_width)
+
+    # 下载失败的doi写入重试队列
+    fails = write_retry_queue(retry_path, results)
+    skipped = sum(r.status == "skipped" for r in results)
+    print(f"成功 {len(results) - len(fails) - skipped} 个，已存在 {skipped} 个，失败 {len(fails)} 个，"
+          f"失败的 DOI 已写入 '{retry_path}'")
+    print(registry.summary())
+
+
+if __name__ == '__main__':
+    run(main)